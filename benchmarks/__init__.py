@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of atlas-alignment-meter on synthetic jagged volumes (not part of the installed package).
+Run from the root of the repository, with atlas-alignment-meter installed:
+    python -m benchmarks.run_benchmarks -o results.json
+    python -m benchmarks.compare baseline.json results.json
+    python -m benchmarks.startup --max-time 0.5
+"""
@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+
+
+def compareResults(baseline, candidate, threshold=1.2):
+    """
+    Compares the results of two runs of the benchmarks, on their best time.
+
+      Parameters:
+        baseline (dict): the results of the reference run, as written by run_benchmarks
+        candidate (dict): the results of the run to compare
+        threshold (float): ratio of the candidate time over the baseline time above which a benchmark is
+          considered as a regression (default: 1.2)
+
+      Returns:
+        comparisons (list). For each benchmark of both runs: its name, the baseline time, the candidate
+          time, their ratio and whether it is a regression
+    """
+    comparisons = []
+
+    for name, result in candidate["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        baseline_time = baseline["results"][name]["best"]
+        candidate_time = result["best"]
+        ratio = candidate_time / baseline_time if baseline_time > 0 else float("inf")
+        comparisons.append(
+            (name, baseline_time, candidate_time, ratio, ratio > threshold)
+        )
+
+    return comparisons
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare two results files of the benchmarks of atlas-alignment-meter"
+    )
+    parser.add_argument(
+        "baseline", metavar="<BASELINE FILE PATH>", help="The reference results"
+    )
+    parser.add_argument(
+        "candidate", metavar="<CANDIDATE FILE PATH>", help="The results to compare"
+    )
+    parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        default=1.2,
+        help="Ratio of the candidate time over the baseline time above which a benchmark is a regression (default: 1.2)",
+    )
+    return parser.parse_args(args)
+
+
+def run():
+    args = parse_args(sys.argv[1:])
+    baseline = json.load(open(args.baseline))
+    candidate = json.load(open(args.candidate))
+
+    if baseline["parameters"] != candidate["parameters"]:
+        print("Warning: the benchmarks were not run with the same parameters")
+
+    comparisons = compareResults(baseline, candidate, args.threshold)
+
+    print(f"{'benchmark':<50} {'baseline':>10} {'candidate':>10} {'ratio':>7}")
+    for name, baseline_time, candidate_time, ratio, is_regression in comparisons:
+        print(
+            f"{name:<50} {baseline_time:>9.4f}s {candidate_time:>9.4f}s {ratio:>7.2f}"
+            + ("  REGRESSION" if is_regression else "")
+        )
+
+    # a non-zero exit code, so that a regression can fail a CI job
+    if any(comparison[-1] for comparison in comparisons):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
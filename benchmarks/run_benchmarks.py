@@ -0,0 +1,338 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from atlas_alignment_meter import core
+from atlas_alignment_meter import export_volume
+from atlas_alignment_meter import labels
+from benchmarks.synthetic import SIZE_DISTRIBUTIONS, createSyntheticVolume
+
+
+def timeFunction(function, repeat):
+    """
+    Runs a function several times, silencing what it prints.
+
+      Parameters:
+        function (callable): the function to run, without arguments
+        repeat (int): number of runs
+
+      Returns:
+        times (list). The wall time of each run, in seconds
+    """
+    times = []
+
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+
+    return times
+
+
+def runBenchmarks(
+    volume,
+    thread_counts,
+    engines=core.ENGINES,
+    backends=core.BACKENDS,
+    coronal_axis_index=0,
+    repeat=3,
+):
+    """
+    Times the main steps of a run of atlas-alignment-meter on a volume: the compaction of the labels, the region
+    selection, core.compute() with each engine (and each backend and thread count, the singlepass engine being run
+    on the largest region), and the export of both validation volumes.
+
+      Parameters:
+        volume (np.ndarray): the annotation volume
+        thread_counts (list): the numbers of threads (or worker processes) to run the engines on
+        engines (list): the engines of core.compute() to time (default: all)
+        backends (list): the backends of core.compute() to time (default: all)
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+        repeat (int): number of runs of each benchmark (default: 3)
+
+      Returns:
+        results (dict). The wall times (in seconds) of each run, per benchmark name
+    """
+    results = {}
+
+    def run(name, function):
+        print(f"{name}...")
+        results[name] = timeFunction(function, repeat)
+
+    run("compactLabels", lambda: labels.compactLabels(volume))
+    compacted_labels = labels.compactLabels(volume)
+
+    run(
+        "selectRegions[LARGEST]",
+        lambda: labels.selectRegions("LARGEST,10", compacted_labels),
+    )
+    run(
+        "selectRegions[SMALLEST]",
+        lambda: labels.selectRegions("SMALLEST,10", compacted_labels),
+    )
+
+    # the largest region, which the region engine computes on a single thread
+    is_region = compacted_labels.ids != 0
+    largest_region = int(
+        compacted_labels.ids[is_region][np.argmax(compacted_labels.counts[is_region])]
+    )
+
+    for engine in engines:
+        if engine == "singlepass":
+            run(
+                "compute[singlepass]",
+                lambda: core.compute(
+                    volume, coronal_axis_index, nb_thread=1, engine=engine
+                ),
+            )
+            run(
+                "compute[singlepass,compacted]",
+                lambda: core.compute(
+                    compacted_labels, coronal_axis_index, nb_thread=1, engine=engine
+                ),
+            )
+
+            # the slabs of the volume are counted in parallel, even for a single region
+            for backend in backends:
+                for nb_thread in thread_counts:
+                    run(
+                        f"compute[singlepass,largest,{backend},{nb_thread}]",
+                        lambda: core.compute(
+                            compacted_labels,
+                            coronal_axis_index,
+                            regions=[largest_region],
+                            nb_thread=nb_thread,
+                            engine=engine,
+                            backend=backend,
+                        ),
+                    )
+            continue
+
+        for backend in backends:
+            for nb_thread in thread_counts:
+                run(
+                    f"compute[{engine},{backend},{nb_thread}]",
+                    lambda: core.compute(
+                        compacted_labels,
+                        coronal_axis_index,
+                        nb_thread=nb_thread,
+                        engine=engine,
+                        backend=backend,
+                    ),
+                )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        metrics = core.compute(
+            compacted_labels, coronal_axis_index, engine="singlepass"
+        )
+
+    # the volumes are written raw, so that the compression does not hide the time of the export itself
+    header = {"encoding": "raw"}
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, "metrics.nrrd")
+
+        for reference_volume_data, name in [
+            (volume, "volume"),
+            (compacted_labels, "compacted"),
+        ]:
+            run(
+                f"createVolumeMetricsPerRegion[{name}]",
+                lambda: export_volume.createVolumeMetricsPerRegion(
+                    metrics["perRegion"],
+                    reference_volume_data,
+                    header,
+                    filepath,
+                    "median",
+                ),
+            )
+            run(
+                f"createVolumeMetricsPerSlice[{name}]",
+                lambda: export_volume.createVolumeMetricsPerSlice(
+                    metrics["perSlice"],
+                    reference_volume_data,
+                    header,
+                    filepath,
+                    coronal_axis_index,
+                    "median",
+                ),
+            )
+
+    return results
+
+
+def _gitCommit():
+    """
+    The commit of the repository the benchmarks are run from, if any
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of atlas-alignment-meter on a synthetic jagged volume"
+    )
+
+    parser.add_argument(
+        "--output",
+        "-o",
+        dest="output",
+        required=True,
+        metavar="<FILE PATH>",
+        help="Path to the JSON file of the results (output)",
+    )
+
+    parser.add_argument(
+        "--shape",
+        dest="shape",
+        default="132,80,114",
+        help="Shape of the synthetic volume, coma-separated (default: 132,80,114, the Allen CCF at 100um)",
+    )
+
+    parser.add_argument(
+        "--regions",
+        dest="nb_regions",
+        type=int,
+        default=200,
+        help="Number of regions of the synthetic volume (default: 200)",
+    )
+
+    parser.add_argument(
+        "--size-distribution",
+        dest="size_distribution",
+        default="LOGNORMAL",
+        choices=[distribution.upper() for distribution in SIZE_DISTRIBUTIONS],
+        help="Distribution of the sizes of the regions (default: LOGNORMAL)",
+    )
+
+    parser.add_argument(
+        "--displacement",
+        dest="displacement",
+        type=float,
+        default=1.0,
+        help="Standard deviation (in voxels) of the displacement of each slice (default: 1.0)",
+    )
+
+    parser.add_argument(
+        "--axis",
+        dest="axis",
+        type=int,
+        default=0,
+        choices=[0, 1, 2],
+        help="Index of the axis orthogonal to the slices (default: 0)",
+    )
+
+    parser.add_argument(
+        "--threads",
+        dest="threads",
+        default=None,
+        help="Numbers of threads to run the region engine on, coma-separated (default: 1 and the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=3,
+        help="Number of runs of each benchmark (default: 3)",
+    )
+
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic volume (default: 0)",
+    )
+
+    return parser.parse_args(args)
+
+
+def run():
+    args = parse_args(sys.argv[1:])
+
+    shape = tuple(int(size) for size in args.shape.split(","))
+    thread_counts = sorted({1, os.cpu_count()})
+    if args.threads:
+        thread_counts = [int(nb_thread) for nb_thread in args.threads.split(",")]
+
+    parameters = {
+        "shape": shape,
+        "nbRegions": args.nb_regions,
+        "sizeDistribution": args.size_distribution.lower(),
+        "displacement": args.displacement,
+        "axis": args.axis,
+        "threads": thread_counts,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+    print("creating the synthetic volume...")
+    volume = createSyntheticVolume(
+        shape,
+        args.nb_regions,
+        args.size_distribution.lower(),
+        args.displacement,
+        args.axis,
+        args.seed,
+    )
+
+    results = runBenchmarks(
+        volume, thread_counts, coronal_axis_index=args.axis, repeat=args.repeat
+    )
+
+    report = {
+        "metadata": {
+            "commit": _gitCommit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+        },
+        "parameters": parameters,
+        "results": {
+            name: {
+                "times": times,
+                "best": min(times),
+                "median": float(np.median(times)),
+            }
+            for name, times in results.items()
+        },
+    }
+
+    results_file = open(args.output, "w")
+    results_file.write(json.dumps(report, ensure_ascii=False, indent=2))
+    results_file.close()
+
+    for name, result in report["results"].items():
+        print(f"{name:<50} {result['best']:.4f} s")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# the modules that must not be imported by the CLI before the arguments are parsed and checked
+HEAVY_MODULES = (
+    "numpy",
+    "nrrd",
+    "pkg_resources",
+    "importlib.metadata",
+    "atlas_alignment_meter.core",
+    "atlas_alignment_meter.export_volume",
+)
+
+# the command lines whose startup is timed (name: arguments of the CLI). None of them computes anything
+COMMANDS = {
+    "help": ["--help"],
+    "invalidInput": ["-i", "missing_volume.nrrd", "-o", "report.json"],
+    "invalidRegions": [
+        "-i",
+        os.path.abspath(__file__),
+        "-o",
+        "report.json",
+        "-r",
+        "1,two,3",
+    ],
+}
+
+# runs the CLI with the given arguments, then prints the heavy modules that were imported as JSON
+_SCRIPT = """
+import json
+import sys
+sys.argv = ["atlas-alignment-meter"] + json.loads(sys.argv[1])
+try:
+    from atlas_alignment_meter import main
+    main.main()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps([name for name in json.loads(%r) if name in sys.modules]))
+"""
+
+
+def timeStartup(cli_args, repeat):
+    """
+    Runs the CLI in a new Python process several times, until it exits.
+
+      Parameters:
+        cli_args (list): the arguments of the CLI
+        repeat (int): number of runs
+
+      Returns:
+        times (list). The wall time of each run, in seconds
+        imported (list). The heavy modules (see HEAVY_MODULES) imported by the CLI
+    """
+    times = []
+    script = _SCRIPT % json.dumps(HEAVY_MODULES)
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-c", script, json.dumps(cli_args)],
+            capture_output=True,
+            text=True,
+        )
+        times.append(time.perf_counter() - start)
+
+    imported = json.loads(process.stderr.strip().splitlines()[-1])
+    return times, imported
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the startup of the CLI of atlas-alignment-meter (--help and invalid arguments)"
+    )
+
+    parser.add_argument(
+        "--output",
+        "-o",
+        dest="output",
+        default=None,
+        metavar="<FILE PATH>",
+        help="Path to the JSON file of the results, that can be compared with benchmarks.compare (default: not written)",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=10,
+        help="Number of runs of each command (default: 10)",
+    )
+
+    parser.add_argument(
+        "--max-time",
+        dest="max_time",
+        type=float,
+        default=0.5,
+        help="Maximum best wall time of a command, in seconds, above which the startup is a regression (default: 0.5)",
+    )
+
+    return parser.parse_args(args)
+
+
+def run():
+    args = parse_args(sys.argv[1:])
+    results = {}
+    regressions = []
+
+    for name, cli_args in COMMANDS.items():
+        times, imported = timeStartup(cli_args, args.repeat)
+        results[name] = {"times": times, "best": min(times), "imported": imported}
+
+        if imported:
+            regressions.append(f"{name} imports {', '.join(imported)}")
+        if min(times) > args.max_time:
+            regressions.append(f"{name} takes {min(times):.3f}s")
+
+    for name, result in results.items():
+        print(f"{name:<50} {result['best']:.4f} s")
+
+    if args.output:
+        report = {
+            "metadata": {
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+            },
+            "parameters": {"repeat": args.repeat},
+            "results": results,
+        }
+
+        results_file = open(args.output, "w")
+        results_file.write(json.dumps(report, ensure_ascii=False, indent=2))
+        results_file.close()
+
+    # a non-zero exit code, so that a regression can fail a CI job
+    if regressions:
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,101 @@
+import numpy as np
+
+# the distributions of region sizes createSyntheticVolume() can generate
+SIZE_DISTRIBUTIONS = ("equal", "uniform", "lognormal")
+
+# Allen annotation ids go up to ~600 millions, the synthetic ids are drawn below that
+_MAX_REGION_ID = 600000000
+
+# number of Voronoi cells the regions are made of, on average
+_NB_CELLS_PER_REGION = 4
+
+
+def createSyntheticVolume(
+    shape=(132, 80, 114),
+    nb_regions=50,
+    size_distribution="lognormal",
+    displacement=1.0,
+    coronal_axis_index=0,
+    seed=0,
+):
+    """
+    Creates a synthetic parcellation volume, made of regions inside an ellipsoid "brain" surrounded by no_data (0).
+    The ellipsoid is cut into small Voronoi cells, which are then distributed among the regions so that the sizes of the
+    regions follow the given distribution (a region can be made of several blobs, like the bilateral regions of an
+    atlas), and each slice is then shifted by a random displacement in its plane, to make the volume jagged
+    (as if it had been reconstructed from mechanically cut slices).
+
+      Parameters:
+        shape (tuple): shape of the volume (default: (132, 80, 114), the Allen CCF at 100um)
+        nb_regions (int): number of regions (default: 50)
+        size_distribution (string): distribution of the region sizes: "equal", "uniform" or "lognormal", the latter
+          giving a few large regions and many small ones, like an annotation atlas (default: "lognormal")
+        displacement (float): standard deviation (in voxels) of the displacement of each slice. 0 gives a smooth volume (default: 1.0)
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+        seed (int): seed of the random generator, the same seed giving the same volume (default: 0)
+
+      Returns:
+        volume (np.ndarray). uint32 volume of sparse region ids, in Fortran order like the volumes given by nrrd.read()
+    """
+    if size_distribution not in SIZE_DISTRIBUTIONS:
+        raise Exception(f"The size distribution must be one of {SIZE_DISTRIBUTIONS}")
+
+    rng = np.random.default_rng(seed)
+
+    region_ids = rng.choice(_MAX_REGION_ID, size=nb_regions, replace=False) + 1
+
+    # the slices are generated in a volume whose first axis is the coronal axis, then moved into place
+    coronal_shape = list(shape)
+    coronal_shape.insert(0, coronal_shape.pop(coronal_axis_index))
+    radii = np.array(coronal_shape) / 2
+
+    # the centers of the cells are drawn uniformly inside the ellipsoid
+    nb_cells = nb_regions * _NB_CELLS_PER_REGION
+    centers = np.zeros((0, 3))
+    while len(centers) < nb_cells:
+        points = rng.uniform(-1, 1, (2 * nb_cells, 3))
+        centers = np.concatenate([centers, points[(points**2).sum(axis=1) <= 1]])
+    centers = (centers[:nb_cells] * radii + radii).astype(np.float32)
+
+    # each region gets one cell, the others are drawn with a probability proportional to the size of the regions
+    if size_distribution == "equal":
+        sizes = np.ones(nb_regions)
+    elif size_distribution == "uniform":
+        sizes = rng.uniform(0, 1, nb_regions)
+    else:
+        sizes = rng.lognormal(0, 1, nb_regions)
+
+    region_per_cell = np.concatenate(
+        [
+            np.arange(nb_regions),
+            rng.choice(nb_regions, size=nb_cells - nb_regions, p=sizes / sizes.sum()),
+        ]
+    )
+    if size_distribution == "equal":
+        region_per_cell = np.arange(nb_cells) % nb_regions
+    id_per_cell = region_ids[region_per_cell]
+
+    volume = np.zeros(coronal_shape, dtype=np.uint32)
+    grid = np.stack(
+        np.meshgrid(
+            np.arange(coronal_shape[1]), np.arange(coronal_shape[2]), indexing="ij"
+        ),
+        axis=-1,
+    )
+    for slice_index in range(coronal_shape[0]):
+        position = np.concatenate(
+            [np.full(grid.shape[:2] + (1,), slice_index), grid], axis=-1
+        ).astype(np.float32)
+
+        # the closest cell of each voxel of the slice. The squared distance to a center c is |p|^2 - 2 p.c + |c|^2,
+        # in which |p|^2 is the same for all the cells
+        distances = (centers**2).sum(axis=1) - 2 * position @ centers.T
+        labels = id_per_cell[np.argmin(distances, axis=-1)]
+
+        inside = (((position + 0.5 - radii) / radii) ** 2).sum(axis=-1) <= 1
+        labels[~inside] = 0
+
+        shift = np.rint(rng.normal(0, displacement, 2)).astype(int)
+        volume[slice_index] = np.roll(labels, shift, axis=(0, 1))
+
+    return np.asfortranarray(np.moveaxis(volume, 0, coronal_axis_index))
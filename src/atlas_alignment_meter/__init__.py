@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
-from pkg_resources import DistributionNotFound, get_distribution
-
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = "atlas-alignment-meter"
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
-    __version__ = "unknown"
-finally:
-    del get_distribution, DistributionNotFound
+
+# Change here if project is renamed and does not equal the package name
+dist_name = "atlas-alignment-meter"
+
+
+def __getattr__(name):
+    # the version is only read when asked, since importlib.metadata is slow to import and the CLI rarely needs it
+    if name == "__version__":
+        from importlib.metadata import PackageNotFoundError, version
+
+        try:
+            return version(dist_name)
+        except PackageNotFoundError:
+            return "unknown"
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
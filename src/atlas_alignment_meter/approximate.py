@@ -0,0 +1,354 @@
+import numpy as np
+from atlas_alignment_meter import core
+from atlas_alignment_meter.labels import CompactedLabels, indicesOf
+from atlas_alignment_meter.profiling import timePhase
+
+# number of groups of regions of similar sizes the regions are sampled from by sampleRegions()
+NB_STRATA = 4
+
+# default number of bootstrap resamples of the sampled slices
+DEFAULT_NB_BOOTSTRAP = 1000
+
+
+def sampleSlices(nb_slices, fraction, rng):
+    """
+    Samples the ratios (slice pairs) a jaggedness estimate is computed on. The ratios that can be non-zero (all but
+    the first and last ones, see core.threadedProcess()) are cut into as many consecutive groups as ratios to
+    sample, and one ratio is picked at random in each group, so that the sample is spread along the whole axis.
+
+      Parameters:
+        nb_slices (int): the number of slices of the volume
+        fraction (float): the fraction of the ratios to sample, in ]0, 1]
+        rng (np.random.Generator): the random generator
+
+      Returns:
+        slices (np.ndarray). The sorted indices of the sampled ratios, the ratio i being measured between the slice i
+          and the slice i+1
+    """
+    candidates = np.arange(1, nb_slices - 1)
+
+    if len(candidates) == 0:
+        return candidates
+
+    nb_samples = min(len(candidates), max(1, int(round(fraction * len(candidates)))))
+    groups = np.array_split(candidates, nb_samples)
+    return np.array([rng.choice(group) for group in groups], dtype=np.int64)
+
+
+def sampleRegions(region_ids, voxel_counts, fraction, rng, nb_strata=NB_STRATA):
+    """
+    Samples regions stratified by size: the regions are sorted by voxel count and cut into nb_strata groups of
+    regions of similar sizes, and the same fraction of each group is picked at random (at least one region per
+    group), so that both the small and the large regions are in the sample.
+
+      Parameters:
+        region_ids (np.ndarray): the ids of the regions to sample from
+        voxel_counts (np.ndarray): the number of voxels of each region of region_ids
+        fraction (float): the fraction of the regions to sample, in ]0, 1]
+        rng (np.random.Generator): the random generator
+        nb_strata (int): number of groups of regions of similar sizes (default: NB_STRATA)
+
+      Returns:
+        region_ids (np.ndarray). The sorted ids of the sampled regions
+    """
+    region_ids = np.asarray(region_ids)
+
+    if fraction >= 1 or len(region_ids) == 0:
+        return np.sort(region_ids)
+
+    by_size = region_ids[np.argsort(voxel_counts, kind="stable")]
+    sampled = []
+
+    for group in np.array_split(by_size, min(nb_strata, len(by_size))):
+        nb_samples = max(1, int(round(fraction * len(group))))
+        sampled.append(rng.choice(group, nb_samples, replace=False))
+
+    return np.sort(np.concatenate(sampled))
+
+
+def sampledRatios(volume, slices, coronal_axis_index=0, regions=None):
+    """
+    Computes the ratios of the regions on some slices only, reading only the two slices each ratio is measured on.
+    The ratios are the same as the ones computed by core.compute() on these slices.
+
+      Parameters:
+        volume (array-like): the annotation volume containing region labels (integers), or the index volume of
+          compacted labels. It can be a volume that is not in memory (see core.isOutOfCore())
+        slices (np.ndarray): the sorted indices of the ratios to compute, as given by sampleSlices()
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+        regions (np.ndarray): the labels of the regions to compute the ratios of (default: None, all the labels met
+          on the slices but the no_data part)
+
+      Returns:
+        labels (np.ndarray). The sorted labels of the regions found on the slices
+        ratios (np.ndarray). (nb_labels, nb_sampled_slices) array of ratios
+        voxel_counts (np.ndarray). The number of voxels of each label on the slices
+    """
+    ratios_per_slice = []
+
+    for i in slices.tolist():
+        crop = [slice(None)] * len(volume.shape)
+        crop[coronal_axis_index] = slice(i, i + 2)
+        slab = np.asarray(volume[tuple(crop)])
+
+        slab_labels = np.unique(slab)
+        if regions is None:
+            slab_labels = slab_labels[slab_labels != 0]
+        else:
+            slab_labels = slab_labels[np.isin(slab_labels, regions)]
+
+        # with an empty slice before the slab, so that computeRatiosFromCounts() only keeps the ratio of the
+        # first slice of the slab (see incremental.updateRatios())
+        presence = np.zeros((len(slab_labels), 3), dtype=np.int64)
+        same = np.zeros_like(presence)
+        core.accumulatePairCounts(
+            slab,
+            slab_labels,
+            presence[:, 1:],
+            same[:, 1:],
+            coronal_axis_index=coronal_axis_index,
+        )
+        ratios = core.computeRatiosFromCounts(presence, same)[:, 1]
+        ratios_per_slice.append((slab_labels, ratios, presence[:, 1]))
+
+    labels = np.unique(
+        np.concatenate(
+            [slab_labels for slab_labels, _, _ in ratios_per_slice]
+            + [np.zeros(0, dtype=volume.dtype)]
+        )
+    )
+    ratios = np.zeros((len(labels), len(slices)))
+    voxel_counts = np.zeros(len(labels), dtype=np.int64)
+
+    for column, (slab_labels, slab_ratios, slab_counts) in enumerate(ratios_per_slice):
+        rows = np.searchsorted(labels, slab_labels)
+        ratios[rows, column] = slab_ratios
+        voxel_counts[rows] += slab_counts
+
+    return labels, ratios, voxel_counts
+
+
+def _weightedMedians(values, columns, weights):
+    """
+    Computes the median of the values repeated as many times as the weight of their column, for each set of weights,
+    as np.median() would on the repeated values. values must be sorted.
+    """
+    medians = np.full(len(weights), np.nan)
+
+    for b, column_weights in enumerate(weights):
+        cumulated = np.cumsum(column_weights[columns])
+        nb_values = cumulated[-1] if len(cumulated) else 0
+
+        if nb_values == 0:
+            continue
+
+        lower = np.searchsorted(cumulated, (nb_values - 1) // 2, side="right")
+        upper = np.searchsorted(cumulated, nb_values // 2, side="right")
+        medians[b] = (values[lower] + values[upper]) / 2
+
+    return medians
+
+
+def _interval(estimates, confidence):
+    """
+    The percentile interval of bootstrap estimates, or None if there are none
+    """
+    estimates = estimates[~np.isnan(estimates)]
+
+    if len(estimates) == 0:
+        return None
+
+    tail = 100 * (1 - confidence) / 2
+    return np.percentile(estimates, [tail, 100 - tail]).tolist()
+
+
+def bootstrapIntervals(
+    ratios, nb_bootstrap=DEFAULT_NB_BOOTSTRAP, confidence=0.95, rng=None
+):
+    """
+    Computes bootstrap confidence intervals of the global mean and median of the non-zero ratios, and of the mean of
+    each region. The sampled slices are resampled with replacement (and not the ratios themselves, since the ratios of
+    the regions of a same slice are not independent).
+
+      Parameters:
+        ratios (np.ndarray): (nb_regions, nb_sampled_slices) array of the ratios on the sampled slices
+        nb_bootstrap (int): number of bootstrap resamples (default: DEFAULT_NB_BOOTSTRAP)
+        confidence (float): the confidence level of the intervals (default: 0.95)
+        rng (np.random.Generator): the random generator (default: None, a new one)
+
+      Returns:
+        intervals (dict). The [low, high] intervals of the global "mean" and "median", and of the "mean" of each
+          region ("perRegionMean", one per row of ratios, None for a region without non-zero ratios)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    nb_regions, nb_slices = ratios.shape
+    is_non_zero = ratios > 0
+
+    # the number of times each sampled slice is in each resample
+    resamples = rng.integers(0, nb_slices, size=(nb_bootstrap, nb_slices))
+    weights = np.zeros((nb_bootstrap, nb_slices))
+    np.add.at(weights, (np.arange(nb_bootstrap)[:, None], resamples), 1)
+
+    sums = ratios @ weights.T
+    counts = is_non_zero.astype(float) @ weights.T
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        region_means = sums / counts
+        global_means = sums.sum(axis=0) / counts.sum(axis=0)
+
+    rows, columns = np.nonzero(is_non_zero)
+    order = np.argsort(ratios[rows, columns], kind="stable")
+    global_medians = _weightedMedians(
+        ratios[rows, columns][order], columns[order], weights
+    )
+
+    return {
+        "mean": _interval(global_means, confidence),
+        "median": _interval(global_medians, confidence),
+        "perRegionMean": [
+            _interval(region_means[row], confidence) for row in range(nb_regions)
+        ],
+    }
+
+
+def computeApproximate(
+    volume,
+    coronal_axis_index=0,
+    regions=None,
+    slice_fraction=0.1,
+    region_fraction=1.0,
+    nb_bootstrap=DEFAULT_NB_BOOTSTRAP,
+    confidence=0.95,
+    seed=None,
+    label_index=None,
+    timings=None,
+):
+    """
+    Compute an estimate of the metrics of the jaggedness from a sample of the ratios (slice pairs) and of the
+    regions, with bootstrap confidence intervals. Only the two slices of each sampled ratio are read, so that the
+    run time is proportional to the size of the sample. The metrics are computed as by core.compute(), on the sampled
+    ratios only (the slices that are not sampled have no per-slice metrics). With slice_fraction and region_fraction
+    of 1, the per-region and per-slice metrics are those of core.compute().
+
+      Parameters:
+        volume (array-like or CompactedLabels): the annotation volume, or its compacted labels as given by
+          labels.compactLabels(). It can be a volume that is not in memory (see core.isOutOfCore())
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+        regions (list): list of region ids (integers) to sample the regions from (default: None, all the regions)
+        slice_fraction (float): the fraction of the ratios to sample, in ]0, 1] (default: 0.1)
+        region_fraction (float): the fraction of the regions to sample, in ]0, 1], stratified by size (default: 1.0)
+        nb_bootstrap (int): number of bootstrap resamples of the sampled slices (default: DEFAULT_NB_BOOTSTRAP)
+        confidence (float): the confidence level of the intervals (default: 0.95)
+        seed (int): seed of the random sampling, for a reproducible estimate (default: None)
+        label_index (LabelIndex): the label index of the volume, for the sizes of the regions the sample is stratified
+          by. If not provided, the sizes of the regions on the sampled slices are used (default: None)
+        timings (dict): OUTPUT. if provided, the wall time of each phase of the computation is added to it, see
+          core.compute() (default: None, nothing is measured)
+
+      Returns:
+        metrics (dict). Metrics per slice, per region and global as given by core.compute(), and an "approximate" entry with the sample, the global "mean" and "median" of the sampled ratios
+          and their confidence intervals ("meanInterval", "medianInterval"), and the confidence interval of the mean
+          of each region ("perRegion"). None if there are no regions in the sample
+    """
+    for name, fraction in [
+        ("slice_fraction", slice_fraction),
+        ("region_fraction", region_fraction),
+    ]:
+        if not 0 < fraction <= 1:
+            raise Exception(f"{name} must be in ]0, 1], not {fraction}")
+
+    rng = np.random.default_rng(seed)
+    compacted_labels = None
+
+    if isinstance(volume, CompactedLabels):
+        compacted_labels = volume
+        volume = compacted_labels.indices
+        if label_index is None:
+            label_index = compacted_labels
+
+    nb_slices = volume.shape[coronal_axis_index]
+
+    # the regions are sampled from the label census when there is one, otherwise from the sampled slices
+    region_ids = None
+    if label_index is not None:
+        is_candidate = label_index.ids != 0
+        if regions:
+            is_candidate &= np.isin(label_index.ids, regions)
+
+        region_ids = sampleRegions(
+            label_index.ids[is_candidate],
+            label_index.counts[is_candidate],
+            region_fraction,
+            rng,
+        )
+
+    elif regions:
+        region_ids = np.unique(np.asarray(regions, dtype=volume.dtype))
+
+    slices = sampleSlices(nb_slices, slice_fraction, rng)
+    print(f"computing on a sample of {len(slices)} of the {nb_slices} slices...")
+
+    with timePhase(timings, "sample"):
+        region_labels = region_ids
+        if compacted_labels is not None and region_ids is not None:
+            region_labels = indicesOf(compacted_labels, region_ids)
+
+        labels, sampled_ratios, voxel_counts = sampledRatios(
+            volume, slices, coronal_axis_index, region_labels
+        )
+
+        if compacted_labels is not None:
+            labels = compacted_labels.ids[labels]
+
+        if label_index is None:
+            sample = np.isin(
+                labels, sampleRegions(labels, voxel_counts, region_fraction, rng)
+            )
+            labels = labels[sample]
+            sampled_ratios = sampled_ratios[sample]
+
+    if len(labels) == 0:
+        return None
+
+    report = {
+        "perRegion": {},
+        "perSlice": {},
+        "global": {},
+    }
+
+    with timePhase(timings, "aggregation"):
+        # the ratios of the slices that are not sampled are 0, which the metrics ignore
+        ratios = np.zeros((len(labels), nb_slices))
+        ratios[:, slices] = sampled_ratios
+
+        for id, region_ratios in zip(labels.tolist(), ratios):
+            report["perRegion"][int(id)] = core.computeRegionStats(region_ratios)
+
+        core.aggregateReport(report, ratios.T)
+
+    with timePhase(timings, "bootstrap"):
+        intervals = bootstrapIntervals(sampled_ratios, nb_bootstrap, confidence, rng)
+
+    non_zero_only = sampled_ratios[sampled_ratios > 0]
+    report["approximate"] = {
+        "sliceFraction": slice_fraction,
+        "regionFraction": region_fraction,
+        "nbSampledSlices": len(slices),
+        "nbSampledRegions": len(labels),
+        "nbBootstrap": nb_bootstrap,
+        "confidence": confidence,
+        "global": {
+            "mean": float(np.mean(non_zero_only)) if len(non_zero_only) else None,
+            "meanInterval": intervals["mean"],
+            "median": float(np.median(non_zero_only)) if len(non_zero_only) else None,
+            "medianInterval": intervals["median"],
+        },
+        "perRegion": {
+            int(id): {"meanInterval": interval}
+            for id, interval in zip(labels.tolist(), intervals["perRegionMean"])
+        },
+    }
+
+    return report
@@ -0,0 +1,238 @@
+import csv
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from atlas_alignment_meter import core
+from atlas_alignment_meter import labels
+from atlas_alignment_meter import load_volume
+from atlas_alignment_meter import report_file
+
+# default number of volumes loaded ahead of the one being computed
+DEFAULT_PREFETCH = 2
+
+# the columns of the summary table. The pooled scores are computed over the non-zero ratios of all the regions pooled
+# together (see pooledScores()): they are not the "global" section of the reports, which is None unless the last slice
+# has non-zero ratios
+SUMMARY_COLUMNS = [
+    "volume",
+    "report",
+    "nbRegions",
+    "pooledMean",
+    "pooledMedian",
+    "pooledStd",
+    "pooledMin",
+    "pooledMax",
+    "loadTime",
+    "computeTime",
+    "error",
+]
+
+
+def pooledScores(ratios_per_region):
+    """
+    Computes the metrics of a volume over the non-zero ratios of all its regions pooled together, so that the volumes
+    of a batch can be ranked by a single score. They are computed as the "global" section of a report, but unlike it,
+    they are always given: the report only gives its "global" metrics when the last slice has non-zero ratios, which
+    is seldom the case of an annotation volume.
+
+      Parameters:
+        ratios_per_region (dict): the ratios for each slice of each region (key: region id), as filled by core.compute()
+
+      Returns:
+        scores (dict). The "pooledMean", "pooledMedian", "pooledStd", "pooledMin" and "pooledMax" of the non-zero
+          ratios (None if there are none)
+    """
+    ratios = np.concatenate(
+        [np.ravel(ratios) for ratios in ratios_per_region.values()] or [[]]
+    )
+    non_zero_only = ratios[ratios > 0]
+
+    if len(non_zero_only) == 0:
+        return dict.fromkeys(
+            ["pooledMean", "pooledMedian", "pooledStd", "pooledMin", "pooledMax"]
+        )
+
+    return {
+        "pooledMean": float(np.mean(non_zero_only)),
+        "pooledMedian": float(np.median(non_zero_only)),
+        "pooledStd": float(np.std(non_zero_only)),
+        "pooledMin": float(np.min(non_zero_only)),
+        "pooledMax": float(np.max(non_zero_only)),
+    }
+
+
+def iterateVolumes(volume_filepaths, prefetch=DEFAULT_PREFETCH, mmap="auto"):
+    """
+    Yields the compacted labels of each volume (see labels.compactLabels()), the volumes being loaded and compacted
+    on a background thread, ahead of the one being used, so that the decoding of the next volumes overlaps with the
+    computation on the current one. At most prefetch volumes are waiting to be used at once, which bounds the memory.
+
+      Parameters:
+        volume_filepaths (list): the paths to the NRRD files of the volumes
+        prefetch (int): the number of volumes loaded ahead (default: 2)
+        mmap (string or bool): whether to memory-map the NRRD files, see load_volume.loadVolume() (default: "auto")
+
+      Yields:
+        volume_filepath (string). The path to the NRRD file of the volume
+        compacted_labels (CompactedLabels). The compacted labels of the volume, None if it could not be loaded
+        load_time (float). The wall time of the loading and of the compaction of the volume, in seconds
+        error (Exception). The error raised while loading the volume, None if it was loaded
+    """
+    loaded = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(item):
+        # waits for room in the queue, unless the volumes are no longer used
+        while not stop.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def load():
+        for volume_filepath in volume_filepaths:
+            start = time.perf_counter()
+
+            # only the compacted labels are kept, the volume itself is released once compacted
+            try:
+                volume, header = load_volume.loadVolume(volume_filepath, mmap)
+                item = (volume_filepath, labels.compactLabels(volume), None)
+            except Exception as e:
+                item = (volume_filepath, None, e)
+            finally:
+                volume = None
+
+            if not put(item + (time.perf_counter() - start,)):
+                return
+
+        put(None)
+
+    loader = threading.Thread(target=load, daemon=True)
+    loader.start()
+
+    try:
+        while True:
+            item = loaded.get()
+
+            if item is None:
+                return
+
+            volume_filepath, compacted_labels, error, load_time = item
+            yield volume_filepath, compacted_labels, load_time, error
+    finally:
+        stop.set()
+        loader.join()
+
+
+def computeBatch(
+    volume_filepaths,
+    report_dir,
+    regions_spec=None,
+    coronal_axis_index=0,
+    nb_thread=os.cpu_count() - 1,
+    engine="singlepass",
+    max_memory=None,
+    prefetch=DEFAULT_PREFETCH,
+    report_extension=".json",
+    mmap="auto",
+):
+    """
+    Computes the metrics of many volumes in a single process, writing one report per volume into report_dir (see
+    report_file.reportFilepath()). The volumes are loaded ahead on a background thread (see iterateVolumes()), and computed one
+    after the other on a single pool of nb_thread threads kept alive for the whole batch. A volume that can not be
+    loaded or computed does not stop the batch, its error is given in the summary instead.
+
+      Parameters:
+        volume_filepaths (list): the paths to the NRRD files of the volumes
+        report_dir (string): path to the folder of the reports, which must exist
+        regions_spec (string): the regions to compute the metrics on, as given with --regions (ex. "68,656" or
+          "LARGEST,10", see labels.selectRegions()) (default: None, all the regions of each volume)
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+        nb_thread (int): number of threads of the pool (default: number of threads available - 1)
+        engine (string): the engine of core.compute() (default: "singlepass", which uses all the threads even on a single region)
+        max_memory (int): memory budget of the computation of each volume in bytes, see core.compute() (default: None)
+        prefetch (int): the number of volumes loaded ahead, see iterateVolumes() (default: 2)
+        report_extension (string): ".json" or ".npz", the format of the reports (default: ".json")
+        mmap (string or bool): whether to memory-map the NRRD files, see load_volume.loadVolume() (default: "auto")
+
+      Returns:
+        summary (list). One row per volume (dict, with the keys of SUMMARY_COLUMNS), in the order of the volumes
+    """
+    nb_thread = max(1, nb_thread)
+    summary = []
+
+    with ThreadPoolExecutor(max_workers=nb_thread) as executor:
+        for volume_filepath, compacted_labels, load_time, error in iterateVolumes(
+            volume_filepaths, prefetch, mmap
+        ):
+            row = dict.fromkeys(SUMMARY_COLUMNS)
+            row.update({"volume": volume_filepath, "loadTime": load_time})
+            summary.append(row)
+            print(f"[{len(summary)}/{len(volume_filepaths)}] {volume_filepath}")
+
+            if error is not None:
+                print(f"Warning: {volume_filepath} could not be loaded ({error})")
+                row["error"] = str(error)
+                continue
+
+            start = time.perf_counter()
+
+            try:
+                regions = None
+                if regions_spec:
+                    regions = labels.selectRegions(regions_spec, compacted_labels)
+
+                ratios_per_region = {}
+                metrics = core.compute(
+                    compacted_labels,
+                    coronal_axis_index=coronal_axis_index,
+                    regions=regions,
+                    nb_thread=nb_thread,
+                    engine=engine,
+                    max_memory=max_memory,
+                    ratios_per_region=ratios_per_region,
+                    executor=executor,
+                )
+            except Exception as e:
+                print(
+                    f"Warning: the metrics of {volume_filepath} could not be computed ({e})"
+                )
+                row["error"] = str(e)
+                continue
+            finally:
+                row["computeTime"] = time.perf_counter() - start
+
+            if metrics is not None:
+                row["nbRegions"] = len(metrics["perRegion"])
+                row.update(
+                    pooledScores(
+                        {id: ratios_per_region[id] for id in metrics["perRegion"]}
+                    )
+                )
+
+            row["report"] = report_file.reportFilepath(
+                report_dir, volume_filepath, report_extension
+            )
+            report_file.writeReport(metrics, row["report"])
+
+    return summary
+
+
+def writeSummary(summary, filepath):
+    """
+    Writes the summary of a batch as a CSV table, with one row per volume and the columns of SUMMARY_COLUMNS.
+
+      Parameters:
+        summary (list): the rows, as given by computeBatch()
+        filepath (string): path to the CSV file
+    """
+    with open(filepath, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(summary)
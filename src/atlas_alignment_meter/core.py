@@ -1,12 +1,57 @@
 import numpy as np
 import threading
+import queue
+import time
 import os
+import warnings
+from atlas_alignment_meter.labels import (
+    CHUNK_NB_VOXELS,
+    CompactedLabels,
+    chunkAxis,
+    indicesOf,
+    iterateChunks,
+    lookupIndices,
+)
+from atlas_alignment_meter.load_volume import iterateArraySlabs
+from atlas_alignment_meter.profiling import timePhase
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+from multiprocessing import shared_memory
+
+# bytes allocated by threadedProcess() per voxel of the sub-volume of a region: at most the int8 mask,
+# its rolled copy, their difference, its absolute value and the boolean copy made by np.count_nonzero() at once
+_REGION_BYTES_PER_VOXEL = 5
+
+# bytes allocated by accumulatePairCounts() per voxel of a chunk: the int64 indices and the temporaries
+# of the counts (measured on the raw volume, the index volume of compacted labels needing about a third)
+_SINGLE_PASS_BYTES_PER_VOXEL = 72
+
+# the ways compute() can obtain the metrics (see compute())
+ENGINES = ("region", "singlepass")
+
+# the ways compute() can run the engines in parallel (see compute())
+BACKENDS = ("thread", "process")
+
+# version of the computation of the ratios of a region, to change whenever the ratios change,
+# so that the ratios computed by a previous version are not reused (see result_cache)
+RATIOS_VERSION = 1
+
+# the annotation volume of a worker process of processPoolProcess() or slabPoolProcess(), set by _initProcessWorker()
+_worker_volume = None
+_worker_shared_memory = None
 
 # import nrrd
 
 
 def threadedProcess(
-    volume, id, list_of_ratios_per_region, report, coronal_axis_index, per_slice_axis
+    volume,
+    id,
+    list_of_ratios_per_region,
+    report,
+    coronal_axis_index,
+    per_slice_axis,
+    bounding_box=None,
+    label=None,
 ):
     """
     Should not be ran manually (ran by the compute() method)
@@ -22,17 +67,37 @@ def threadedProcess(
             report (dict): OUTPUT. This function adds in the "perRegion" metrics entry for this particular region
             coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name). (default: 0)
             per_slice_axis (tuple): thetwo axis that represent the slice plane orthogonal to coronal_axis_index
+            bounding_box (np.ndarray): (3, 2) array of the start (inclusive) and stop (exclusive) indices of the region
+                along each axis, as given by computeRegionCensus(). If provided, the metrics are computed on the
+                sub-volume of the region only (default: None)
+            label (int): value of the region in the volume, if it is not its id, such as its index in the index
+                volume of compacted labels (default: None, the id)
     """
     # we don't process the no_data part
     if id == 0:
         return
 
+    if label is None:
+        label = id
+
     # print("region id: ", id , f" ({counter + 1}/{nb_regions})")
     # print("region id: ", id)
 
+    nb_slices = volume.shape[coronal_axis_index]
+    slice_range = slice(0, nb_slices)
+
+    if bounding_box is not None:
+        # working on the sub-volume of the region only. It is padded with one slice before and after
+        # along the coronal axis so that the transitions into and out of the region are still measured
+        crop = [slice(start, stop) for start, stop in bounding_box]
+        start, stop = bounding_box[coronal_axis_index]
+        slice_range = slice(max(0, start - 1), min(nb_slices, stop + 1))
+        crop[coronal_axis_index] = slice_range
+        volume = volume[tuple(crop)]
+
     # creating the volumetric mask for this region
     region_mask = np.zeros_like(volume, dtype=np.int8)
-    region_mask[volume == id] = 1
+    region_mask[volume == label] = 1
     # nrrd.write(f'region_mask_{id}.nrrd', region_mask)
 
     # creating a rolled mask so that each slice in the rolled_region_mask is the same
@@ -54,10 +119,11 @@ def threadedProcess(
     sum_non_zero = (
         region_mask_per_slice_non_zero + rolled_region_mask_per_slice_non_zero
     )
-    diff_ratios_per_slice = np.divide(
+    diff_ratios_per_slice = np.zeros(nb_slices, dtype=float)
+    np.divide(
         diff_per_slice_non_zero,
         sum_non_zero,
-        out=np.zeros_like(diff_per_slice_non_zero, dtype=float),
+        out=diff_ratios_per_slice[slice_range],
         where=sum_non_zero != 0,
     )
 
@@ -69,46 +135,1174 @@ def threadedProcess(
     diff_ratios_per_slice[0] = 0
     diff_ratios_per_slice[-1] = 0
 
-    non_zero_only = diff_ratios_per_slice[diff_ratios_per_slice > 0]
     list_of_ratios_per_region.append(diff_ratios_per_slice)
+    report["perRegion"][int(id)] = computeRegionStats(diff_ratios_per_slice)
 
-    report["perRegion"][int(id)] = {
-        # "diffRatios": diff_ratios_per_slice.tolist(),
+
+def computeRegionStats(diff_ratios_per_slice):
+    """
+    Computes the per-region metrics from the ratios of a region (one ratio per slice).
+
+        Parameters:
+            diff_ratios_per_slice (np.ndarray): the ratios of a region, one per slice. The zeros are not considered.
+
+        Returns:
+            metrics (dict). The "mean", "std" and "median" of the non-zero ratios (None if there are none)
+    """
+    non_zero_only = diff_ratios_per_slice[diff_ratios_per_slice > 0]
+
+    return {
+        # the ratios themselves are added to the report over the span of the region only (see region_ratios)
         "mean": float(np.mean(non_zero_only)) if len(non_zero_only) > 0 else None,
         "std": float(np.std(non_zero_only)) if len(non_zero_only) > 0 else None,
         "median": float(np.median(non_zero_only)) if len(non_zero_only) > 0 else None,
     }
 
 
+def computeRegionCensus(volume, region_ids):
+    """
+    Computes the number of voxels and the bounding box of each region, in a single pass over the volume.
+
+        Parameters:
+            volume (np.ndarray): annotation volume containing region labels (integers)
+            region_ids (np.ndarray): sorted array of the region ids to compute the census of
+
+        Returns:
+            voxel_counts (np.ndarray). The number of voxels of each region
+            bounding_boxes (np.ndarray). (nb_regions, 3, 2) array of the start (inclusive) and stop (exclusive)
+                indices of each region along each axis. A region that is not in the volume gets empty ranges
+    """
+    nb_regions = len(region_ids)
+    nb_bins = nb_regions + 1
+    region_ids = np.asarray(region_ids, dtype=volume.dtype)
+
+    # for each axis, whether each region is present at each index along this axis
+    presence_per_axis = [
+        np.zeros((nb_regions, size), dtype=bool) for size in volume.shape
+    ]
+
+    voxel_counts = np.zeros(nb_regions, dtype=np.int64)
+    chunk_axis = chunkAxis(volume)
+
+    for chunk in iterateChunks(volume, chunk_axis):
+        start = chunk[chunk_axis].start
+        indices = lookupIndices(volume[chunk], region_ids)
+
+        for axis, presence in enumerate(presence_per_axis):
+            counts = _countPerSlice(np.moveaxis(indices, axis, 0), nb_bins)
+
+            if axis == chunk_axis:
+                presence[:, start : start + indices.shape[axis]] = counts > 0
+                voxel_counts += counts.sum(axis=1)
+            else:
+                presence |= counts > 0
+
+    bounding_boxes = np.zeros((nb_regions, 3, 2), dtype=np.int64)
+
+    for axis, presence in enumerate(presence_per_axis):
+        is_present = presence.any(axis=1)
+        bounding_boxes[:, axis, 0] = np.where(is_present, presence.argmax(axis=1), 0)
+        bounding_boxes[:, axis, 1] = np.where(
+            is_present, presence.shape[1] - presence[:, ::-1].argmax(axis=1), 0
+        )
+
+    return voxel_counts, bounding_boxes
+
+
+def _countPerSlice(indices, nb_bins):
+    """
+    Counts the occurence of each compacted index on each slice along the first axis, with a single bincount.
+    Returns a (nb_bins - 1, nb_slices) array, the last bin (the labels that are not counted) being dropped.
+    """
+    nb_slices = indices.shape[0]
+    bin_offsets = (np.arange(nb_slices) * nb_bins).reshape(-1, 1, 1)
+    counts = np.bincount(
+        (indices + bin_offsets).ravel(order="K"), minlength=nb_slices * nb_bins
+    )
+    return counts.reshape(nb_slices, nb_bins)[:, :-1].T
+
+
+def _countUnchangedPerSlice(indices, nb_bins):
+    """
+    Counts, for each compacted index and each slice i along the first axis, the voxels that have this index on
+    both the slice i and the slice i+1. Returns a (nb_bins - 1, nb_slices - 1) array.
+    """
+    unchanged = np.where(indices[:-1] == indices[1:], indices[:-1], nb_bins - 1)
+    return _countPerSlice(unchanged, nb_bins)
+
+
+def accumulatePairCounts(
+    slab,
+    region_ids,
+    presence,
+    same,
+    coronal_axis_index=0,
+    slice_offset=0,
+    previous_slice=None,
+):
+    """
+    Counts, for each region and each slice of a slab, the number of voxels of the region (presence)
+    and the number of voxels of the region that are still part of it on the next slice (same).
+    This function does not return anything and instead adds the counts to the arrays provided in arguments,
+    so that it can be called on consecutive parts of a volume.
+
+        Parameters:
+            slab (np.ndarray): part of the annotation volume, made of consecutive slices along coronal_axis_index.
+                It can also be a part of the volume cut along another axis, as long as it contains all the slices
+            region_ids (np.ndarray): sorted array of the region ids to count
+            presence (np.ndarray): OUTPUT. (nb_regions, nb_slices) array of voxel counts per region and per slice
+            same (np.ndarray): OUTPUT. (nb_regions, nb_slices) array where the element [r, i] is the number of voxels
+                of the region r that are at the same position on the slice i and on the slice i+1
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (default: 0)
+            slice_offset (int): index in the whole volume of the first slice of the slab (default: 0)
+            previous_slice (np.ndarray): the slice that precedes the slab in the volume, if any, so that the transition
+                from this slice to the first slice of the slab is counted as well (default: None)
+    """
+    nb_bins = len(region_ids) + 1
+    region_ids = np.asarray(region_ids, dtype=slab.dtype)
+
+    if len(region_ids) == 0:
+        return
+
+    if previous_slice is not None:
+        first_slice = np.take(slab, 0, axis=coronal_axis_index)
+        pair = np.stack(
+            (
+                lookupIndices(np.asarray(previous_slice), region_ids),
+                lookupIndices(first_slice, region_ids),
+            )
+        )
+        same[:, slice_offset - 1 : slice_offset] += _countUnchangedPerSlice(
+            pair, nb_bins
+        )
+
+    # The slab is visited in the order of its memory layout, which is much faster. If it is cut along the
+    # coronal axis, the transition from a chunk to the next is counted using the last slice of the previous chunk
+    chunk_axis = chunkAxis(slab)
+    previous = None
+
+    for chunk in iterateChunks(slab, chunk_axis):
+        indices = np.moveaxis(
+            lookupIndices(slab[chunk], region_ids), coronal_axis_index, 0
+        )
+        first = slice_offset
+
+        if chunk_axis == coronal_axis_index:
+            first += chunk[chunk_axis].start
+
+            if previous is not None:
+                pair = np.stack((previous, indices[0]))
+                same[:, first - 1 : first] += _countUnchangedPerSlice(pair, nb_bins)
+
+            previous = indices[-1]
+
+        nb_chunk_slices = indices.shape[0]
+        presence[:, first : first + nb_chunk_slices] += _countPerSlice(indices, nb_bins)
+        same[:, first : first + nb_chunk_slices - 1] += _countUnchangedPerSlice(
+            indices, nb_bins
+        )
+
+
+def computeRatiosFromCounts(presence, same):
+    """
+    Computes the ratios of each region on each slice from the counts made by accumulatePairCounts().
+    This gives exactly the same ratios as threadedProcess() does with the volumetric masks.
+
+        Parameters:
+            presence (np.ndarray): (nb_regions, nb_slices) array of voxel counts per region and per slice
+            same (np.ndarray): (nb_regions, nb_slices) array of the voxels that remain in the region from a slice to the next
+
+        Returns:
+            ratios (np.ndarray). (nb_regions, nb_slices) array of ratios
+    """
+    # the next slice of the last one is the first one, as done with np.roll in threadedProcess
+    next_presence = np.roll(presence, -1, axis=1)
+    sum_non_zero = presence + next_presence
+    diff_per_slice_non_zero = sum_non_zero - 2 * same
+    diff_ratios = np.divide(
+        diff_per_slice_non_zero,
+        sum_non_zero,
+        out=np.zeros_like(diff_per_slice_non_zero, dtype=float),
+        where=sum_non_zero != 0,
+    )
+
+    # see threadedProcess() for why those are discarded
+    diff_ratios[diff_ratios == 1] = 0
+    diff_ratios[:, 0] = 0
+    diff_ratios[:, -1] = 0
+    return diff_ratios
+
+
+def singlePassProcess(
+    volume,
+    regions_ids,
+    report,
+    coronal_axis_index,
+    compacted_labels=None,
+    nb_workers=1,
+    backend="thread",
+    executor=None,
+):
+    """
+    Should not be ran manually (ran by the compute() method)
+    Computes the metrics on all the given regions at once, by visiting each slice of the volume only once
+    instead of creating a volumetric mask for each region. Adds the "perRegion" entries to the report.
+    With several workers, the volume is cut into slabs along coronal_axis_index which are counted in parallel
+    (see slabPoolProcess()), so that even a single region is computed on all the workers.
+
+        Parameters:
+            volume (np.ndarray): annotation volume containing region labels (integers)
+            regions_ids (list): ids of the regions to compute the metrics on
+            report (dict): OUTPUT. This function adds in the "perRegion" metrics entry for each region
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name).
+            compacted_labels (CompactedLabels): if volume is the index volume of compacted labels, the compacted
+                labels, to find the index of each region (default: None)
+            nb_workers (int): number of threads (or worker processes) counting the slabs (default: 1)
+            backend (string): "thread" or "process", see compute() (default: "thread")
+            executor (ThreadPoolExecutor): the pool of threads to count the slabs on with the thread backend, see compute() (default: None)
+
+        Returns:
+            ratios (np.ndarray). (nb_regions, nb_slices) array of ratios, rows sorted by region id
+    """
+    if compacted_labels is not None:
+        region_ids = np.unique(
+            np.asarray(regions_ids, dtype=compacted_labels.ids.dtype)
+        )
+    else:
+        region_ids = np.unique(np.asarray(regions_ids, dtype=volume.dtype))
+
+    region_ids = region_ids[region_ids != 0]
+    nb_slices = volume.shape[coronal_axis_index]
+
+    presence = np.zeros((len(region_ids), nb_slices), dtype=np.int64)
+    same = np.zeros_like(presence)
+
+    # only the no_data part was requested
+    if len(region_ids) == 0:
+        return presence.astype(float)
+
+    # the indices are sorted like the ids
+    region_labels = region_ids
+    if compacted_labels is not None:
+        region_labels = indicesOf(compacted_labels, region_ids)
+
+    if nb_workers > 1:
+        slabPoolProcess(
+            volume,
+            region_labels,
+            presence,
+            same,
+            coronal_axis_index,
+            nb_workers,
+            backend,
+            executor,
+        )
+    else:
+        accumulatePairCounts(
+            volume, region_labels, presence, same, coronal_axis_index=coronal_axis_index
+        )
+
+    return fillReportFromCounts(report, region_ids, presence, same)
+
+
+def overlappingSlabRanges(nb_slices, nb_slabs):
+    """
+    Cuts the slices of a volume into contiguous slabs of about the same size, each slab ending with the first slice
+    of the next one, so that the transition from a slab to the next is counted within the slab.
+
+        Parameters:
+            nb_slices (int): the number of slices of the volume
+            nb_slabs (int): the number of slabs, reduced if there are not enough slices
+
+        Returns:
+            slab_ranges (list). The (start, stop) slices of each slab, the last slice of a slab being the first of the next
+    """
+    nb_slabs = max(1, min(nb_slabs, nb_slices - 1))
+    bounds = np.linspace(0, max(0, nb_slices - 1), nb_slabs + 1).round().astype(int)
+    return [(int(start), int(stop) + 1) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _countSlab(volume, region_labels, coronal_axis_index, slab_range):
+    """
+    Counts the presence of each region on the slices of a slab, and the voxels that remain in each region on the
+    transitions within the slab (see accumulatePairCounts()). Returns the (nb_regions, nb_slab_slices) counts.
+    """
+    crop = [slice(None)] * volume.ndim
+    crop[coronal_axis_index] = slice(*slab_range)
+    slab = volume[tuple(crop)]
+
+    presence = np.zeros(
+        (len(region_labels), slab_range[1] - slab_range[0]), dtype=np.int64
+    )
+    same = np.zeros_like(presence)
+    accumulatePairCounts(
+        slab, region_labels, presence, same, coronal_axis_index=coronal_axis_index
+    )
+    return presence, same
+
+
+def _countWorkerSlab(region_labels, coronal_axis_index, slab_range):
+    """
+    Should not be ran manually (ran by slabPoolProcess() in a worker process)
+    Counts a slab of the volume of the worker process, see _countSlab().
+    """
+    return _countSlab(_worker_volume, region_labels, coronal_axis_index, slab_range)
+
+
+def slabPoolProcess(
+    volume,
+    region_labels,
+    presence,
+    same,
+    coronal_axis_index,
+    nb_workers,
+    backend="thread",
+    executor=None,
+):
+    """
+    Should not be ran manually (ran by singlePassProcess())
+    Counts the presence of each region on each slice and the voxels that remain in each region from a slice to the
+    next (see accumulatePairCounts()) on a pool of threads or worker processes, each one counting a slab of
+    consecutive slices along coronal_axis_index. The slabs overlap by one slice (see overlappingSlabRanges()): each slab
+    counts the transitions within it, and the presence on all its slices but the one it shares with the next slab,
+    so that the counts of the slabs add up to exactly those of the whole volume.
+
+        Parameters:
+            volume (np.ndarray): annotation volume containing region labels (integers), or the index volume of compacted labels
+            region_labels (np.ndarray): sorted array of the labels of the regions to count in the volume
+            presence (np.ndarray): OUTPUT. (nb_regions, nb_slices) array of voxel counts per region and per slice
+            same (np.ndarray): OUTPUT. (nb_regions, nb_slices) array of the voxels that remain in the region from a slice to the next
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name).
+            nb_workers (int): number of threads (or worker processes), and of slabs
+            backend (string): "thread" or "process", see compute() (default: "thread")
+            executor (ThreadPoolExecutor): the pool of threads to count the slabs on with the thread backend, instead of
+                starting new threads (default: None)
+    """
+    slab_ranges = overlappingSlabRanges(volume.shape[coronal_axis_index], nb_workers)
+
+    if backend == "process":
+        with _sharedVolumePool(volume, len(slab_ranges)) as executor:
+            partial_counts = list(
+                executor.map(
+                    _countWorkerSlab,
+                    [region_labels] * len(slab_ranges),
+                    [coronal_axis_index] * len(slab_ranges),
+                    slab_ranges,
+                )
+            )
+    else:
+        with contextlib.ExitStack() as stack:
+            if executor is None:
+                executor = stack.enter_context(
+                    ThreadPoolExecutor(max_workers=len(slab_ranges))
+                )
+
+            partial_counts = list(
+                executor.map(
+                    lambda slab_range: _countSlab(
+                        volume, region_labels, coronal_axis_index, slab_range
+                    ),
+                    slab_ranges,
+                )
+            )
+
+    for (start, stop), (slab_presence, slab_same) in zip(slab_ranges, partial_counts):
+        # the last slice of a slab is counted by the next one, unless it is the last slice of the volume
+        nb_present = stop - start if stop == presence.shape[1] else stop - start - 1
+        presence[:, start : start + nb_present] += slab_presence[:, :nb_present]
+        same[:, start : stop - 1] += slab_same[:, :-1]
+
+
+def fillReportFromCounts(report, region_ids, presence, same):
+    """
+    Adds the "perRegion" entries to the report from the counts made by accumulatePairCounts().
+
+        Parameters:
+            report (dict): OUTPUT. This function adds in the "perRegion" metrics entry for each region
+            region_ids (np.ndarray): the region id of each row of presence and same
+            presence (np.ndarray): (nb_regions, nb_slices) array of voxel counts per region and per slice
+            same (np.ndarray): (nb_regions, nb_slices) array of the voxels that remain in the region from a slice to the next
+
+        Returns:
+            ratios (np.ndarray). (nb_regions, nb_slices) array of ratios
+    """
+    diff_ratios = computeRatiosFromCounts(presence, same)
+
+    for id, diff_ratios_per_slice in zip(np.asarray(region_ids).tolist(), diff_ratios):
+        report["perRegion"][int(id)] = computeRegionStats(diff_ratios_per_slice)
+
+    return diff_ratios
+
+
+def _findMissingLabels(slab, region_ids):
+    """
+    Returns the sorted labels of the slab that are not in region_ids (sorted array).
+    """
+    if len(region_ids) == 0:
+        return np.unique(slab)
+
+    indices = lookupIndices(slab, region_ids)
+    return np.unique(slab[indices == len(region_ids)])
+
+
+def _insertRegions(region_ids, presence, same, new_region_ids):
+    """
+    Returns region_ids, presence and same with additional rows for the new regions, keeping the ids sorted.
+    """
+    merged_region_ids = np.union1d(region_ids, new_region_ids).astype(region_ids.dtype)
+    rows = np.searchsorted(merged_region_ids, region_ids)
+
+    merged_presence = np.zeros(
+        (len(merged_region_ids), presence.shape[1]), dtype=presence.dtype
+    )
+    merged_same = np.zeros_like(merged_presence)
+    merged_presence[rows] = presence
+    merged_same[rows] = same
+
+    return merged_region_ids, merged_presence, merged_same
+
+
+def countSlabs(slabs, shape, slab_axis, coronal_axis_index=0, regions=None):
+    """
+    Counts the voxels of each region on each slice, and the voxels that remain in the region from a slice to the
+    next (see accumulatePairCounts()), from consecutive slabs of a volume. The volume is never entirely in memory:
+    only the current slab and, if the slabs are cut along the coronal axis, the last slice of the previous slab.
+
+        Parameters:
+            slabs (iterable): yields the index of the first slice of each slab along slab_axis, and the slab (np.ndarray).
+                The slabs must be consecutive and cover the whole volume. (ex. load_volume.iterateSlabs())
+            shape (tuple): the shape of the whole volume
+            slab_axis (int): the axis along which the volume is cut into slabs
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (default: 0)
+            regions (list): list of region ids (integers) to count. If not provided, all the regions met in the
+                slabs are counted, including the no_data part (default: None)
+
+        Returns:
+            region_ids (np.ndarray). The sorted region ids
+            presence (np.ndarray). (nb_regions, nb_slices) array of voxel counts per region and per slice
+            same (np.ndarray). (nb_regions, nb_slices) array of the voxels that remain in the region from a slice to the next
+    """
+    nb_slices = shape[coronal_axis_index]
+    region_ids = None
+    previous_slice = None
+
+    for start, slab in slabs:
+        if region_ids is None:
+            if not regions:
+                region_ids = np.zeros(0, dtype=slab.dtype)
+            else:
+                region_ids = np.unique(np.asarray(regions, dtype=slab.dtype))
+
+            presence = np.zeros((len(region_ids), nb_slices), dtype=np.int64)
+            same = np.zeros_like(presence)
+
+        # the regions met for the first time are added on the fly
+        if not regions:
+            missing_labels = _findMissingLabels(slab, region_ids)
+
+            if len(missing_labels):
+                region_ids, presence, same = _insertRegions(
+                    region_ids, presence, same, missing_labels
+                )
+
+        if slab_axis == coronal_axis_index:
+            accumulatePairCounts(
+                slab,
+                region_ids,
+                presence,
+                same,
+                coronal_axis_index=coronal_axis_index,
+                slice_offset=start,
+                previous_slice=previous_slice,
+            )
+            previous_slice = np.take(slab, -1, axis=slab_axis).copy()
+        else:
+            accumulatePairCounts(
+                slab,
+                region_ids,
+                presence,
+                same,
+                coronal_axis_index=coronal_axis_index,
+            )
+
+    return region_ids, presence, same
+
+
+def computeFromCounts(
+    region_ids, presence, same, regions=None, ratios_per_region=None, timings=None
+):
+    """
+    Compute the metrics of the jaggedness from the counts made by countSlabs() or accumulatePairCounts().
+
+        Parameters:
+            region_ids (np.ndarray): the region id of each row of presence and same
+            presence (np.ndarray): (nb_regions, nb_slices) array of voxel counts per region and per slice
+            same (np.ndarray): (nb_regions, nb_slices) array of the voxels that remain in the region from a slice to the next
+            regions (list): list of region ids (integers) to run the metrics on. If not provided, the metrics we be computed on all the counted regions (default: None)
+            ratios_per_region (dict): OUTPUT. if provided, the ratios for each slice of each region are added to it (key: region id) (default: None)
+            timings (dict): OUTPUT. if provided, the timings of the computation are added to it, see compute() (default: None, nothing is measured)
+
+        Returns:
+            metrics (dict). Metrics per slice, per region and global
+    """
+    region_ids = np.asarray(region_ids)
+
+    # only the regions that are actually in the volume
+    is_present = presence.sum(axis=1) > 0
+
+    if regions:
+        is_present &= np.isin(region_ids, regions)
+        regions_ids = region_ids[is_present].tolist()
+
+        if len(regions) != len(regions_ids):
+            print(
+                "Among the provided regions, only the folowwing are present in the volume: ",
+                regions_ids,
+            )
+
+        if len(regions_ids) == 0:
+            raise Exception("None of the provided regions are in the volume.")
+
+    # we don't process the no_data part
+    rows = np.flatnonzero(is_present & (region_ids != 0))
+
+    if len(rows) == 0:
+        return None
+
+    if timings is not None:
+        timings["nbWorkers"] = 1
+
+    report = {
+        "perRegion": {},
+        "perSlice": {},
+        "global": {},
+    }
+
+    with timePhase(timings, "aggregation"):
+        ratios = fillReportFromCounts(
+            report, region_ids[rows], presence[rows], same[rows]
+        )
+        aggregateReport(report, ratios.T)
+
+    if ratios_per_region is not None:
+        ratios_per_region.update(zip(region_ids[rows].tolist(), ratios))
+
+    return report
+
+
+def computeFromSlabs(
+    slabs,
+    shape,
+    slab_axis,
+    coronal_axis_index=0,
+    regions=None,
+    ratios_per_region=None,
+    timings=None,
+):
+    """
+    Compute the metrics of the jaggedness from consecutive slabs of an annotation volume, so that the whole volume
+    never has to be in memory (see countSlabs()). This gives the same metrics as compute().
+
+        Parameters:
+            slabs (iterable): yields the index of the first slice of each slab along slab_axis, and the slab (np.ndarray).
+                The slabs must be consecutive and cover the whole volume. (ex. load_volume.iterateSlabs())
+            shape (tuple): the shape of the whole volume
+            slab_axis (int): the axis along which the volume is cut into slabs
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (default: 0)
+            regions (list): list of region ids (integers) to run the metrics on. If not provided, the metrics we be computed on all the regions of the volume (default: None)
+            ratios_per_region (dict): OUTPUT. if provided, the ratios for each slice of each region are added to it (key: region id) (default: None)
+            timings (dict): OUTPUT. if provided, the timings of the computation are added to it, see compute() (default: None, nothing is measured)
+
+        Returns:
+            metrics (dict). Metrics per slice, per region and global
+    """
+    print("computing slab by slab...")
+
+    # the slabs are read (and decompressed) as they are counted
+    with timePhase(timings, "slabs"):
+        region_ids, presence, same = countSlabs(
+            slabs,
+            shape,
+            slab_axis,
+            coronal_axis_index=coronal_axis_index,
+            regions=regions,
+        )
+
+    return computeFromCounts(
+        region_ids,
+        presence,
+        same,
+        regions=regions,
+        ratios_per_region=ratios_per_region,
+        timings=timings,
+    )
+
+
+def isOutOfCore(volume, max_memory=None):
+    """
+    Whether a volume is computed slab by slab by compute(): an array-like giving access to slabs with numpy indexing
+    (such as an HDF5 dataset or a zarr array), or a memory-mapped array (np.memmap, such as a raw NRRD file opened
+    by load_volume.memoryMapVolume() or a .npy file opened with np.load(mmap_mode="r")) that is larger than the
+    memory budget. A memory-mapped array within the budget is read by the engines like an array in memory, the
+    operating system loading its pages as they are used.
+
+        Parameters:
+            volume (array-like): the annotation volume
+            max_memory (int): memory budget of the computation in bytes (default: None, no limit)
+
+        Returns:
+            bool. True if the volume is computed slab by slab
+    """
+    if isinstance(volume, CompactedLabels):
+        return False
+
+    if not isinstance(volume, np.ndarray):
+        return True
+
+    return (
+        isinstance(volume, np.memmap)
+        and max_memory is not None
+        and volume.nbytes > max_memory
+    )
+
+
+def estimateSlabSize(volume, slab_axis, max_memory=None):
+    """
+    Estimates the number of slices of the slabs a volume is read by, so that the slab and the temporary arrays made to
+    count it (see accumulatePairCounts()) stay under a memory budget. For a chunked array (HDF5, zarr), the slabs are
+    made of whole chunks when possible.
+
+        Parameters:
+            volume (array-like): the annotation volume
+            slab_axis (int): the axis along which the volume is cut into slabs
+            max_memory (int): memory budget in bytes (default: None, a few millions of voxels per slab)
+
+        Returns:
+            slab_size (int). The number of slices of each slab
+    """
+    shape = tuple(volume.shape)
+    slice_nb_voxels = max(1, int(np.prod(shape)) // max(1, shape[slab_axis]))
+
+    if max_memory is None:
+        slab_size = max(1, CHUNK_NB_VOXELS // slice_nb_voxels)
+    else:
+        # the temporary arrays are at most those of a chunk, but are counted for the whole slab to be on the safe side
+        voxel_nbytes = np.dtype(volume.dtype).itemsize + _SINGLE_PASS_BYTES_PER_VOXEL
+        slab_size = max(1, max_memory // (slice_nb_voxels * voxel_nbytes))
+
+    chunks = getattr(volume, "chunks", None)
+    if chunks and slab_size >= chunks[slab_axis]:
+        slab_size -= slab_size % chunks[slab_axis]
+
+    return int(min(slab_size, shape[slab_axis]))
+
+
+def computeOutOfCore(
+    volume,
+    coronal_axis_index=0,
+    regions=None,
+    max_memory=None,
+    label_index=None,
+    ratios_per_region=None,
+    timings=None,
+):
+    """
+    Should not be ran manually (ran by the compute() method)
+    Compute the metrics of the jaggedness of a volume that is not entirely in memory (see isOutOfCore()), by counting
+    it slab by slab (see countSlabs()). The regions whose ratios are already in ratios_per_region are not counted again. When the slabs are cut along the coronal axis, the last slice of each slab is
+    kept to count its transition to the first slice of the next one, so that the counts are exactly those of the whole
+    volume. A memory-mapped volume is cut along its slowest-varying axis instead, each slab being contiguous on disk,
+    and each slab then contains all the slices. This gives the same metrics as compute().
+
+        Parameters:
+            volume (array-like): the annotation volume, giving access to slabs with numpy indexing
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (default: 0)
+            regions (list): list of region ids (integers) to run the metrics on (default: None, all the regions)
+            max_memory (int): memory budget of the computation in bytes, which sets the size of the slabs (default: None)
+            label_index (LabelIndex): the label index of the volume, so that the regions do not have to be found in each slab (default: None)
+            ratios_per_region (dict): OUTPUT. the ratios for each slice of the regions already computed (key: region id),
+                see compute(). The ratios of the counted regions are added to it (default: None)
+            timings (dict): OUTPUT. if provided, the timings of the computation are added to it, with the number of slices of
+                the slabs ("slabSize"), see compute() (default: None, nothing is measured)
+
+        Returns:
+            metrics (dict). Metrics per slice, per region and global
+    """
+    slab_axis = coronal_axis_index
+    if hasattr(volume, "strides"):
+        slab_axis = chunkAxis(volume)
+
+    slab_size = estimateSlabSize(volume, slab_axis, max_memory)
+
+    if not regions and label_index is not None:
+        regions = label_index.ids.tolist()
+
+    if ratios_per_region is None:
+        ratios_per_region = {}
+
+    # the regions whose ratios were already computed are not counted again (when the regions are not known, all of
+    # them are counted)
+    cached_ids = []
+    if regions:
+        cached_ids = [int(id) for id in regions if int(id) in ratios_per_region]
+        regions = [id for id in regions if int(id) not in ratios_per_region]
+
+    if timings is not None:
+        timings["nbCachedRegions"] = len(cached_ids)
+
+    report = None
+    if regions is None or len(regions) > 0:
+        print(
+            f"the volume is not in memory, reading it by slabs of {slab_size} slices..."
+        )
+        if timings is not None:
+            timings["slabSize"] = slab_size
+
+        report = computeFromSlabs(
+            iterateArraySlabs(volume, slab_axis, slab_size),
+            tuple(volume.shape),
+            slab_axis,
+            coronal_axis_index,
+            regions=regions,
+            ratios_per_region=ratios_per_region,
+            timings=timings,
+        )
+    else:
+        print("the ratios of all the regions were already computed")
+
+    if not cached_ids:
+        return report
+
+    # the metrics are aggregated again, with the regions already computed
+    computed_ids = sorted(
+        set(cached_ids) | set(report["perRegion"] if report is not None else [])
+    )
+    report = {"perRegion": {}, "perSlice": {}, "global": {}}
+
+    with timePhase(timings, "aggregation"):
+        for id in computed_ids:
+            report["perRegion"][id] = computeRegionStats(ratios_per_region[id])
+
+        aggregateReport(
+            report, np.array([ratios_per_region[id] for id in computed_ids]).T
+        )
+
+    return report
+
+
+def _medianOfSorted(sorted_values, nb_values):
+    """
+    Computes the median of each row of an array whose rows are sorted with their values first and NaN last, from
+    the number of values of each row (the rows without values are given NaN). This gives the same medians as
+    np.median() on the values of each row, without a Python loop over the rows.
+    """
+    nb_rows = sorted_values.shape[0]
+    if sorted_values.shape[1] == 0:
+        return np.full(nb_rows, np.nan)
+
+    lower = np.maximum(0, (nb_values - 1) // 2)
+    upper = np.maximum(0, nb_values // 2)
+    rows = np.arange(nb_rows)
+    medians = (sorted_values[rows, lower] + sorted_values[rows, upper]) / 2
+    medians[nb_values == 0] = np.nan
+    return medians
+
+
+def aggregateReport(report, ratios_per_region_per_slice):
+    """
+    Should not be ran manually (ran by the compute() method)
+    Adds the "perSlice" and "global" entries to the report, from the ratios of all the regions.
+    The metrics of all the slices are computed at once, on the whole matrix.
+
+        Parameters:
+            report (dict): OUTPUT. This function adds in the "perSlice" and "global" entries
+            ratios_per_region_per_slice (np.ndarray): (nb_slices, nb_regions) array of ratios
+    """
+    ratios = np.asarray(ratios_per_region_per_slice, dtype=float)
+
+    # for the per-slice approach, we need to filter out all the zeros because we want to consider
+    # only the jaggies of where the regions are and keeping the zeros (aka. where each region is not)
+    # is lowering down very much the average, which create an important bias into detecting the jaggies.
+    # The zeros are replaced by NaN, which the reductions ignore
+    is_non_zero = ratios > 0
+    nb_non_zero = np.count_nonzero(is_non_zero, axis=1)
+    non_zero_only = np.where(is_non_zero, ratios, np.nan)
+
+    # the slices without any non-zero ratio get NaN (then None) and would warn about it
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        per_slice = {
+            "mean": np.nanmean(non_zero_only, axis=1),
+            "median": _medianOfSorted(np.sort(non_zero_only, axis=1), nb_non_zero),
+            "std": np.nanstd(non_zero_only, axis=1),
+            "min": np.min(
+                np.where(is_non_zero, ratios, np.inf), axis=1, initial=np.inf
+            ),
+            "max": np.max(ratios, axis=1, initial=0),
+        }
+
+    has_ratios = (nb_non_zero > 0).tolist()
+    for name, values in per_slice.items():
+        report["perSlice"][name] = [
+            value if has_ratio else None
+            for value, has_ratio in zip(values.tolist(), has_ratios)
+        ]
+
+    # for the global approach, no need to. As it always was, the global metrics are only given when the
+    # last slice has non-zero ratios
+    flat_non_zero = ratios[is_non_zero]
+    has_global = len(has_ratios) > 0 and has_ratios[-1]
+    report["global"]["mean"] = float(np.mean(flat_non_zero)) if has_global else None
+    report["global"]["median"] = float(np.median(flat_non_zero)) if has_global else None
+    report["global"]["std"] = float(np.std(flat_non_zero)) if has_global else None
+    report["global"]["min"] = float(np.min(flat_non_zero)) if has_global else None
+    report["global"]["max"] = float(np.max(flat_non_zero)) if has_global else None
+
+
+def _initProcessWorker(shared_memory_name, shape, dtype, order):
+    """
+    Should not be ran manually (ran by _sharedVolumePool() when each worker process starts)
+    Makes the annotation volume stored in shared memory available to the worker process, without copying it.
+    """
+    global _worker_volume, _worker_shared_memory
+    _worker_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    _worker_volume = np.ndarray(
+        shape, dtype=dtype, buffer=_worker_shared_memory.buf, order=order
+    )
+
+
+def _processRegion(id, coronal_axis_index, per_slice_axis, bounding_box, label):
+    """
+    Should not be ran manually (ran by processPoolProcess() in a worker process)
+    Computes the metrics of a region on the volume of the worker process and returns them, since the
+    structures of the parent process cannot be written from a worker process.
+    """
+    list_of_ratios_per_region = []
+    report = {"perRegion": {}}
+    start = time.perf_counter()
+    threadedProcess(
+        _worker_volume,
+        id,
+        list_of_ratios_per_region,
+        report,
+        coronal_axis_index,
+        per_slice_axis,
+        bounding_box,
+        label,
+    )
+    wall_time = time.perf_counter() - start
+    return list_of_ratios_per_region, report["perRegion"], wall_time
+
+
+def estimateRegionMemory(bounding_box, coronal_axis_index, nb_slices):
+    """
+    Estimates the memory allocated by threadedProcess() to compute the metrics of a region.
+
+        Parameters:
+            bounding_box (np.ndarray): (3, 2) array of the start (inclusive) and stop (exclusive) indices of the region
+                along each axis, as given by computeRegionCensus()
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name).
+            nb_slices (int): number of slices of the volume along coronal_axis_index
+
+        Returns:
+            nb_bytes (int). The estimated peak of the memory allocated for the region
+    """
+    sizes = (bounding_box[:, 1] - bounding_box[:, 0]).tolist()
+
+    # the sub-volume is padded with a slice on both sides along the coronal axis
+    sizes[coronal_axis_index] = min(nb_slices, sizes[coronal_axis_index] + 2)
+
+    # and the per-slice counts and ratios
+    return int(np.prod(sizes)) * _REGION_BYTES_PER_VOXEL + 4 * nb_slices * 8
+
+
+def estimateSinglePassMemory(shape, nb_regions, coronal_axis_index):
+    """
+    Estimates the memory allocated by singlePassProcess() to compute the metrics of all the regions at once.
+
+        Parameters:
+            shape (tuple): the shape of the volume
+            nb_regions (int): number of regions to compute the metrics on
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name).
+
+        Returns:
+            nb_bytes (int). The estimated peak of the memory allocated for the computation
+    """
+    nb_voxels = int(np.prod(shape))
+
+    # the chunks are made of whole slices, which may be larger than CHUNK_NB_VOXELS
+    nb_chunk_voxels = min(nb_voxels, max(CHUNK_NB_VOXELS, nb_voxels // min(shape)))
+
+    # the presence and same counts, and the ratios
+    nb_count_bytes = 3 * nb_regions * shape[coronal_axis_index] * 8
+
+    return nb_chunk_voxels * _SINGLE_PASS_BYTES_PER_VOXEL + nb_count_bytes
+
+
+def threadPoolProcess(
+    volume,
+    regions_ids,
+    ratios_per_region,
+    report,
+    coronal_axis_index,
+    per_slice_axis,
+    bounding_box_per_region,
+    nb_thread,
+    label_per_region=None,
+    executor=None,
+    wall_time_per_region=None,
+):
+    """
+    Should not be ran manually (ran by the compute() method)
+    Computes the metrics of each region on a pool of threads that take the regions from a shared queue, in the given
+    order, each thread taking the next region as soon as it is done with the previous. This way, a large region only
+    keeps its own thread busy.
+
+        Parameters:
+            volume (np.ndarray): annotation volume containing region labels (integers)
+            regions_ids (list): ids of the regions to compute the metrics on
+            ratios_per_region (dict): OUTPUT. this function adds the ratios for each slice of each region (key: region id)
+            report (dict): OUTPUT. This function adds in the "perRegion" metrics entry for each region
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name).
+            per_slice_axis (tuple): thetwo axis that represent the slice plane orthogonal to coronal_axis_index
+            bounding_box_per_region (dict): the bounding box of each region (key: region id)
+            nb_thread (int): number of threads
+            label_per_region (dict): the value of each region in the volume, if it is not its id (key: region id) (default: None)
+            executor (ThreadPoolExecutor): the pool of threads to run on, instead of starting new threads (default: None)
+            wall_time_per_region (dict): OUTPUT. if provided, the wall time of each region is added to it (key: region id) (default: None)
+    """
+    regions_queue = queue.Queue()
+    for id in regions_ids:
+        regions_queue.put(id)
+
+    def work():
+        while True:
+            try:
+                id = regions_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            start = time.perf_counter()
+            list_of_ratios_per_region = []
+            threadedProcess(
+                volume,
+                id,
+                list_of_ratios_per_region,
+                report,
+                coronal_axis_index,
+                per_slice_axis,
+                bounding_box_per_region[int(id)],
+                label_per_region and label_per_region[int(id)],
+            )
+            if wall_time_per_region is not None:
+                wall_time_per_region[int(id)] = time.perf_counter() - start
+
+            for ratios in list_of_ratios_per_region:
+                ratios_per_region[int(id)] = ratios
+
+    nb_workers = min(nb_thread, len(regions_ids))
+
+    if executor is not None:
+        for future in [executor.submit(work) for _ in range(nb_workers)]:
+            future.result()
+        return
+
+    thread_list = [threading.Thread(target=work) for _ in range(nb_workers)]
+
+    for t in thread_list:
+        t.start()
+
+    for t in thread_list:
+        t.join()
+
+
+def processPoolProcess(
+    volume,
+    regions_ids,
+    ratios_per_region,
+    report,
+    coronal_axis_index,
+    per_slice_axis,
+    bounding_box_per_region,
+    nb_workers,
+    label_per_region=None,
+    wall_time_per_region=None,
+):
+    """
+    Should not be ran manually (ran by the compute() method)
+    Computes the metrics of each region on a pool of worker processes, which are not limited by the GIL.
+    The volume is copied once into shared memory, from which all the workers read it, and only the region
+    ids are sent to the workers. The regions are dispatched in the given order, each worker taking the next
+    one as soon as it is done with the previous.
+
+        Parameters:
+            volume (np.ndarray): annotation volume containing region labels (integers)
+            regions_ids (list): ids of the regions to compute the metrics on
+            ratios_per_region (dict): OUTPUT. this function adds the ratios for each slice of each region (key: region id)
+            report (dict): OUTPUT. This function adds in the "perRegion" metrics entry for each region
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name).
+            per_slice_axis (tuple): thetwo axis that represent the slice plane orthogonal to coronal_axis_index
+            bounding_box_per_region (dict): the bounding box of each region (key: region id)
+            nb_workers (int): number of worker processes
+            label_per_region (dict): the value of each region in the volume, if it is not its id (key: region id) (default: None)
+            wall_time_per_region (dict): OUTPUT. if provided, the wall time of each region is added to it (key: region id) (default: None)
+    """
+    with _sharedVolumePool(volume, nb_workers) as executor:
+        futures = [
+            executor.submit(
+                _processRegion,
+                id,
+                coronal_axis_index,
+                per_slice_axis,
+                bounding_box_per_region[int(id)],
+                label_per_region and label_per_region[int(id)],
+            )
+            for id in regions_ids
+        ]
+
+        for id, future in zip(regions_ids, futures):
+            list_of_ratios_per_region, per_region, wall_time = future.result()
+            for ratios in list_of_ratios_per_region:
+                ratios_per_region[int(id)] = ratios
+            report["perRegion"].update(per_region)
+            if wall_time_per_region is not None:
+                wall_time_per_region[int(id)] = wall_time
+
+
+@contextlib.contextmanager
+def _sharedVolumePool(volume, nb_workers):
+    """
+    Copies the volume once into shared memory, and yields a pool of worker processes that read it from there
+    (see _initProcessWorker()). The shared memory is released once the pool is done.
+    """
+    order = "F" if volume.flags.f_contiguous and not volume.flags.c_contiguous else "C"
+    block = shared_memory.SharedMemory(create=True, size=max(1, volume.nbytes))
+
+    try:
+        shared_volume = np.ndarray(
+            volume.shape, dtype=volume.dtype, buffer=block.buf, order=order
+        )
+        shared_volume[...] = volume
+
+        with ProcessPoolExecutor(
+            max_workers=nb_workers,
+            initializer=_initProcessWorker,
+            initargs=(block.name, volume.shape, volume.dtype, order),
+        ) as executor:
+            yield executor
+
+        del shared_volume
+    finally:
+        block.close()
+        block.unlink()
+
+
 def compute(
     volume,
     coronal_axis_index=0,
     regions=None,
     precomputed_all_region_ids=None,
     nb_thread=os.cpu_count() - 1,
+    engine="region",
+    backend="thread",
+    max_memory=None,
+    label_index=None,
+    ratios_per_region=None,
+    executor=None,
+    timings=None,
+    out_of_core=None,
 ):
     """
     Compute the metrics of the jaggedness for a given annotation volume
 
         Parameters:
-            volume (np.ndarray): the annotation volume containing region label (integers)
+            volume (np.ndarray or CompactedLabels): the annotation volume containing region label (integers), or its
+                compacted labels as given by labels.compactLabels(), in which case the regions are computed on the index
+                volume (which is smaller and allows lookup tables) and the list of regions does not have to be computed.
+                A volume that is not in memory (HDF5 dataset, zarr array, or np.memmap over max_memory, see isOutOfCore())
+                is computed slab by slab instead, whatever the engine, with slabs sized from max_memory (see computeOutOfCore())
             coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name). (default: 0)
             regions (list): list of region ids (integers) to run the metrics on. If not provided, the metrics we be computed on all the regions of the volume (default: None)
             precomputed_all_region_ids (list): for optimization only. If already computed before, then the full list of regions availble in the volume can be passed here to avoir recomputation (default: None)
             nb_threads (int): number of thread to run the metrics on (default: number of thread available - 1)
+            engine (string): "region" to compute the metrics with a volumetric mask per region, or "singlepass" to compute
+                the metrics of all the regions at once in a single pass over the volume, which is much faster when
+                there are many regions. The singlepass engine cuts the volume into nb_thread slabs along coronal_axis_index
+                that are counted in parallel, so that it also uses all the workers on a few large regions. Both give the
+                same metrics (default: "region")
+            backend (string): "thread" to run the engine on nb_thread threads, or "process" to run it on a pool of
+                nb_thread worker processes sharing the volume in shared memory, which is not limited by the GIL (default: "thread")
+            max_memory (int): memory budget of the computation in bytes, on top of the volume itself. The number of threads (or worker
+                processes) is reduced so that the estimated memory of the regions (or slabs) computed at once stays under it
+                (with the copy of the volume in shared memory, for the region engine with the process backend). A warning is
+                printed if a single region (or slab) is estimated to need more (default: None, no limit)
+            label_index (LabelIndex): the label index of the volume, as given by label_index.buildLabelIndex() or
+                label_index.loadLabelIndex(). Its ids and bounding boxes are then used instead of being computed from
+                the volume (default: None)
+            ratios_per_region (dict): the ratios for each slice of the regions already computed (key: region id), such as
+                the ratios loaded by result_cache.loadRatios(). These regions are not computed again, and the ratios of the
+                computed regions are added to it (default: None)
+            executor (ThreadPoolExecutor): a pool of threads to run the thread backend on, instead of starting new threads.
+                A pool kept alive across calls saves starting threads for each volume (ex. see batch) (default: None)
+            timings (dict): OUTPUT. if provided, the timings of the computation are added to it: the wall time of each of
+                its "phases", the number of threads (or worker processes) "nbWorkers", the number of regions which were
+                already computed "nbCachedRegions" and the wall time of each region "perRegion" (region engine only)
+                (default: None, nothing is measured)
+            out_of_core (bool): True to compute the volume slab by slab whatever its type, False to read it entirely into
+                memory if it is not (default: None, see isOutOfCore())
 
         Returns:
             metrics (dict). Metrics per slice, per region and global
     """
 
-    print(f"computing on {nb_thread} threads...")
+    if engine not in ENGINES:
+        raise Exception(f"The engine must be one of {ENGINES}")
+
+    if backend not in BACKENDS:
+        raise Exception(f"The backend must be one of {BACKENDS}")
+
+    # on a single-core machine, os.cpu_count() - 1 is 0
+    nb_thread = max(1, nb_thread)
+
+    compacted_labels = None
+    if isinstance(volume, CompactedLabels):
+        compacted_labels = volume
+        volume = compacted_labels.indices
+
     shape = volume.shape
-    nb_slices = shape[coronal_axis_index]
 
-    if precomputed_all_region_ids is not None:
+    if label_index is not None and tuple(label_index.shape) != tuple(shape):
+        raise Exception(
+            f"The label index is for a volume of shape {tuple(label_index.shape)}, not {tuple(shape)}"
+        )
+
+    if out_of_core is None:
+        out_of_core = isOutOfCore(volume, max_memory)
+
+    # the engines need a volume in memory, or memory-mapped
+    if not out_of_core and not isinstance(volume, np.ndarray):
+        volume = np.asarray(volume[...])
+
+    if out_of_core:
+        return computeOutOfCore(
+            volume,
+            coronal_axis_index,
+            regions,
+            max_memory,
+            label_index,
+            ratios_per_region,
+            timings,
+        )
+
+    if label_index is not None:
+        all_region_ids = label_index.ids
+    elif compacted_labels is not None:
+        all_region_ids = compacted_labels.ids
+    elif precomputed_all_region_ids is not None:
         all_region_ids = precomputed_all_region_ids
     else:
-        all_region_ids = np.unique(volume)
+        with timePhase(timings, "regionList"):
+            all_region_ids = np.unique(volume)
 
     if regions:
         regions_ids = [e for e in regions if e in all_region_ids]
@@ -134,118 +1328,238 @@ def compute(
         "global": {},
     }
 
-    # compute the axis tuple that is being used for a per-slice operation
-    # such as in the use of np.count_nonzero
-    per_slice_axis = {0, 1, 2}
-    per_slice_axis.remove(coronal_axis_index)
-    per_slice_axis = tuple(per_slice_axis)
+    if ratios_per_region is None:
+        ratios_per_region = {}
 
-    # each element is related to specific brain region.
-    # each element is an array with as many element as slices in the volume
-    list_of_ratios_per_region = []
+    # the regions whose ratios were already computed are not computed again. The no_data part is not processed.
+    cached_ids = [id for id in regions_ids if int(id) in ratios_per_region]
+    regions_ids = [
+        id for id in regions_ids if id != 0 and int(id) not in ratios_per_region
+    ]
+    if timings is not None:
+        timings["nbCachedRegions"] = len(cached_ids)
 
-    thread_list = []
+    if len(regions_ids) == 0:
+        print("the ratios of all the regions were already computed")
+        if timings is not None:
+            timings["nbWorkers"] = 0
 
-    # counter = 0
-    # For each region is, we create a volumetric mask
-    for id in regions_ids:
-        thread = threading.Thread(
-            target=threadedProcess,
-            args=(
+    elif engine == "singlepass":
+        # each worker counts a slab of the volume, so that even a single region runs on all of them
+        nb_workers = len(overlappingSlabRanges(shape[coronal_axis_index], nb_thread))
+        worker_memory = estimateSinglePassMemory(
+            shape, len(regions_ids), coronal_axis_index
+        )
+
+        if max_memory is not None:
+            available_memory = max_memory - (
+                volume.nbytes if backend == "process" else 0
+            )
+            nb_fitting = max(1, available_memory // max(1, worker_memory))
+
+            if worker_memory > available_memory:
+                print(
+                    f"Warning: the computation is estimated to need {worker_memory} bytes, over the memory budget"
+                )
+
+            nb_workers = int(min(nb_workers, nb_fitting))
+
+        if timings is not None:
+            timings["estimatedWorkerMemory"] = worker_memory
+            timings["nbWorkers"] = nb_workers
+
+        if nb_workers > 1:
+            print(f"computing in a single pass, on {nb_workers} slabs in parallel...")
+        else:
+            print("computing in a single pass...")
+
+        with timePhase(timings, "singlePass"):
+            ratios = singlePassProcess(
                 volume,
-                id,
-                list_of_ratios_per_region,
+                regions_ids,
                 report,
                 coronal_axis_index,
-                per_slice_axis,
-            ),
+                compacted_labels,
+                nb_workers,
+                backend,
+                executor,
+            )
+
+        # the rows are sorted by region id
+        ratios_per_region.update(zip(sorted(int(id) for id in regions_ids), ratios))
+
+    else:
+        computeRegions(
+            volume,
+            regions_ids,
+            ratios_per_region,
+            report,
+            coronal_axis_index,
+            nb_thread,
+            backend,
+            max_memory,
+            compacted_labels,
+            label_index,
+            executor,
+            timings,
         )
-        thread_list.append(thread)
 
-    def run_some_thread():
-        if len(thread_list) == 0:
-            return
+    computed_ids = sorted(
+        int(id) for id in cached_ids + regions_ids if int(id) in ratios_per_region
+    )
 
-        sub_list = []
-        for j in range(0, nb_thread):
-            try:
-                t = thread_list.pop()
-                sub_list.append(t)
-                t.start()
-            except:
-                pass
+    if len(computed_ids) == 0:
+        return None
 
-        for t in sub_list:
-            t.join()
+    with timePhase(timings, "aggregation"):
+        for id in cached_ids:
+            report["perRegion"][int(id)] = computeRegionStats(
+                ratios_per_region[int(id)]
+            )
 
-        run_some_thread()
+        # one row per region, in the order of the region ids whatever the order the regions were computed in
+        ratios_per_region_per_slice = np.empty(
+            (len(computed_ids), len(ratios_per_region[computed_ids[0]]))
+        )
+        for row, id in enumerate(computed_ids):
+            ratios_per_region_per_slice[row] = ratios_per_region[id]
 
-    run_some_thread()
+        aggregateReport(report, ratios_per_region_per_slice.T)
 
-    if len(list_of_ratios_per_region) == 0:
-        return None
+    return report
 
-    # list_of_ratios_per_region
-    ratios_per_region_per_slice = np.concatenate(list_of_ratios_per_region)
-    # np.savetxt("ratios_per_region_per_slice_BEFORE_RESHAPE.csv", ratios_per_region_per_slice)
-    ratios_per_region_per_slice.shape = (
-        int(ratios_per_region_per_slice.shape[0] / nb_slices),
-        nb_slices,
-    )
-    ratios_per_region_per_slice = ratios_per_region_per_slice.T
-    print(ratios_per_region_per_slice.shape)
 
-    # for debugging purpose, we may not run the thing on all the regions, hence we need to know
-    # on how many region the thing was ran
-    actual_nb_regions = ratios_per_region_per_slice.shape[1]
+def computeRegions(
+    volume,
+    regions_ids,
+    ratios_per_region,
+    report,
+    coronal_axis_index,
+    nb_thread,
+    backend="thread",
+    max_memory=None,
+    compacted_labels=None,
+    label_index=None,
+    executor=None,
+    timings=None,
+):
+    """
+    Should not be ran manually (ran by the compute() method)
+    Computes the metrics of the given regions with a volumetric mask per region, on a pool of threads or worker
+    processes. Adds the "perRegion" entries to the report.
 
-    per_slice = np.split(
-        ratios_per_region_per_slice, ratios_per_region_per_slice.shape[0], axis=0
-    )
+        Parameters:
+            volume (np.ndarray): annotation volume containing region labels (integers), or the index volume of compacted labels
+            regions_ids (list): ids of the regions to compute the metrics on, without the no_data part
+            ratios_per_region (dict): OUTPUT. this function adds the ratios for each slice of each region (key: region id)
+            report (dict): OUTPUT. This function adds in the "perRegion" metrics entry for each region
+            coronal_axis_index (int): index of the axis to for which the slicing happened orthogonal to (most likely the coronal axis, hence the name).
+            nb_thread (int): number of threads (or worker processes)
+            backend (string): "thread" or "process", see compute() (default: "thread")
+            max_memory (int): memory budget of the computation in bytes, see compute() (default: None, no limit)
+            compacted_labels (CompactedLabels): if volume is the index volume of compacted labels, the compacted
+                labels, to find the index of each region (default: None)
+            label_index (LabelIndex): the label index of the volume, to get the bounding boxes from (default: None)
+            executor (ThreadPoolExecutor): the pool of threads to run on with the thread backend, see compute() (default: None)
+            timings (dict): OUTPUT. if provided, the timings of the regions are added to it, see compute() (default: None, nothing is measured)
+    """
+    nb_slices = volume.shape[coronal_axis_index]
 
-    report["perSlice"]["mean"] = []
-    report["perSlice"]["median"] = []
-    report["perSlice"]["std"] = []
-    report["perSlice"]["min"] = []
-    report["perSlice"]["max"] = []
+    # compute the axis tuple that is being used for a per-slice operation
+    # such as in the use of np.count_nonzero
+    per_slice_axis = {0, 1, 2}
+    per_slice_axis.remove(coronal_axis_index)
+    per_slice_axis = tuple(per_slice_axis)
 
-    # for the per-slice approach, we need to filter out all the zeros because we want to consider
-    # only the jaggies of where the regions are and keeping the zeros (aka. where each region is not)
-    # is lowering down very much the average, which create an important bias into detecting the jaggies
-    for slice_data in per_slice:
-        slice_data_sub = slice_data[0].copy()
-        non_zero_only = slice_data_sub[slice_data_sub > 0]
-
-        if len(non_zero_only) == 0:
-            report["perSlice"]["mean"].append(None)
-            report["perSlice"]["median"].append(None)
-            report["perSlice"]["std"].append(None)
-            report["perSlice"]["min"].append(None)
-            report["perSlice"]["max"].append(None)
-        else:
-            report["perSlice"]["mean"].append(float(np.mean(non_zero_only)))
-            report["perSlice"]["median"].append(float(np.median(non_zero_only)))
-            report["perSlice"]["std"].append(float(np.std(non_zero_only)))
-            report["perSlice"]["min"].append(float(np.min(non_zero_only)))
-            report["perSlice"]["max"].append(float(np.max(non_zero_only)))
+    # the bounding box of each region is computed in a single pass so that each region
+    # is then processed on its own sub-volume rather than on the whole volume
+    # (on the index volume, the census is made on the indices of the regions, which are sorted like their ids)
+    label_per_region = None
+    if compacted_labels is not None:
+        census_ids = np.unique(
+            np.asarray(regions_ids, dtype=compacted_labels.ids.dtype)
+        )
+        census_labels = indicesOf(compacted_labels, census_ids)
+        label_per_region = dict(zip(census_ids.tolist(), census_labels.tolist()))
+    else:
+        census_ids = np.unique(np.asarray(regions_ids, dtype=volume.dtype))
+        census_labels = census_ids
 
-    # for the global approach, no need to
-    flat = ratios_per_region_per_slice.ravel()
-    flat_non_zero = flat[flat > 0]
-    report["global"]["mean"] = (
-        float(np.mean(flat_non_zero)) if len(non_zero_only) > 0 else None
-    )
-    report["global"]["median"] = (
-        float(np.median(flat_non_zero)) if len(non_zero_only) > 0 else None
-    )
-    report["global"]["std"] = (
-        float(np.std(flat_non_zero)) if len(non_zero_only) > 0 else None
-    )
-    report["global"]["min"] = (
-        float(np.min(flat_non_zero)) if len(non_zero_only) > 0 else None
+    if label_index is not None:
+        positions = np.searchsorted(label_index.ids, census_ids)
+        voxel_counts = label_index.counts[positions]
+        bounding_boxes = label_index.bounding_boxes[positions]
+    else:
+        with timePhase(timings, "census"):
+            voxel_counts, bounding_boxes = computeRegionCensus(volume, census_labels)
+    bounding_box_per_region = dict(zip(census_ids.tolist(), bounding_boxes))
+
+    # the largest regions are computed first so that they do not end up delaying the end of the computation
+    # (the wall time of each region is recorded to keep an eye on this)
+    voxel_count_per_region = dict(zip(census_ids.tolist(), voxel_counts.tolist()))
+    regions_ids = sorted(
+        regions_ids,
+        key=lambda id: voxel_count_per_region[int(id)],
+        reverse=True,
     )
-    report["global"]["max"] = (
-        float(np.max(flat_non_zero)) if len(non_zero_only) > 0 else None
+    # the regions computed at once must fit in the memory budget, considering the largest one
+    worker_memory = max(
+        [
+            estimateRegionMemory(
+                bounding_box_per_region[int(id)], coronal_axis_index, nb_slices
+            )
+            for id in regions_ids
+        ],
+        default=0,
     )
+    if max_memory is not None:
+        available_memory = max_memory - (volume.nbytes if backend == "process" else 0)
+        nb_fitting = max(1, available_memory // max(1, worker_memory))
 
-    return report
+        if worker_memory > available_memory:
+            print(
+                f"Warning: the largest region is estimated to need {worker_memory} bytes, over the memory budget"
+            )
+
+        if nb_fitting < nb_thread:
+            print(
+                f"running on {nb_fitting} {'processes' if backend == 'process' else 'threads'} instead of {nb_thread} to stay under the memory budget"
+            )
+            nb_thread = int(nb_fitting)
+
+    wall_time_per_region = None
+    if timings is not None:
+        timings["estimatedWorkerMemory"] = worker_memory
+        timings["nbWorkers"] = max(1, min(nb_thread, len(regions_ids)))
+        wall_time_per_region = timings["perRegion"] = {}
+
+    with timePhase(timings, "regions"):
+        if backend == "process":
+            print(f"computing on {nb_thread} processes...")
+            processPoolProcess(
+                volume,
+                regions_ids,
+                ratios_per_region,
+                report,
+                coronal_axis_index,
+                per_slice_axis,
+                bounding_box_per_region,
+                nb_thread,
+                label_per_region,
+                wall_time_per_region,
+            )
+        else:
+            print(f"computing on {nb_thread} threads...")
+            threadPoolProcess(
+                volume,
+                regions_ids,
+                ratios_per_region,
+                report,
+                coronal_axis_index,
+                per_slice_axis,
+                bounding_box_per_region,
+                nb_thread,
+                label_per_region,
+                executor,
+                wall_time_per_region,
+            )
@@ -1,6 +1,10 @@
 import json
 import nrrd
 import numpy as np
+from atlas_alignment_meter.labels import CompactedLabels, iterateChunks, lookupIndices
+
+# the metrics of each region (see core.computeRegionStats()), min and max being only per slice
+REGION_METRICS = ("mean", "std", "median")
 
 
 def createVolumeMetricsPerRegion(
@@ -9,25 +13,89 @@ def createVolumeMetricsPerRegion(
     reference_volume_meta,
     output_filepath,
     metric_name="mean",
+    fill_value=0.0,
 ):
     """
     Use precomputed metrics to export a NRRD file (volume) with a ratio-per-regions approach.
+    The metric of each voxel is looked up in a table of the metric of each label, for all the regions at once.
 
       Parameters:
         metrics_per_region (dict): the "perRegion" property of the precomputed metrics
-        reference_volume_data (np.ndarray): Numpy array of the original parcellation volume (used from creating an empty clone of the same size)
+        reference_volume_data (np.ndarray or CompactedLabels): Numpy array of the original parcellation volume (used from creating an empty clone of the same size),
+          or its compacted labels as given by labels.compactLabels(), which do not need any label lookup
         reference_volume_meta (dict): Metadata capturing the origin parcellation NRRD header. Used to conserve spatial transform
-        output_filepath (string): filepath where to save the metrics volume
-        metric_name (string): name of the metric to export in the volume. Can be "mean", "std" or "median" (default: "mean")
+        output_filepath (string or list): filepath where to save the metrics volume, or list of filepaths (one per metric) if several metrics are exported
+        metric_name (string or list): name of the metric to export in the volume. Can be "mean", "std" or "median", or a list of them to export
+          several metrics from the same pass over the labels (default: "mean")
+        fill_value (float): value given to the regions whose metric is None, such as the regions present on a single slice (default: 0.0)
     """
-    metric_volume = np.zeros_like(reference_volume_data, dtype=np.float32)
+    metric_names = [metric_name] if isinstance(metric_name, str) else metric_name
+    output_filepaths = (
+        [output_filepath] if isinstance(output_filepath, str) else output_filepath
+    )
 
-    for region_id in metrics_per_region:
-        metric_volume[reference_volume_data == int(region_id)] = float(
-            metrics_per_region[region_id][metric_name]
-        )
+    if len(metric_names) != len(output_filepaths):
+        raise Exception("There must be as many output filepaths as metrics to export")
+
+    for name in metric_names:
+        if name not in REGION_METRICS:
+            raise Exception(
+                f"The metric per region must be one of {REGION_METRICS}, not '{name}'"
+            )
+
+    # the keys are strings when the metrics are read from a JSON report
+    metrics_per_region = {int(id): metrics_per_region[id] for id in metrics_per_region}
+    region_ids = np.array(sorted(metrics_per_region), dtype=np.int64)
+
+    compacted_labels = None
+    if isinstance(reference_volume_data, CompactedLabels):
+        compacted_labels = reference_volume_data
+        reference_volume_data = compacted_labels.indices
+        region_ids = region_ids[np.isin(region_ids, compacted_labels.ids)]
+        table_positions = np.searchsorted(compacted_labels.ids, region_ids)
+        nb_labels = len(compacted_labels.ids)
+    else:
+        region_ids = region_ids.astype(reference_volume_data.dtype)
+        table_positions = np.arange(len(region_ids))
+        nb_labels = len(region_ids)
+
+    # one table per metric, with the value of each label. The last entry is for the labels
+    # that are not in the metrics (such as no_data)
+    metric_tables = []
+    for name in metric_names:
+        metric_table = np.zeros(nb_labels + 1, dtype=np.float32)
+        metric_table[table_positions] = [
+            (
+                fill_value
+                if metrics_per_region[id][name] is None
+                else metrics_per_region[id][name]
+            )
+            for id in region_ids.tolist()
+        ]
+        metric_tables.append(metric_table)
+
+    order = (
+        "F"
+        if reference_volume_data.flags.f_contiguous
+        and not reference_volume_data.flags.c_contiguous
+        else "C"
+    )
+    metric_volumes = [
+        np.zeros(reference_volume_data.shape, dtype=np.float32, order=order)
+        for _ in metric_names
+    ]
+
+    for chunk in iterateChunks(reference_volume_data):
+        if compacted_labels is not None:
+            indices = reference_volume_data[chunk]
+        else:
+            indices = lookupIndices(reference_volume_data[chunk], region_ids)
 
-    nrrd.write(output_filepath, metric_volume, reference_volume_meta)
+        for metric_volume, metric_table in zip(metric_volumes, metric_tables):
+            metric_volume[chunk] = metric_table[indices]
+
+    for metric_volume, filepath in zip(metric_volumes, output_filepaths):
+        nrrd.write(filepath, metric_volume, reference_volume_meta)
 
 
 def createVolumeMetricsPerSlice(
@@ -37,40 +105,70 @@ def createVolumeMetricsPerSlice(
     output_filepath,
     per_slice_axis=0,
     metric_name="mean",
+    out=None,
 ):
     """
     Use precomputed metrics to export a NRRD file (volume) with a ratio-per-slice approach.
+    The value of each slice is broadcast along the slicing axis and multiplied with the mask of the non-zero voxels.
 
       Parameters:
         metrics_per_slice (dict): the "perSlice" property of the precomputed metrics
-        reference_volume_data (np.ndarray): Numpy array of the original parcellation volume (used from creating an empty clone of the same size)
+        reference_volume_data (np.ndarray or CompactedLabels): Numpy array of the original parcellation volume (used from creating an empty clone of the same size),
+          or its compacted labels as given by labels.compactLabels()
         reference_volume_meta (dict): Metadata capturing the origin parcellation NRRD header. Used to conserve spatial transform
-        output_filepath (string): filepath where to save the metrics volume
+        output_filepath (string): filepath where to save the metrics volume. If None, the volume is only written in out
+        per_slice_axis (int): index of the axis orthogonal to the slices, the one the metrics were computed along (coronal_axis_index of core.compute()) (default: 0)
         metric_name (string): name of the metric to export in the volume. Can be "mean", "std" or "median", "min" and "max" (default: "mean")
+        out (np.ndarray): float32 array of the same shape as the volume in which to write the metrics volume, such as a
+          memory-mapped array, instead of allocating a new one (default: None)
+
+      Returns:
+        metric_volume (np.ndarray). The metrics volume (out, if provided)
     """
+    if per_slice_axis not in [0, 1, 2]:
+        raise Exception("The parameter per_slice_axis must be 0, 1 or 2")
 
-    metric_volume = np.zeros_like(reference_volume_data, dtype=np.float32)
+    no_data_label = 0
 
-    for slice_index in range(0, len(metrics_per_slice[metric_name])):
-        metric_value = float(metrics_per_slice[metric_name][slice_index] or 0)
+    if isinstance(reference_volume_data, CompactedLabels):
+        # the no_data label is the first of the sorted ids, if the volume has any
+        if reference_volume_data.ids[0] != 0:
+            no_data_label = len(reference_volume_data.ids)
+        reference_volume_data = reference_volume_data.indices
 
-        # would have liked to user .take instead but dont want to do a deepcopy, to slicing "dynamically" here
-        slice_ref = None
-        slice_out = None
+    metric_per_slice = np.array(
+        [value or 0 for value in metrics_per_slice[metric_name]], dtype=np.float32
+    )
+
+    if len(metric_per_slice) != reference_volume_data.shape[per_slice_axis]:
+        raise Exception(
+            f"There are {len(metric_per_slice)} slices in the metrics but {reference_volume_data.shape[per_slice_axis]} along the axis {per_slice_axis} of the volume"
+        )
 
-        if per_slice_axis == 0:
-            slice_ref = reference_volume_data[slice_index, :, :]
-            slice_out = metric_volume[slice_index, :, :]
-        elif per_slice_axis == 1:
-            slice_ref = reference_volume_data[:, slice_index, :]
-            slice_out = metric_volume[:, slice_index, :]
-        elif per_slice_axis == 2:
-            slice_ref = reference_volume_data[:, :, slice_index]
-            slice_out = metric_volume[:, :, slice_index]
+    # the value of each slice, broadcast along the slicing axis
+    broadcast_shape = [1, 1, 1]
+    broadcast_shape[per_slice_axis] = -1
+    metric_per_voxel = np.broadcast_to(
+        metric_per_slice.reshape(broadcast_shape), reference_volume_data.shape
+    )
 
-        if slice_ref is None:
-            raise Exception("The parameter per_slice_axis must be 0, 1 or 2")
+    if out is None:
+        order = (
+            "F"
+            if reference_volume_data.flags.f_contiguous
+            and not reference_volume_data.flags.c_contiguous
+            else "C"
+        )
+        out = np.zeros(reference_volume_data.shape, dtype=np.float32, order=order)
+
+    for chunk in iterateChunks(reference_volume_data):
+        np.multiply(
+            reference_volume_data[chunk] != no_data_label,
+            metric_per_voxel[chunk],
+            out=out[chunk],
+        )
 
-        slice_out[slice_ref != 0] = metric_value
+    if output_filepath is not None:
+        nrrd.write(output_filepath, out, reference_volume_meta)
 
-    nrrd.write(output_filepath, metric_volume, reference_volume_meta)
+    return out
@@ -0,0 +1,192 @@
+import os
+import zlib
+import numpy as np
+from atlas_alignment_meter import core
+from atlas_alignment_meter.profiling import timePhase
+
+
+def sliceChecksums(volume, coronal_axis_index=0):
+    """
+    Computes a checksum (CRC32) of each slice of a volume, to find the slices that changed from a version of the
+    volume to the next.
+
+      Parameters:
+        volume (np.ndarray): the annotation volume
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+
+      Returns:
+        checksums (np.ndarray). uint32 array of the checksum of each slice
+    """
+    checksums = np.zeros(volume.shape[coronal_axis_index], dtype=np.uint32)
+    crop = [slice(None)] * volume.ndim
+
+    # (indexing the slices is much faster than np.take() on a volume in Fortran order)
+    for i in range(len(checksums)):
+        crop[coronal_axis_index] = i
+        checksums[i] = zlib.crc32(np.ascontiguousarray(volume[tuple(crop)]))
+
+    return checksums
+
+
+def changedSlices(previous_checksums, checksums):
+    """
+    Finds the slices that changed from a version of a volume to the next, from their checksums.
+
+      Parameters:
+        previous_checksums (np.ndarray): the checksum of each slice of the previous volume, as given by sliceChecksums()
+        checksums (np.ndarray): the checksum of each slice of the new volume
+
+      Returns:
+        changed_slices (np.ndarray). The sorted indices of the slices that changed
+    """
+    if len(previous_checksums) != len(checksums):
+        raise Exception(
+            f"The volumes do not have the same number of slices ({len(previous_checksums)} and {len(checksums)})"
+        )
+
+    return np.flatnonzero(np.asarray(previous_checksums) != np.asarray(checksums))
+
+
+def affectedPairs(changed_slices, nb_slices):
+    """
+    Finds the slice pairs whose ratios change when some slices change: the ratio i of a region is measured between
+    the slice i and the slice i+1, so a change of the slice i affects the ratios i-1 and i. The ratios of the first
+    and last slices are always 0 and are not affected.
+
+      Parameters:
+        changed_slices (list): the indices of the slices that changed
+        nb_slices (int): the number of slices of the volume
+
+      Returns:
+        pairs (np.ndarray). The sorted indices of the affected ratios
+    """
+    changed_slices = np.asarray(changed_slices, dtype=np.int64)
+    pairs = np.unique(np.concatenate([changed_slices - 1, changed_slices]))
+    return pairs[(pairs > 0) & (pairs < nb_slices - 1)]
+
+
+def _pairRuns(pairs):
+    """
+    Splits sorted pair indices into runs of consecutive pairs, given as (first, last) tuples
+    """
+    if len(pairs) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(pairs) > 1)
+    starts = np.concatenate([[0], breaks + 1])
+    stops = np.concatenate([breaks, [len(pairs) - 1]])
+    return list(zip(pairs[starts].tolist(), pairs[stops].tolist()))
+
+
+def updateRatios(volume, ratios_per_region, pairs, coronal_axis_index=0):
+    """
+    Computes again the given ratios of the regions whose ratios were already computed, on the slices they are
+    measured on only. The regions that are no longer on these slices get a ratio of 0.
+
+      Parameters:
+        volume (np.ndarray): the annotation volume
+        ratios_per_region (dict): OUTPUT. the ratios for each slice of each region (key: region id), of which the
+          affected ratios are updated
+        pairs (np.ndarray): the sorted indices of the ratios to compute again, as given by affectedPairs()
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+    """
+    region_ids = np.array(sorted(ratios_per_region), dtype=volume.dtype)
+
+    for first, last in _pairRuns(pairs):
+        # the slices the ratios first to last are measured on
+        crop = [slice(None)] * volume.ndim
+        crop[coronal_axis_index] = slice(first, last + 2)
+        slab = volume[tuple(crop)]
+
+        # with an empty slice before the slab, so that computeRatiosFromCounts() only discards the ratios
+        # of this empty slice and of the last slice of the slab (which is measured with the first one)
+        nb_slab_slices = last - first + 2
+        presence = np.zeros((len(region_ids), nb_slab_slices + 1), dtype=np.int64)
+        same = np.zeros_like(presence)
+        core.accumulatePairCounts(
+            slab,
+            region_ids,
+            presence[:, 1:],
+            same[:, 1:],
+            coronal_axis_index=coronal_axis_index,
+        )
+        ratios = core.computeRatiosFromCounts(presence, same)[:, 1:-1]
+
+        for id, region_ratios in zip(region_ids.tolist(), ratios):
+            ratios_per_region[id][first : last + 1] = region_ratios
+
+
+def computeIncremental(
+    volume,
+    ratios_per_region,
+    checksums=None,
+    changed_slices=None,
+    coronal_axis_index=0,
+    regions=None,
+    precomputed_all_region_ids=None,
+    nb_thread=os.cpu_count() - 1,
+    engine="region",
+    timings=None,
+):
+    """
+    Compute the metrics of the jaggedness of a volume of which only a few slices changed since the ratios of its
+    regions were computed (such as in an iterative realignment). Only the ratios measured on the changed slices are
+    computed again, then the metrics are aggregated from all the ratios. This gives the same metrics as compute().
+
+      Parameters:
+        volume (np.ndarray): the new annotation volume
+        ratios_per_region (dict): OUTPUT. the ratios for each slice of each region (key: region id) computed on the
+          previous volume, as filled by compute(). They are updated to the ones of the new volume
+        checksums (np.ndarray): OUTPUT. the checksum of each slice of the previous volume, as given by sliceChecksums(),
+          to find the changed slices. They are updated to the ones of the new volume (default: None)
+        changed_slices (list): the indices of the slices that changed, if known. Either checksums or changed_slices
+          must be provided (default: None)
+        coronal_axis_index (int): index of the axis orthogonal to the slices (default: 0)
+        regions (list): list of region ids (integers) to run the metrics on, see compute() (default: None, all the regions)
+        precomputed_all_region_ids (list): the list of the regions of the new volume, if already computed, see compute() (default: None)
+        nb_thread (int): number of threads to compute the regions that were not computed on the previous volume, see compute() (default: number of thread available - 1)
+        engine (string): engine to compute the regions that were not computed on the previous volume, see compute() (default: "region")
+        timings (dict): OUTPUT. if provided, the timings of the computation are added to it as by compute(), with the
+          number of changed slices "nbChangedSlices" (default: None, nothing is measured)
+
+      Returns:
+        metrics (dict). Metrics per slice, per region and global, as given by compute()
+    """
+    if checksums is None and changed_slices is None:
+        raise Exception(
+            "Either the checksums of the previous volume or the changed slices must be provided"
+        )
+
+    nb_slices = volume.shape[coronal_axis_index]
+
+    if checksums is not None:
+        with timePhase(timings, "checksums"):
+            new_checksums = sliceChecksums(volume, coronal_axis_index)
+
+            if changed_slices is None:
+                changed_slices = changedSlices(checksums, new_checksums)
+
+            checksums[...] = new_checksums
+
+    with timePhase(timings, "incremental"):
+        pairs = affectedPairs(changed_slices, nb_slices)
+        updateRatios(volume, ratios_per_region, pairs, coronal_axis_index)
+
+    print(
+        f"{len(changed_slices)} changed slices, {len(pairs)} ratios computed again per region"
+    )
+
+    if timings is not None:
+        timings["nbChangedSlices"] = len(changed_slices)
+
+    # the regions that were not computed on the previous volume are computed entirely
+    return core.compute(
+        volume,
+        coronal_axis_index=coronal_axis_index,
+        regions=regions,
+        precomputed_all_region_ids=precomputed_all_region_ids,
+        nb_thread=nb_thread,
+        engine=engine,
+        ratios_per_region=ratios_per_region,
+        timings=timings,
+    )
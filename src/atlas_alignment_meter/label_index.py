@@ -0,0 +1,255 @@
+from collections import namedtuple
+import hashlib
+import os
+import zipfile
+import nrrd
+import numpy as np
+from atlas_alignment_meter import core
+from atlas_alignment_meter.labels import CompactedLabels, compactLabels
+
+# version of the content of the label index files, to change when it changes
+_FORMAT_VERSION = 1
+
+# size of the blocks read to compute the content hash of a file
+_HASH_BLOCK_SIZE = 2**20
+
+# The census of the labels of an annotation volume, that can be stored next to the volume and reused across runs:
+#   ids (np.ndarray): sorted array of the labels of the volume
+#   counts (np.ndarray): number of voxels of each label of ids
+#   bounding_boxes (np.ndarray): (nb_labels, 3, 2) array of the start (inclusive) and stop (exclusive) indices of each
+#     label along each axis, bounding_boxes[:, axis] being the range of slices of each label along this axis
+#   shape (tuple): the shape of the volume
+LabelIndex = namedtuple("LabelIndex", ["ids", "counts", "bounding_boxes", "shape"])
+
+
+def buildLabelIndex(volume):
+    """
+    Builds the label index of an annotation volume, in a single pass over the volume.
+
+      Parameters:
+        volume (np.ndarray or CompactedLabels): the annotation volume, or its compacted labels as given by labels.compactLabels()
+
+      Returns:
+        label_index (LabelIndex). The ids, voxel counts, bounding boxes of the labels and the shape of the volume
+    """
+    if isinstance(volume, CompactedLabels):
+        compacted_labels = volume
+    else:
+        compacted_labels = compactLabels(volume)
+
+    indices = compacted_labels.indices
+    _, bounding_boxes = core.computeRegionCensus(
+        indices, np.arange(len(compacted_labels.ids), dtype=indices.dtype)
+    )
+
+    return LabelIndex(
+        compacted_labels.ids, compacted_labels.counts, bounding_boxes, indices.shape
+    )
+
+
+def labelIndexFilepath(volume_filepath, index_dir=None):
+    """
+    Gets the path of the label index file of a volume, stored next to it (ex. annotation.nrrd.labels.npz), or in a
+    folder such as the cache folder, named after the absolute path of the volume (ex. annotation.nrrd.<hash>.labels.npz)
+
+      Parameters:
+        volume_filepath (string): path to the NRRD file of the volume
+        index_dir (string): path to the folder of the label index file (default: None, next to the volume)
+
+      Returns:
+        filepath (string). The path to the label index file
+    """
+    if index_dir is None:
+        return f"{volume_filepath}.labels.npz"
+
+    # the volumes of the same name in different folders do not share their label index file
+    path_hash = hashlib.sha256(os.path.abspath(volume_filepath).encode()).hexdigest()
+    return os.path.join(
+        index_dir, f"{os.path.basename(volume_filepath)}.{path_hash[:16]}.labels.npz"
+    )
+
+
+def volumeFilepaths(volume_filepath):
+    """
+    Gets the files a volume is stored in: the NRRD file, and its detached data file if any.
+
+      Parameters:
+        volume_filepath (string): path to the NRRD file of the volume
+
+      Returns:
+        filepaths (list). The paths to the files of the volume
+    """
+    header = nrrd.read_header(volume_filepath)
+    data_filepath = header.get("data file", header.get("datafile"))
+
+    if data_filepath is None:
+        return [volume_filepath]
+
+    if not os.path.isabs(data_filepath):
+        data_filepath = os.path.join(os.path.dirname(volume_filepath), data_filepath)
+
+    return [volume_filepath, data_filepath]
+
+
+def fileStamps(filepaths):
+    """
+    Gets the size and modification time of some files, to check quickly whether the files changed.
+
+      Parameters:
+        filepaths (list): paths to the files
+
+      Returns:
+        stamps (np.ndarray). (nb_files, 2) array of the size and modification time (ns) of each file
+    """
+    stamps = []
+
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        stamps.append([stat.st_size, stat.st_mtime_ns])
+
+    return np.array(stamps, dtype=np.int64)
+
+
+def contentHash(filepaths):
+    """
+    Computes the hash (SHA-256) of the content of some files, such as the NRRD file of a volume and its detached data file.
+
+      Parameters:
+        filepaths (list): paths to the files
+
+      Returns:
+        hash (string). The hexadecimal digest of the content of the files
+    """
+    content_hash = hashlib.sha256()
+
+    for filepath in filepaths:
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+                content_hash.update(block)
+
+    return content_hash.hexdigest()
+
+
+def saveLabelIndex(
+    label_index, volume_filepath, index_filepath=None, content_hash=None
+):
+    """
+    Saves the label index of a volume in a file, keyed by the content hash and the modification time of the volume files.
+
+      Parameters:
+        label_index (LabelIndex): the label index, as given by buildLabelIndex()
+        volume_filepath (string): path to the NRRD file of the volume
+        index_filepath (string): path to the label index file (default: None, next to the volume, see labelIndexFilepath())
+        content_hash (string): the content hash of the volume files, if already computed (default: None, see contentHash())
+    """
+    if index_filepath is None:
+        index_filepath = labelIndexFilepath(volume_filepath)
+
+    volume_filepaths = volumeFilepaths(volume_filepath)
+
+    if content_hash is None:
+        content_hash = contentHash(volume_filepaths)
+
+    # written in a temporary file first, so that a concurrent run never reads a partial file
+    temporary_filepath = f"{index_filepath}.{os.getpid()}.tmp"
+
+    with open(temporary_filepath, "wb") as f:
+        np.savez(
+            f,
+            version=_FORMAT_VERSION,
+            content_hash=content_hash,
+            file_stamps=fileStamps(volume_filepaths),
+            ids=label_index.ids,
+            counts=label_index.counts,
+            bounding_boxes=label_index.bounding_boxes,
+            shape=np.array(label_index.shape),
+        )
+
+    os.replace(temporary_filepath, index_filepath)
+
+
+def loadLabelIndex(volume_filepath, index_filepath=None):
+    """
+    Loads the label index of a volume, if it exists and is still valid. When the modification time (or size) of the volume
+    files changed since the index was saved, the content hash of the files is checked, and the index is still used (and its
+    modification times updated) if the content is the same.
+
+      Parameters:
+        volume_filepath (string): path to the NRRD file of the volume
+        index_filepath (string): path to the label index file (default: None, next to the volume, see labelIndexFilepath())
+
+      Returns:
+        label_index (LabelIndex). The label index, or None if there is no valid label index for the volume
+    """
+    if index_filepath is None:
+        index_filepath = labelIndexFilepath(volume_filepath)
+
+    if not os.path.exists(index_filepath):
+        return None
+
+    volume_filepaths = volumeFilepaths(volume_filepath)
+
+    try:
+        with np.load(index_filepath) as data:
+            if int(data["version"]) != _FORMAT_VERSION:
+                return None
+
+            label_index = LabelIndex(
+                data["ids"],
+                data["counts"],
+                data["bounding_boxes"],
+                tuple(data["shape"].tolist()),
+            )
+            stored_hash = str(data["content_hash"])
+            stored_stamps = data["file_stamps"]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # a damaged index file (ex. truncated by an interrupted run), the index is built again
+        return None
+
+    stamps = fileStamps(volume_filepaths)
+
+    if stamps.shape == stored_stamps.shape and np.array_equal(stamps, stored_stamps):
+        return label_index
+
+    if contentHash(volume_filepaths) != stored_hash:
+        return None
+
+    # the files were touched (ex. copied) but not changed
+    try:
+        saveLabelIndex(label_index, volume_filepath, index_filepath, stored_hash)
+    except OSError:
+        pass
+
+    return label_index
+
+
+def volumeContentHash(volume_filepath, index_filepath=None):
+    """
+    Gets the content hash of the volume files (see contentHash()), reading it from the label index file of the volume
+    when the files have the same size and modification time as when the index was saved, so that the files are not
+    read again.
+
+      Parameters:
+        volume_filepath (string): path to the NRRD file of the volume
+        index_filepath (string): path to the label index file (default: None, next to the volume, see labelIndexFilepath())
+
+      Returns:
+        hash (string). The hexadecimal digest of the content of the volume files
+    """
+    if index_filepath is None:
+        index_filepath = labelIndexFilepath(volume_filepath)
+
+    volume_filepaths = volumeFilepaths(volume_filepath)
+
+    if os.path.exists(index_filepath):
+        try:
+            with np.load(index_filepath) as data:
+                if int(data["version"]) == _FORMAT_VERSION and np.array_equal(
+                    fileStamps(volume_filepaths), data["file_stamps"]
+                ):
+                    return str(data["content_hash"])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # a damaged index file, the files are hashed instead
+            pass
+
+    return contentHash(volume_filepaths)
@@ -0,0 +1,157 @@
+from collections import namedtuple
+import numpy as np
+
+# maximum number of voxels processed at once, by compactLabels() and by the counts of the core module (see iterateChunks())
+CHUNK_NB_VOXELS = 2**22
+
+# The region labels of an annotation volume, compacted so that they can be used as indices:
+#   indices (np.ndarray): volume of the same shape as the annotation volume, in which each label is replaced
+#     by its position in ids (uint16, or uint32 if there are 65536 labels or more)
+#   ids (np.ndarray): sorted array of the labels of the volume (the lookup table from index to label)
+#   counts (np.ndarray): number of voxels of each label of ids
+CompactedLabels = namedtuple("CompactedLabels", ["indices", "ids", "counts"])
+
+
+def compactLabels(volume):
+    """
+    Compacts the region labels of an annotation volume. Allen annotation ids are sparse values (up to
+    hundreds of millions), while their positions in the sorted list of the ids of the volume are dense, and
+    can directly be used with np.bincount() or to index a lookup table. This is done once per volume, and
+    the result can then be given to core.compute(), to the export_volume functions and to the region selection.
+
+      Parameters:
+        volume (np.ndarray): the annotation volume containing region labels (integers)
+
+      Returns:
+        compacted_labels (CompactedLabels). The index volume, the ids and the voxel counts of the labels
+    """
+    ids, counts = np.unique(volume, return_counts=True)
+    index_dtype = np.uint16 if len(ids) < 2**16 else np.uint32
+
+    # keeps the memory layout of the volume (nrrd.read() gives Fortran-ordered arrays)
+    order = "F" if volume.flags.f_contiguous and not volume.flags.c_contiguous else "C"
+    indices = np.empty(volume.shape, dtype=index_dtype, order=order)
+
+    # converted chunk by chunk, to keep np.searchsorted()'s int64 output small
+    for chunk in iterateChunks(volume):
+        indices[chunk] = np.searchsorted(ids, volume[chunk])
+
+    return CompactedLabels(indices, ids, counts)
+
+
+def chunkAxis(volume):
+    """
+    Gets the slowest-varying axis of a volume, along which the consecutive elements are the furthest apart in memory,
+    so that each chunk taken along this axis is a contiguous block of memory.
+
+      Parameters:
+        volume (np.ndarray): the volume
+
+      Returns:
+        axis (int). The slowest-varying axis
+    """
+    return int(np.argmax(np.abs(volume.strides)))
+
+
+def iterateChunks(volume, axis=None):
+    """
+    Cuts a volume into chunks of a few millions of voxels (CHUNK_NB_VOXELS), made of consecutive slices along an axis,
+    so that the temporary arrays made from each chunk remain small. Along the slowest-varying axis, each chunk is
+    contiguous in memory (or on disk, for a memory-mapped volume).
+
+      Parameters:
+        volume (np.ndarray): the volume to cut
+        axis (int): the axis along which the volume is cut (default: None, the slowest-varying axis, see chunkAxis())
+
+      Returns:
+        chunks (generator). Yields the index (tuple of slices) of each chunk in the volume
+    """
+    if axis is None:
+        axis = chunkAxis(volume)
+
+    slice_size = max(1, volume.size // max(1, volume.shape[axis]))
+    chunk_size = max(1, CHUNK_NB_VOXELS // slice_size)
+
+    for start in range(0, volume.shape[axis], chunk_size):
+        chunk = [slice(None)] * volume.ndim
+        chunk[axis] = slice(start, start + chunk_size)
+        yield tuple(chunk)
+
+
+def indicesOf(compacted_labels, region_ids):
+    """
+    Gets the indices of some regions in the index volume of compacted labels.
+
+      Parameters:
+        compacted_labels (CompactedLabels): the compacted labels, as given by compactLabels()
+        region_ids (list): ids of regions present in the volume
+
+      Returns:
+        indices (np.ndarray). The index of each region, with the dtype of the index volume
+    """
+    return np.searchsorted(compacted_labels.ids, region_ids).astype(
+        compacted_labels.indices.dtype
+    )
+
+
+def lookupIndices(block, region_ids):
+    """
+    Converts the region labels of a block into compacted indices: the position of each label in
+    region_ids, or len(region_ids) for the labels that are not in region_ids (including no_data).
+
+      Parameters:
+        block (np.ndarray): part of the annotation volume containing region labels (integers)
+        region_ids (np.ndarray): sorted array of the region ids to keep, with the same dtype as block
+
+      Returns:
+        indices (np.ndarray). Array of the same shape as block
+    """
+    nb_regions = len(region_ids)
+
+    if nb_regions == 0:
+        return np.zeros(block.shape, dtype=np.intp)
+
+    # small unsigned labels (ex. the index volume of compacted labels) go through a lookup table,
+    # which is much faster than a binary search
+    if block.dtype.kind == "u" and block.dtype.itemsize <= 2:
+        lookup_table = np.full(2 ** (8 * block.dtype.itemsize), nb_regions)
+        lookup_table[region_ids] = np.arange(nb_regions)
+        return lookup_table[block]
+
+    indices = np.searchsorted(region_ids, block)
+    np.minimum(indices, nb_regions - 1, out=indices)
+    indices[region_ids[indices] != block] = nb_regions
+    return indices
+
+
+def selectRegions(regions_spec, compacted_labels=None):
+    """
+    Selects the regions to run the metrics on, from the value of the --regions option.
+
+      Parameters:
+        regions_spec (string): comma-separated list of region ids, or "LARGEST,N" or "SMALLEST,N"
+        compacted_labels (CompactedLabels or label_index.LabelIndex): the compacted labels or the label index of the
+          volume, for their ids and voxel counts (only used with "LARGEST,N" or "SMALLEST,N", the index volume is not
+          needed)
+
+      Returns:
+        regions (list). The ids of the selected regions
+    """
+    is_largest = regions_spec.upper().strip().startswith("LARGEST")
+    is_smallest = regions_spec.upper().strip().startswith("SMALLEST")
+
+    if not is_largest and not is_smallest:
+        return list(map(lambda id: int(id), regions_spec.split(",")))
+
+    nb_to_keep = int(regions_spec.split(",")[-1])
+    ids = np.asarray(compacted_labels.ids)
+    counts = np.asarray(compacted_labels.counts, dtype=np.int64)
+
+    # a stable sort, so that the regions of the same size are all kept, in the order of their ids
+    order = np.argsort(-counts if is_largest else counts, kind="stable")
+    region_ids = ids[order]
+
+    # the no_data case
+    region_ids = region_ids[region_ids != 0]
+
+    return region_ids[:nb_to_keep].tolist()
@@ -0,0 +1,358 @@
+import bz2
+import gzip
+import os
+import nrrd
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    # optional, to read HDF5 files
+    h5py = None
+
+try:
+    import zarr
+except ImportError:
+    # optional, to read zarr arrays
+    zarr = None
+
+# default number of voxels in each slab read by iterateSlabs()
+_SLAB_NB_VOXELS = 2**22
+
+# NRRD types (and their synonyms) to numpy types, the endianness being added from the header
+_NRRD_TYPES = {
+    "int8": "i1",
+    "uint8": "u1",
+    "int16": "i2",
+    "uint16": "u2",
+    "int32": "i4",
+    "uint32": "u4",
+    "int64": "i8",
+    "uint64": "u8",
+    "float": "f4",
+    "double": "f8",
+}
+
+_NRRD_TYPE_SYNONYMS = {
+    "signed char": "int8",
+    "int8_t": "int8",
+    "uchar": "uint8",
+    "unsigned char": "uint8",
+    "uint8_t": "uint8",
+    "short": "int16",
+    "short int": "int16",
+    "signed short": "int16",
+    "signed short int": "int16",
+    "int16_t": "int16",
+    "ushort": "uint16",
+    "unsigned short": "uint16",
+    "unsigned short int": "uint16",
+    "uint16_t": "uint16",
+    "int": "int32",
+    "signed int": "int32",
+    "int32_t": "int32",
+    "uint": "uint32",
+    "unsigned int": "uint32",
+    "uint32_t": "uint32",
+    "longlong": "int64",
+    "long long": "int64",
+    "long long int": "int64",
+    "signed long long": "int64",
+    "signed long long int": "int64",
+    "int64_t": "int64",
+    "ulonglong": "uint64",
+    "unsigned long long": "uint64",
+    "unsigned long long int": "uint64",
+    "uint64_t": "uint64",
+}
+
+
+def getDataType(header):
+    """
+    Get the numpy data type of the voxels of a NRRD file.
+
+      Parameters:
+        header (dict): the NRRD header, as read by nrrd.read_header()
+
+      Returns:
+        dtype (np.dtype). The data type, with the endianness of the file
+    """
+    nrrd_type = header["type"].strip().lower()
+    nrrd_type = _NRRD_TYPE_SYNONYMS.get(nrrd_type, nrrd_type)
+
+    if nrrd_type not in _NRRD_TYPES:
+        raise Exception(f"Unsupported NRRD type: {header['type']}")
+
+    dtype = np.dtype(_NRRD_TYPES[nrrd_type])
+
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder(">" if header.get("endian") == "big" else "<")
+
+    return dtype
+
+
+def _openDataSection(filepath, header):
+    """
+    Opens the file containing the data of a NRRD file (the NRRD file itself or the detached data file)
+    and moves to the beginning of the data, after the header and the line skip.
+
+      Returns:
+        fh (file). The opened file, in binary mode, positioned at the beginning of the data
+    """
+    data_filepath = header.get("data file", header.get("datafile"))
+
+    if data_filepath is None:
+        fh = open(filepath, "rb")
+        nrrd.read_header(fh)
+    else:
+        if data_filepath.startswith("LIST") or " " in data_filepath.strip():
+            raise Exception(
+                "NRRD files with multiple detached data files are not supported"
+            )
+
+        if not os.path.isabs(data_filepath):
+            data_filepath = os.path.join(os.path.dirname(filepath), data_filepath)
+
+        fh = open(data_filepath, "rb")
+
+    for _ in range(int(header.get("line skip", header.get("lineskip", 0)))):
+        fh.readline()
+
+    return fh
+
+
+def _readExactly(stream, nb_bytes):
+    """
+    Reads exactly nb_bytes from a stream, which may return fewer bytes at once (ex. when decompressing)
+    """
+    buffer = bytearray(nb_bytes)
+    view = memoryview(buffer)
+    position = 0
+
+    while position < nb_bytes:
+        nb_read = stream.readinto(view[position:])
+
+        if not nb_read:
+            raise Exception(
+                f"The NRRD data section is shorter than expected ({position} bytes instead of {nb_bytes})"
+            )
+
+        position += nb_read
+
+    return buffer
+
+
+def iterateSlabs(filepath, slab_size=None):
+    """
+    Reads the volume of a NRRD file slab by slab, so that the whole volume never has to be in memory at once.
+    The slabs are made of consecutive slices along the slowest-varying axis of the file (the last axis of the
+    array given by nrrd.read()), since this is the order in which the data are stored. Compressed files (gzip, bzip2)
+    are decompressed on the fly.
+
+      Parameters:
+        filepath (string): path to the NRRD file
+        slab_size (int): number of slices of each slab (default: a few millions of voxels per slab)
+
+      Returns:
+        slabs (generator). Yields the index of the first slice of each slab, and the slab (np.ndarray, with the
+          same axis order as the array given by nrrd.read())
+    """
+    header = nrrd.read_header(filepath)
+    sizes = [int(size) for size in header["sizes"]]
+    dtype = getDataType(header)
+    encoding = header["encoding"].strip().lower()
+
+    slice_size = int(np.prod(sizes[:-1]))
+    nb_slices = sizes[-1]
+    data_nbytes = slice_size * nb_slices * dtype.itemsize
+
+    if slab_size is None:
+        slab_size = max(1, _SLAB_NB_VOXELS // max(1, slice_size))
+
+    byte_skip = int(header.get("byte skip", header.get("byteskip", 0)))
+    fh = _openDataSection(filepath, header)
+
+    try:
+        if encoding == "raw":
+            if byte_skip == -1:
+                fh.seek(-data_nbytes, os.SEEK_END)
+            else:
+                fh.seek(byte_skip, os.SEEK_CUR)
+            stream = fh
+        elif encoding in ["gzip", "gz"]:
+            stream = gzip.GzipFile(fileobj=fh, mode="rb")
+        elif encoding in ["bzip2", "bz2"]:
+            stream = bz2.BZ2File(fh, mode="rb")
+        else:
+            raise Exception(
+                f"Reading slab by slab is not supported for the encoding '{encoding}'"
+            )
+
+        # with compressed data, the byte skip applies to the decompressed data
+        if encoding != "raw":
+            if byte_skip == -1:
+                raise Exception(
+                    "A byte skip of -1 is only supported for raw NRRD files"
+                )
+            _readExactly(stream, byte_skip)
+
+        for start in range(0, nb_slices, slab_size):
+            nb_slab_slices = min(slab_size, nb_slices - start)
+            buffer = _readExactly(stream, nb_slab_slices * slice_size * dtype.itemsize)
+
+            # the NRRD sizes are given from the fastest to the slowest varying axis
+            slab = np.frombuffer(buffer, dtype=dtype)
+            slab = slab.reshape([nb_slab_slices] + sizes[-2::-1]).T
+            yield start, slab
+    finally:
+        fh.close()
+
+
+def iterateArraySlabs(array, axis, slab_size):
+    """
+    Reads an array slab by slab, such as a memory-mapped array or a chunked array (HDF5 dataset, zarr array) that
+    does not fit in memory.
+
+      Parameters:
+        array (array-like): the array, giving access to slabs with numpy indexing
+        axis (int): the axis along which the array is cut into slabs
+        slab_size (int): number of slices of each slab
+
+      Returns:
+        slabs (generator). Yields the index of the first slice of each slab, and the slab (np.ndarray)
+    """
+    shape = tuple(array.shape)
+
+    for start in range(0, shape[axis], slab_size):
+        crop = [slice(None)] * len(shape)
+        crop[axis] = slice(start, start + slab_size)
+        yield start, np.asarray(array[tuple(crop)])
+
+
+def openArray(filepath, dataset=None):
+    """
+    Opens a volume without reading it into memory, so that it can be computed slab by slab by core.compute():
+    a raw NRRD file or a .npy file is memory-mapped, an HDF5 file (.h5, .hdf5, requires h5py) or a zarr
+    array (.zarr, requires zarr) is read chunk by chunk when accessed.
+
+      Parameters:
+        filepath (string): path to the volume file (or folder, for zarr)
+        dataset (string): the path of the volume in the HDF5 file or in the zarr group (default: None, for
+          HDF5 files the only dataset of the file)
+
+      Returns:
+        volume (array-like). The volume
+    """
+    extension = os.path.splitext(filepath.rstrip("/"))[1].lower()
+
+    if extension == ".nrrd":
+        return memoryMapVolume(filepath)
+
+    if extension == ".npy":
+        return np.load(filepath, mmap_mode="r")
+
+    if extension in [".h5", ".hdf5"]:
+        if h5py is None:
+            raise Exception("h5py is required to read HDF5 files (pip install h5py)")
+
+        h5_file = h5py.File(filepath, "r")
+        if dataset is None:
+            if len(h5_file.keys()) != 1:
+                raise Exception(
+                    f"The HDF5 file has several datasets, one of {list(h5_file.keys())} must be given"
+                )
+            dataset = list(h5_file.keys())[0]
+
+        return h5_file[dataset]
+
+    if extension == ".zarr":
+        if zarr is None:
+            raise Exception("zarr is required to read zarr arrays (pip install zarr)")
+
+        array = zarr.open(filepath, mode="r")
+        return array[dataset] if dataset is not None else array
+
+    raise Exception(f"Unsupported volume file extension '{extension}'")
+
+
+def canMemoryMap(header):
+    """
+    Whether the volume of a NRRD file can be memory-mapped, meaning its data are stored raw (not compressed nor as text)
+    in a single file.
+
+      Parameters:
+        header (dict): the NRRD header, as read by nrrd.read_header()
+
+      Returns:
+        bool. True if the volume can be memory-mapped
+    """
+    data_filepath = header.get("data file", header.get("datafile"))
+
+    if data_filepath is not None and (
+        data_filepath.startswith("LIST") or " " in data_filepath.strip()
+    ):
+        return False
+
+    return header["encoding"].strip().lower() == "raw"
+
+
+def memoryMapVolume(filepath, header=None):
+    """
+    Opens the volume of a raw NRRD file (or of its detached data file) as a read-only memory-mapped array,
+    instead of reading it into memory. The voxels are only read from disk when accessed, and several processes
+    mapping the same file share the same memory.
+
+      Parameters:
+        filepath (string): path to the NRRD file
+        header (dict): the NRRD header, if already read (default: None)
+
+      Returns:
+        volume (np.memmap). Read-only array with the same shape and axis order as the array given by nrrd.read()
+    """
+    if header is None:
+        header = nrrd.read_header(filepath)
+
+    if not canMemoryMap(header):
+        raise Exception(
+            f"Only raw NRRD files can be memory-mapped (encoding: {header['encoding']})"
+        )
+
+    sizes = tuple(int(size) for size in header["sizes"])
+    dtype = getDataType(header)
+    data_nbytes = int(np.prod(sizes)) * dtype.itemsize
+    byte_skip = int(header.get("byte skip", header.get("byteskip", 0)))
+
+    fh = _openDataSection(filepath, header)
+
+    try:
+        if byte_skip == -1:
+            offset = os.fstat(fh.fileno()).st_size - data_nbytes
+        else:
+            offset = fh.tell() + byte_skip
+
+        return np.memmap(
+            fh, dtype=dtype, mode="r", offset=offset, shape=sizes, order="F"
+        )
+    finally:
+        fh.close()
+
+
+def loadVolume(filepath, mmap="auto"):
+    """
+    Loads the volume and the header of a NRRD file, memory-mapping the volume when possible.
+
+      Parameters:
+        filepath (string): path to the NRRD file
+        mmap (string or bool): True to memory-map the volume (raises an exception if the file is not raw), False to
+          read it into memory with nrrd.read(), "auto" to memory-map it only if the file is raw (default: "auto")
+
+      Returns:
+        volume (np.ndarray). The volume, as given by nrrd.read()
+        header (dict). The NRRD header
+    """
+    header = nrrd.read_header(filepath)
+
+    if mmap is True or (mmap == "auto" and canMemoryMap(header)):
+        return memoryMapVolume(filepath, header), header
+
+    return nrrd.read(filepath)
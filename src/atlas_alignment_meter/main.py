@@ -1,13 +1,26 @@
 import argparse
+import glob
 import sys
-from atlas_alignment_meter import __version__
-import nrrd
-import json
-from atlas_alignment_meter import core
-from atlas_alignment_meter import export_volume
-import numpy as np
 import os
 
+# numpy, pynrrd and the modules of the computation are only imported by run(), once the arguments are parsed and
+# checked, so that --help, --version and the errors on the arguments are immediate (see benchmarks/startup.py)
+
+
+class VersionAction(argparse.Action):
+    """Print the version and exit, like the "version" action of argparse, but reading the version only when asked"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, help=None):
+        super().__init__(
+            option_strings, dest=dest, default=argparse.SUPPRESS, nargs=0, help=help
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from atlas_alignment_meter import __version__
+
+        print(f"atlas-alignment-meter {__version__}")
+        parser.exit()
+
 
 def parse_args(args):
     """Parse command line parameters
@@ -18,11 +31,14 @@ def parse_args(args):
     Returns:
       :obj:`argparse.Namespace`: command line parameters namespace
     """
-    parser = argparse.ArgumentParser(description="Just a Fibonacci demonstration")
+    parser = argparse.ArgumentParser(
+        description="Just a Fibonacci demonstration",
+        epilog="To compute many volumes in a single process, see the batch command: atlas-alignment-meter batch --help",
+    )
     parser.add_argument(
         "--version",
-        action="version",
-        version="atlas-alignment-meter {ver}".format(ver=__version__),
+        action=VersionAction,
+        help="show program's version number and exit",
     )
 
     parser.add_argument(
@@ -40,7 +56,23 @@ def parse_args(args):
         dest="out_report",
         required=True,
         metavar="<FILE PATH>",
-        help="Path to the JSON report file (output)",
+        help="Path to the report file (output). The report is written as JSON, or in a binary format (one array per column of the report, that can be memory-mapped, see report_file.loadReport()) if the file name ends with .npz",
+    )
+
+    parser.add_argument(
+        "--report-ratios",
+        required=False,
+        dest="report_ratios",
+        action="store_true",
+        help="Add to a binary report (.npz) the matrix of the ratios of each region on each slice (not with --axis ALL) (default: off)",
+    )
+
+    parser.add_argument(
+        "--report-ratio-spans",
+        required=False,
+        dest="report_ratio_spans",
+        action="store_true",
+        help="Add to the report (JSON or .npz) the ratios of each region over its own slice span, from its first to its last non-zero ratio, as a start slice and float32 ratios (see region_ratios.loadRegionRatios()). Not with --axis ALL nor --sample-slices/--sample-regions (default: off)",
     )
 
     parser.add_argument(
@@ -68,9 +100,10 @@ def parse_args(args):
         "-vm",
         dest="out_metric",
         required=False,
-        default="MEDIAN",
+        default=["MEDIAN"],
+        nargs="+",
         choices=["MEAN", "MEDIAN", "STD", "MIN", "MAX"],
-        help="Metric to export in the volume. Only works with --output-per-region-volume and --output-per-slice-volume (default: MEDIAN)",
+        help="Metric(s) to export in the volume. Only works with --output-per-region-volume and --output-per-slice-volume (MIN and MAX only with --output-per-slice-volume). When several metrics are given (ex. -vm MEDIAN MEAN), one volume is exported per metric, with the name of the metric appended to the file name (ex. some_volume_median.nrrd) (default: MEDIAN)",
     )
 
     parser.add_argument(
@@ -82,6 +115,16 @@ def parse_args(args):
         help="ids of regions to measure on, coma-separated with no whitespace (ex. -r 1,2,3,4 ). The values '-r LARGEST,N' or '-r SMALLEST,N' can also be used (with 'N' being an integer)",
     )
 
+    parser.add_argument(
+        "--axis",
+        "-a",
+        required=False,
+        dest="axis",
+        default="0",
+        choices=["0", "1", "2", "ALL"],
+        help="Index of the axis orthogonal to the slicing plane, along which the jaggedness is measured (the coronal axis, 0 for the Allen CCF volumes as read by pynrrd). The per-slice volume is exported along the same axis. ALL measures it along each of the three axes, in a section of the report per axis, with the axis appended to the names of the exported volumes (not with --stream) (default: 0)",
+    )
+
     parser.add_argument(
         "--threads",
         "-t",
@@ -91,92 +134,860 @@ def parse_args(args):
         help="Number of threads to run on. Number or 'AUTO' (default: AUTO)",
     )
 
-    return parser.parse_args(args)
+    parser.add_argument(
+        "--engine",
+        "-e",
+        required=False,
+        dest="engine",
+        default="REGION",
+        choices=["REGION", "SINGLEPASS"],
+        help="How to compute the metrics: REGION creates a volumetric mask per region, SINGLEPASS computes all the regions at once in a single pass over the volume (faster when running on many regions), the volume being cut into slabs along the axis that are counted in parallel (which also uses all the threads on a few large regions). Both give the same metrics (default: REGION)",
+    )
 
+    parser.add_argument(
+        "--backend",
+        "-b",
+        required=False,
+        dest="backend",
+        default="THREAD",
+        choices=["THREAD", "PROCESS"],
+        help="How to run the engine in parallel: THREAD runs it on threads, PROCESS runs it on worker processes sharing the volume in memory, which scales better on many cores. With PROCESS, the number given with --threads is the number of worker processes (default: THREAD)",
+    )
 
-def main():
-    args = parse_args(sys.argv[1:])
-    volume_file_path = args.parcellation_volume
-    report_filepath = args.out_report
-    volume_data, volume_header = nrrd.read(volume_file_path)
+    parser.add_argument(
+        "--stream",
+        required=False,
+        dest="stream",
+        action="store_true",
+        help="Read the volume slab by slab instead of loading it entirely, so that only a few slices are in memory at once. This gives the same metrics, with any engine (default: off)",
+    )
 
-    regions = None
-    precomputed_all_region_ids = None
-
-    if args.regions:
-        if args.regions.upper().strip().startswith("LARGEST"):
-            nb_to_keep = int(args.regions.split(",")[-1])
-            regions_ids, regions_counts = np.unique(volume_data, return_counts=True)
-            r = dict(zip(regions_counts.tolist(), regions_ids.tolist()))
-            precomputed_all_region_ids = regions_ids
-
-            regions = []
-            for nb_voxels in sorted(r, reverse=True):
-                region_id = r[nb_voxels]
-
-                # the no_data case
-                if region_id == 0:
-                    continue
-
-                regions.append(region_id)
-                if len(regions) == nb_to_keep:
-                    break
-
-        elif args.regions.upper().strip().startswith("SMALLEST"):
-            nb_to_keep = int(args.regions.split(",")[-1])
-            regions_ids, regions_counts = np.unique(volume_data, return_counts=True)
-            r = dict(zip(regions_counts.tolist(), regions_ids.tolist()))
-            precomputed_all_region_ids = regions_ids
-
-            regions = []
-            for nb_voxels in sorted(r):
-                region_id = r[nb_voxels]
-
-                # the no_data case
-                if region_id == 0:
-                    continue
-
-                regions.append(region_id)
-                if len(regions) == nb_to_keep:
-                    break
+    parser.add_argument(
+        "--mmap",
+        required=False,
+        dest="mmap",
+        default="AUTO",
+        choices=["AUTO", "ON", "OFF"],
+        help="Memory-map the volume instead of reading it into memory. Only possible with raw NRRD files (encoding: raw, data attached or detached). AUTO memory-maps it whenever possible (default: AUTO)",
+    )
+
+    parser.add_argument(
+        "--input-cache",
+        required=False,
+        dest="input_cache",
+        default="OFF",
+        choices=["OFF", "RAW", "ZLIB"],
+        help="Keep a copy of a compressed volume next to it (<volume>.cache), written on first use or when the volume changed, so that the next runs load it much faster. RAW is uncompressed and memory-mapped, ZLIB is made of independently compressed slabs, decompressed in parallel on the --threads. Not used for raw NRRD files, which are memory-mapped, nor with --stream (default: OFF)",
+    )
+
+    parser.add_argument(
+        "--label-index",
+        required=False,
+        dest="label_index",
+        default="AUTO",
+        choices=["AUTO", "SIDECAR", "OFF"],
+        help="Read the label index of the volume (ids, voxel counts and bounding boxes of the labels) from a file, or build and store it on first use or when the volume changed, so that the next runs on the same volume do not have to scan it again. AUTO stores it in the --cache-dir, if any. SIDECAR stores it next to the volume (<volume>.labels.npz). OFF never reads nor stores it (default: AUTO)",
+    )
+
+    parser.add_argument(
+        "--max-memory",
+        required=False,
+        dest="max_memory",
+        default=None,
+        metavar="<SIZE>",
+        help="Memory budget of the computation, on top of the volume itself, in bytes or with a unit (ex. 512M, 16G). The number of threads (or worker processes) is reduced so that the estimated memory of the regions computed at once stays under it (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        required=False,
+        dest="cache_dir",
+        default=None,
+        metavar="<FOLDER PATH>",
+        help="Folder of the cache of the ratios of the regions, keyed by the content of the volume and the axis. The regions already computed on the same volume are read from it instead of being computed again (not with --stream) (default: no cache)",
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        required=False,
+        dest="cache_max_size",
+        default="1G",
+        metavar="<SIZE>",
+        help="Maximum size of the cache folder, in bytes or with a unit (ex. 512M, 16G). The least recently used entries are deleted when it is over (default: 1G)",
+    )
+
+    parser.add_argument(
+        "--sample-slices",
+        required=False,
+        dest="sample_slices",
+        type=float,
+        default=None,
+        metavar="<FRACTION>",
+        help="Compute a quick estimate of the metrics on a fraction of the slice pairs (ex. 0.1), spread along the axis, with bootstrap confidence intervals in an 'approximate' section of the report. Only the sampled slices of a raw NRRD file are read (not with --stream nor --axis ALL), a compressed file (ex. gzip) is still read entirely (default: off, exact metrics)",
+    )
+
+    parser.add_argument(
+        "--sample-regions",
+        required=False,
+        dest="sample_regions",
+        type=float,
+        default=None,
+        metavar="<FRACTION>",
+        help="Compute a quick estimate of the metrics on a fraction of the regions (ex. 0.2), sampled in each range of region sizes. Can be combined with --sample-slices (default: off, all the regions)",
+    )
+
+    parser.add_argument(
+        "--bootstrap",
+        required=False,
+        dest="bootstrap",
+        type=int,
+        default=None,
+        metavar="<N>",
+        help="Number of bootstrap resamples for the confidence intervals of an estimate, with --sample-slices or --sample-regions (default: 1000)",
+    )
+
+    parser.add_argument(
+        "--seed",
+        required=False,
+        dest="seed",
+        type=int,
+        default=None,
+        metavar="<N>",
+        help="Seed of the sampling of --sample-slices and --sample-regions, for a reproducible estimate (default: random)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        required=False,
+        dest="profile",
+        nargs="?",
+        const=True,
+        default=None,
+        metavar="<FILE PATH>",
+        help="Add to the report a 'timings' section, with the wall time of each phase of the run (loading, computation, serialization, exports...), the number of threads (or worker processes) and the wall time of each region. If a file path is given, the run is also profiled with cProfile, into this file (default: off)",
+    )
+
+    parsed_args = parser.parse_args(args)
+    checkArgs(parser, parsed_args)
+    return parsed_args
+
+
+def checkArgs(parser, args):
+    """Check the command line parameters that argparse can not check, before anything is computed.
+    Exits with an error message (see argparse.ArgumentParser.error()) if one is not valid
+
+    Args:
+      parser (:obj:`argparse.ArgumentParser`): the parser of the command line parameters
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+    """
+    if not os.path.isfile(args.parcellation_volume):
+        parser.error(f"the input volume {args.parcellation_volume} does not exist")
+
+    report_directory = os.path.dirname(os.path.abspath(args.out_report))
+    if not os.path.isdir(report_directory):
+        parser.error(f"the folder of the report {report_directory} does not exist")
+
+    checkRegions(parser, args.regions)
+
+    for option, size in [
+        ("--max-memory", args.max_memory),
+        ("--cache-max-size", args.cache_max_size),
+    ]:
+        try:
+            if size:
+                parseMemorySize(size)
+        except ValueError:
+            parser.error(
+                f"invalid {option} {size}, expected a size such as 512M or 16G"
+            )
+
+    for option, fraction in [
+        ("--sample-slices", args.sample_slices),
+        ("--sample-regions", args.sample_regions),
+    ]:
+        if fraction is not None and not 0 < fraction <= 1:
+            parser.error(f"{option} must be in ]0, 1], not {fraction}")
+
+    # the regions only have a mean, a median and a std (see core.computeRegionStats())
+    if args.out_region_volume:
+        slice_only_metrics = [
+            name for name in args.out_metric if name in ["MIN", "MAX"]
+        ]
+        if slice_only_metrics:
+            parser.error(
+                f"--volume-metric {' '.join(slice_only_metrics)} is only available with --output-per-slice-volume (-vs), the regions only have MEAN, MEDIAN and STD"
+            )
+
+
+def checkRegions(parser, regions_spec):
+    """Check the value of the --regions option, exiting with an error message if it is not valid
+
+    Args:
+      parser (:obj:`argparse.ArgumentParser`): the parser of the command line parameters
+      regions_spec (str): comma-separated list of region ids, or 'LARGEST,N' or 'SMALLEST,N' (or None)
+    """
+    if not regions_spec:
+        return
+
+    try:
+        spec = regions_spec.upper().strip()
+        if spec.startswith(("LARGEST", "SMALLEST")):
+            name, nb_regions = spec.split(",")
+            if name not in ["LARGEST", "SMALLEST"] or int(nb_regions) <= 0:
+                raise ValueError
         else:
-            regions = list(map(lambda id: int(id), args.regions.split(",")))
+            for region_id in regions_spec.split(","):
+                int(region_id)
+    except ValueError:
+        parser.error(
+            f"invalid --regions {regions_spec}, expected a comma-separated list of region ids, LARGEST,N or SMALLEST,N"
+        )
+
 
+def parseThreadCount(threads):
+    """Parse the value of the --threads option
+
+    Args:
+      threads (str): number of threads, or 'AUTO'
+
+    Returns:
+      int: the number of threads, the number of threads available - 1 for 'AUTO' (or an invalid value)
+    """
     nb_thread = os.cpu_count() - 1
-    if args.threads.strip().upper() != "AUTO":
+    if threads.strip().upper() != "AUTO":
         try:
-            nb_thread = int(args.threads)
+            nb_thread = int(threads)
         except:
             pass
 
-    metrics = core.compute(
-        volume_data,
-        regions=regions,
-        precomputed_all_region_ids=precomputed_all_region_ids,
-        nb_thread=nb_thread,
+    return nb_thread
+
+
+def parseMemorySize(size):
+    """Parse a memory size, such as the value of the --max-memory option
+
+    Args:
+      size (str): number of bytes, or number followed by a unit (K, M, G or T, with an optional trailing B, ex. 16G or 1.5GB)
+
+    Returns:
+      int: the number of bytes
+    """
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    size = size.strip().upper()
+
+    if size.endswith("B"):
+        size = size[:-1]
+
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+
+def metricFilepaths(filepath, metric_names, axis=None):
+    """Get the filepath of the volume of each exported metric
+
+    Args:
+      filepath (str): the filepath given on the command line
+      metric_names ([str]): names of the metrics to export
+      axis (int): the axis the metrics are measured along, with --axis ALL (default: None)
+
+    Returns:
+      [str]: the filepath itself if there is a single metric, otherwise the filepath with
+        the name of each metric appended (ex. some_volume_median.nrrd). With an axis, the
+        axis is appended first (ex. some_volume_axis0_median.nrrd)
+    """
+    root, extension = os.path.splitext(filepath)
+
+    if axis is not None:
+        root = f"{root}_axis{axis}"
+
+    if len(metric_names) == 1:
+        return [f"{root}{extension}"]
+
+    return [f"{root}_{metric_name}{extension}" for metric_name in metric_names]
+
+
+def main():
+    # the batch command has its own parameters
+    if sys.argv[1:2] == ["batch"]:
+        batchMain(sys.argv[2:])
+        return
+
+    args = parse_args(sys.argv[1:])
+
+    import tracemalloc
+    from atlas_alignment_meter import profiling
+
+    # with --profile FILE, the whole run is profiled with cProfile
+    cprofile_filepath = args.profile if isinstance(args.profile, str) else None
+
+    # with --profile, the peak of the allocated memory is measured for each phase
+    if args.profile:
+        tracemalloc.start()
+
+    try:
+        with profiling.profileToFile(cprofile_filepath):
+            run(args)
+    finally:
+        if args.profile:
+            tracemalloc.stop()
+
+
+def expandVolumeFilepaths(patterns):
+    """Expand a list of NRRD file paths and glob patterns (ex. 'warped/*.nrrd') into the list of the volume files, in
+    the order they are given, each pattern being expanded in alphabetical order. A file met twice is only kept once.
+
+    Args:
+      patterns ([str]): the file paths and glob patterns
+
+    Returns:
+      [str]: the paths to the volume files
+    """
+    volume_filepaths = []
+
+    for pattern in patterns:
+        filepaths = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+
+        for filepath in filepaths:
+            if filepath not in volume_filepaths:
+                volume_filepaths.append(filepath)
+
+    return volume_filepaths
+
+
+def parse_batch_args(args):
+    """Parse the parameters of the batch command
+
+    Args:
+      args ([str]): command line parameters as list of strings, after 'batch'
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace, with the expanded list of the volume files in volume_filepaths
+    """
+    parser = argparse.ArgumentParser(
+        prog="atlas-alignment-meter batch",
+        description="Compute the metrics of many volumes in a single process, writing one report per volume and a summary table of their metrics over the non-zero ratios of all their regions pooled together",
     )
 
-    metrics_file = open(report_filepath, "w")
-    metrics_file.write(json.dumps(metrics, ensure_ascii=False, indent=2))
-    metrics_file.close()
+    parser.add_argument(
+        "volumes",
+        nargs="*",
+        metavar="<FILE PATH OR GLOB>",
+        help="The NRRD parcellation volume files (input), or glob patterns such as 'warped/*.nrrd'",
+    )
 
-    # Are there any volume to export?
-    if args.out_region_volume:
-        print("Exporting validation volume with score per region...")
-        export_volume.createVolumeMetricsPerRegion(
-            metrics_per_region=metrics["perRegion"],
-            reference_volume_data=volume_data,
-            reference_volume_meta=volume_header,
-            output_filepath=args.out_region_volume,
-            metric_name=args.out_metric.lower(),
+    parser.add_argument(
+        "--volume-list",
+        "-l",
+        required=False,
+        dest="volume_list",
+        default=None,
+        metavar="<FILE PATH>",
+        help="A text file listing the NRRD volume files (or glob patterns), one per line, in addition to the ones given as arguments",
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        required=True,
+        dest="output_dir",
+        metavar="<FOLDER PATH>",
+        help="Folder of the reports (output), named after the volumes (ex. variant_12.json for variant_12.nrrd), created if it does not exist",
+    )
+
+    parser.add_argument(
+        "--summary",
+        "-s",
+        required=False,
+        dest="summary",
+        default=None,
+        metavar="<FILE PATH>",
+        help="Path to the CSV table of the metrics of each volume over the non-zero ratios of all its regions pooled together (pooledMean, pooledMedian...), which are always given, unlike the global section of the reports (output) (default: summary.csv in the folder of the reports)",
+    )
+
+    parser.add_argument(
+        "--report-format",
+        required=False,
+        dest="report_format",
+        default="JSON",
+        choices=["JSON", "NPZ"],
+        help="The format of the reports, JSON or binary (see report_file.loadReport()) (default: JSON)",
+    )
+
+    parser.add_argument(
+        "--regions",
+        "-r",
+        required=False,
+        dest="regions",
+        default=None,
+        help="The regions to compute the metrics on in each volume, as with the single volume command (ex. 68,656 or LARGEST,10) (default: all the regions)",
+    )
+
+    parser.add_argument(
+        "--axis",
+        "-a",
+        required=False,
+        dest="axis",
+        default="0",
+        choices=["0", "1", "2"],
+        help="Index of the axis orthogonal to the slicing plane, along which the jaggedness is measured (default: 0)",
+    )
+
+    parser.add_argument(
+        "--threads",
+        "-t",
+        required=False,
+        dest="threads",
+        default="AUTO",
+        help="Number of threads of the pool kept alive for the whole batch. Number or 'AUTO' (default: AUTO)",
+    )
+
+    parser.add_argument(
+        "--engine",
+        "-e",
+        required=False,
+        dest="engine",
+        default="SINGLEPASS",
+        choices=["REGION", "SINGLEPASS"],
+        help="How to compute the metrics, see the single volume command. SINGLEPASS uses all the threads even on a single region (default: SINGLEPASS)",
+    )
+
+    parser.add_argument(
+        "--max-memory",
+        required=False,
+        dest="max_memory",
+        default=None,
+        metavar="<SIZE>",
+        help="Memory budget of the computation of each volume, on top of the volume itself, in bytes or with a unit (ex. 512M, 16G) (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        required=False,
+        dest="prefetch",
+        type=int,
+        default=2,
+        metavar="<NUMBER>",
+        help="Number of volumes loaded ahead on a background thread while the current one is computed. Each of them is held in memory until it is computed (default: 2)",
+    )
+
+    # the volumes can be given before or after the options
+    parsed_args = parser.parse_intermixed_args(args)
+    patterns = list(parsed_args.volumes)
+
+    if parsed_args.volume_list:
+        if not os.path.isfile(parsed_args.volume_list):
+            parser.error(f"the volume list {parsed_args.volume_list} does not exist")
+
+        with open(parsed_args.volume_list) as f:
+            patterns += [line.strip() for line in f if line.strip()]
+
+    for pattern in patterns:
+        if len(expandVolumeFilepaths([pattern])) == 0:
+            parser.error(f"the pattern {pattern} does not match any file")
+
+    parsed_args.volume_filepaths = expandVolumeFilepaths(patterns)
+
+    if len(parsed_args.volume_filepaths) == 0:
+        parser.error("no volume file was given")
+
+    for volume_filepath in parsed_args.volume_filepaths:
+        if not os.path.isfile(volume_filepath):
+            parser.error(f"the input volume {volume_filepath} does not exist")
+
+    # the reports are named after the volumes, which must then have different names
+    report_names = [
+        os.path.splitext(os.path.basename(volume_filepath))[0]
+        for volume_filepath in parsed_args.volume_filepaths
+    ]
+    if len(set(report_names)) != len(report_names):
+        parser.error(
+            "several volumes have the same file name, their reports would overwrite each other"
+        )
+
+    checkRegions(parser, parsed_args.regions)
+
+    try:
+        if parsed_args.max_memory:
+            parseMemorySize(parsed_args.max_memory)
+    except ValueError:
+        parser.error(
+            f"invalid --max-memory {parsed_args.max_memory}, expected a size such as 512M or 16G"
+        )
+
+    if parsed_args.prefetch < 1:
+        parser.error(f"--prefetch must be at least 1, not {parsed_args.prefetch}")
+
+    return parsed_args
+
+
+def batchMain(args):
+    """Run the batch command: the metrics of each volume, one report per volume and the summary table
+
+    Args:
+      args ([str]): command line parameters as list of strings, after 'batch'
+    """
+    args = parse_batch_args(args)
+
+    from atlas_alignment_meter import batch
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary_filepath = args.summary or os.path.join(args.output_dir, "summary.csv")
+
+    summary = batch.computeBatch(
+        args.volume_filepaths,
+        args.output_dir,
+        regions_spec=args.regions,
+        coronal_axis_index=int(args.axis),
+        nb_thread=parseThreadCount(args.threads),
+        engine=args.engine.lower(),
+        max_memory=parseMemorySize(args.max_memory) if args.max_memory else None,
+        prefetch=args.prefetch,
+        report_extension=f".{args.report_format.lower()}",
+    )
+    batch.writeSummary(summary, summary_filepath)
+
+    # the summary table is also printed, with the pooled median of each volume
+    for row in summary:
+        score = "error" if row["error"] else row["pooledMedian"]
+        print(f"{os.path.basename(row['volume'])}: {score}")
+
+    print(f"summary written to {summary_filepath}")
+
+
+def run(args):
+    """Run the metrics and the exports for the parsed command line parameters
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+    """
+    import nrrd
+    import numpy as np
+    from atlas_alignment_meter import approximate
+    from atlas_alignment_meter import core
+    from atlas_alignment_meter import export_volume
+    from atlas_alignment_meter import load_volume
+    from atlas_alignment_meter import labels
+    from atlas_alignment_meter import label_index
+    from atlas_alignment_meter import multi_axis
+    from atlas_alignment_meter import profiling
+    from atlas_alignment_meter import region_ratios as ratio_spans
+    from atlas_alignment_meter import report_file
+    from atlas_alignment_meter import result_cache
+    from atlas_alignment_meter import volume_cache
+
+    volume_file_path = args.parcellation_volume
+    report_filepath = args.out_report
+
+    nb_thread = parseThreadCount(args.threads)
+
+    all_axes = args.axis == "ALL"
+    coronal_axis_index = None if all_axes else int(args.axis)
+    metric_names = [metric_name.lower() for metric_name in args.out_metric]
+    mmap = {"AUTO": "auto", "ON": True, "OFF": False}[args.mmap]
+    max_memory = parseMemorySize(args.max_memory) if args.max_memory else None
+
+    # the wall time of each phase of the run, only measured with --profile
+    timings = {"phases": {}} if args.profile else None
+
+    regions = None
+    by_voxel_count = args.regions and args.regions.upper().strip().startswith(
+        ("LARGEST", "SMALLEST")
+    )
+
+    if args.stream and all_axes:
+        raise Exception("--axis ALL is not available with --stream")
+
+    is_approximate = args.sample_slices is not None or args.sample_regions is not None
+    if is_approximate and (args.stream or all_axes):
+        raise Exception(
+            "--sample-slices and --sample-regions are not available with --stream nor --axis ALL"
         )
 
-    if args.out_slice_volume:
-        print("Exporting validation volume with score per slice...")
-        export_volume.createVolumeMetricsPerSlice(
-            metrics_per_slice=metrics["perSlice"],
-            reference_volume_data=volume_data,
-            reference_volume_meta=volume_header,
-            output_filepath=args.out_slice_volume,
-            metric_name=args.out_metric.lower(),
+    if is_approximate and args.cache_dir:
+        print(
+            "Warning: the cache is not used with --sample-slices and --sample-regions"
         )
+
+    if args.cache_dir and all_axes:
+        print("Warning: the cache is not used with --axis ALL")
+
+    if args.report_ratios and not report_file.isBinaryReport(report_filepath):
+        print("Warning: the ratios are only added to a binary report (.npz)")
+
+    if args.report_ratio_spans and (all_axes or is_approximate):
+        print(
+            "Warning: the ratio spans are not added to the report with --axis ALL, --sample-slices nor --sample-regions"
+        )
+
+    # the ratios of the regions, filled by the computation, for the cache, --report-ratios and --report-ratio-spans
+    ratios_per_region = None
+    if args.report_ratios and report_file.isBinaryReport(report_filepath):
+        if all_axes:
+            print("Warning: the ratios are not added to the report with --axis ALL")
+        else:
+            ratios_per_region = {}
+
+    if args.report_ratio_spans and not all_axes and not is_approximate:
+        ratios_per_region = {}
+
+    if args.stream:
+        if args.cache_dir:
+            print("Warning: the cache is not used with --stream")
+
+        if args.input_cache != "OFF":
+            print("Warning: the cache copy of the volume is not used with --stream")
+
+        # the volume is never entirely loaded, only read slab by slab
+        volume_data = None
+        volume_header = nrrd.read_header(volume_file_path)
+        shape = tuple(int(size) for size in volume_header["sizes"])
+        slabs = load_volume.iterateSlabs(volume_file_path)
+        slab_axis = len(shape) - 1
+
+        if by_voxel_count:
+            print("computing slab by slab...")
+            with profiling.timePhase(timings, "slabs"):
+                regions_ids, presence, same = core.countSlabs(
+                    slabs, shape, slab_axis, coronal_axis_index
+                )
+            regions = labels.selectRegions(
+                args.regions,
+                labels.CompactedLabels(None, regions_ids, presence.sum(axis=1)),
+            )
+            metrics = core.computeFromCounts(
+                regions_ids,
+                presence,
+                same,
+                regions,
+                ratios_per_region=ratios_per_region,
+                timings=timings,
+            )
+        else:
+            if args.regions:
+                regions = labels.selectRegions(args.regions)
+
+            metrics = core.computeFromSlabs(
+                slabs,
+                shape,
+                slab_axis,
+                coronal_axis_index,
+                regions=regions,
+                ratios_per_region=ratios_per_region,
+                timings=timings,
+            )
+
+    else:
+        with profiling.timePhase(timings, "load"):
+            if args.input_cache != "OFF":
+                volume_data, volume_header = volume_cache.loadVolume(
+                    volume_file_path,
+                    args.input_cache.lower(),
+                    mmap,
+                    max(1, nb_thread),
+                )
+            else:
+                volume_data, volume_header = load_volume.loadVolume(
+                    volume_file_path, mmap
+                )
+
+        # the label index is only stored in the cache folder, or next to the volume when asked to
+        label_index_filepath = None
+        if args.label_index == "SIDECAR":
+            label_index_filepath = label_index.labelIndexFilepath(volume_file_path)
+        elif args.label_index == "AUTO" and args.cache_dir:
+            label_index_filepath = label_index.labelIndexFilepath(
+                volume_file_path, args.cache_dir
+            )
+
+        volume_label_index = None
+        if label_index_filepath:
+            with profiling.timePhase(timings, "labelIndex"):
+                volume_label_index = label_index.loadLabelIndex(
+                    volume_file_path, label_index_filepath
+                )
+
+        # the labels are compacted once, then used for the label index, the region selection, the metrics and the
+        # exports. The compaction reads the whole volume into memory, so that a memory-mapped volume, or a volume
+        # only sampled by a few slices, is only compacted when the label census is needed
+        needs_census = label_index_filepath or by_voxel_count
+        benefits_from_compaction = not is_approximate and not isinstance(
+            volume_data, np.memmap
+        )
+
+        if volume_label_index is None and (needs_census or benefits_from_compaction):
+            print("compacting the labels...")
+            with profiling.timePhase(timings, "compaction"):
+                volume_data = labels.compactLabels(volume_data)
+
+            if label_index_filepath:
+                print("building the label index...")
+                with profiling.timePhase(timings, "labelIndex"):
+                    volume_label_index = label_index.buildLabelIndex(volume_data)
+
+                    try:
+                        os.makedirs(
+                            os.path.dirname(label_index_filepath) or ".", exist_ok=True
+                        )
+                        label_index.saveLabelIndex(
+                            volume_label_index, volume_file_path, label_index_filepath
+                        )
+                    except OSError as e:
+                        print(f"Warning: the label index could not be stored ({e})")
+
+        if args.regions:
+            regions = labels.selectRegions(
+                args.regions, volume_label_index or volume_data
+            )
+
+        if args.cache_dir and not all_axes and not is_approximate:
+            with profiling.timePhase(timings, "cache"):
+                # the content hash stored in the label index saves hashing the volume files again
+                if label_index_filepath:
+                    content_hash = label_index.volumeContentHash(
+                        volume_file_path, label_index_filepath
+                    )
+                else:
+                    content_hash = label_index.contentHash(
+                        label_index.volumeFilepaths(volume_file_path)
+                    )
+
+                cache_key = result_cache.cacheKey(content_hash, coronal_axis_index)
+                ratios_per_region = result_cache.loadRatios(args.cache_dir, cache_key)
+            nb_cached_regions = len(ratios_per_region)
+
+        if is_approximate:
+            metrics = approximate.computeApproximate(
+                volume_data,
+                coronal_axis_index=coronal_axis_index,
+                regions=regions,
+                slice_fraction=args.sample_slices or 1.0,
+                region_fraction=args.sample_regions or 1.0,
+                nb_bootstrap=args.bootstrap or approximate.DEFAULT_NB_BOOTSTRAP,
+                seed=args.seed,
+                label_index=volume_label_index,
+                timings=timings,
+            )
+        elif all_axes:
+            # the label index is shared by the three axes
+            metrics = multi_axis.computeAllAxes(
+                volume_data,
+                regions=regions,
+                nb_thread=nb_thread,
+                engine=args.engine.lower(),
+                backend=args.backend.lower(),
+                max_memory=max_memory,
+                label_index=volume_label_index,
+                timings=timings,
+            )
+        else:
+            metrics = core.compute(
+                volume_data,
+                coronal_axis_index=coronal_axis_index,
+                regions=regions,
+                nb_thread=nb_thread,
+                engine=args.engine.lower(),
+                backend=args.backend.lower(),
+                max_memory=max_memory,
+                label_index=volume_label_index,
+                ratios_per_region=ratios_per_region,
+                timings=timings,
+            )
+
+        # only the newly computed regions have to be added to the cache
+        if (
+            args.cache_dir
+            and not all_axes
+            and not is_approximate
+            and len(ratios_per_region) > nb_cached_regions
+        ):
+            with profiling.timePhase(timings, "cache"):
+                try:
+                    result_cache.saveRatios(
+                        args.cache_dir,
+                        cache_key,
+                        ratios_per_region,
+                        parseMemorySize(args.cache_max_size),
+                    )
+                except OSError as e:
+                    print(f"Warning: the ratios could not be cached ({e})")
+
+    # the phases of the run and of the computation, in the order they happened
+    if args.profile and metrics is not None:
+        metrics["timings"] = timings
+
+    # only the ratios of the regions of the report are added to it, over their span
+    region_ratios = None
+    if args.report_ratio_spans and ratios_per_region and metrics is not None:
+        region_ratios = ratio_spans.fromDense(
+            ratios_per_region,
+            [id for id in metrics["perRegion"] if id in ratios_per_region],
+        )
+
+    # the ratios read from the cache are only added to the report with --report-ratios
+    if not args.report_ratios:
+        ratios_per_region = None
+
+    with profiling.timePhase(timings, "serialization"):
+        report_file.writeReport(
+            metrics, report_filepath, ratios_per_region, region_ratios
+        )
+
+    # Are there any volume to export?
+    if volume_data is None and (args.out_region_volume or args.out_slice_volume):
+        print("Loading the volume to export the validation volumes...")
+        with profiling.timePhase(timings, "exportLoad"):
+            volume_data, volume_header = load_volume.loadVolume(volume_file_path, mmap)
+            volume_data = labels.compactLabels(volume_data)
+
+    # the metrics along each axis, with --axis ALL
+    metrics_per_axis = {coronal_axis_index: metrics}
+    if all_axes:
+        metrics_per_axis = metrics["perAxis"]
+
+    # the same metrics volume is reused for each metric and each axis, once written
+    metric_volume = None
+
+    for axis, axis_metrics in metrics_per_axis.items():
+        axis_suffix = axis if all_axes else None
+
+        if args.out_region_volume:
+            print("Exporting validation volume with score per region...")
+            with profiling.timePhase(timings, "exportPerRegion"):
+                export_volume.createVolumeMetricsPerRegion(
+                    metrics_per_region=axis_metrics["perRegion"],
+                    reference_volume_data=volume_data,
+                    reference_volume_meta=volume_header,
+                    output_filepath=metricFilepaths(
+                        args.out_region_volume, metric_names, axis_suffix
+                    ),
+                    metric_name=metric_names,
+                )
+
+        if args.out_slice_volume:
+            print("Exporting validation volume with score per slice...")
+            output_filepaths = metricFilepaths(
+                args.out_slice_volume, metric_names, axis_suffix
+            )
+
+            with profiling.timePhase(timings, "exportPerSlice"):
+                for metric_name, output_filepath in zip(metric_names, output_filepaths):
+                    metric_volume = export_volume.createVolumeMetricsPerSlice(
+                        metrics_per_slice=axis_metrics["perSlice"],
+                        reference_volume_data=volume_data,
+                        reference_volume_meta=volume_header,
+                        output_filepath=output_filepath,
+                        per_slice_axis=axis,
+                        metric_name=metric_name,
+                        out=metric_volume,
+                    )
+
+    if args.profile and metrics is not None:
+        # the report is written again, with the time of its serialization and of the exports
+        report_file.writeReport(
+            metrics, report_filepath, ratios_per_region, region_ratios
+        )
+
+        for phase, wall_time in timings["phases"].items():
+            print(f"{phase}: {wall_time:.3f}s")
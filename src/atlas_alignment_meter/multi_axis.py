@@ -0,0 +1,70 @@
+import os
+from atlas_alignment_meter import core
+from atlas_alignment_meter import label_index as label_index_module
+from atlas_alignment_meter.labels import CompactedLabels, compactLabels
+from atlas_alignment_meter.profiling import timePhase
+
+# the axes the jaggedness is measured along by computeAllAxes()
+AXES = (0, 1, 2)
+
+
+def computeAllAxes(
+    volume,
+    regions=None,
+    nb_thread=os.cpu_count() - 1,
+    engine="region",
+    backend="thread",
+    max_memory=None,
+    label_index=None,
+    timings=None,
+):
+    """
+    Compute the metrics of the jaggedness along each of the three axes of an annotation volume, so that a jaggedness
+    moved from a plane to another (ex. by a realignment) is not missed. The labels are compacted and their census
+    (list, voxel counts and bounding boxes) is made only once, then shared by the three axes.
+
+      Parameters:
+        volume (np.ndarray or CompactedLabels): the annotation volume, or its compacted labels as given by labels.compactLabels()
+        regions (list): list of region ids (integers) to run the metrics on, see compute() (default: None, all the regions)
+        nb_thread (int): number of threads to run the metrics on, see compute() (default: number of thread available - 1)
+        engine (string): "region" or "singlepass", see compute() (default: "region")
+        backend (string): "thread" or "process", see compute() (default: "thread")
+        max_memory (int): memory budget of the computation in bytes, see compute() (default: None, no limit)
+        label_index (LabelIndex): the label index of the volume, as given by label_index.buildLabelIndex() or
+          label_index.loadLabelIndex(). If not provided, it is built from the volume (default: None)
+        timings (dict): OUTPUT. if provided, the wall time of the shared phases is added to it, and the timings of the
+          computation along each axis, as given by compute(), in "perAxis" (key: axis) (default: None, nothing is measured)
+
+      Returns:
+        metrics (dict). The metrics along each axis, as given by compute() (key: axis), in "perAxis"
+    """
+    if label_index is None:
+        if not isinstance(volume, CompactedLabels):
+            print("compacting the labels...")
+            with timePhase(timings, "compaction"):
+                volume = compactLabels(volume)
+
+        with timePhase(timings, "census"):
+            label_index = label_index_module.buildLabelIndex(volume)
+
+    report = {"perAxis": {}}
+
+    for axis in AXES:
+        axis_timings = None
+        if timings is not None:
+            axis_timings = timings.setdefault("perAxis", {})[axis] = {}
+
+        print(f"computing along the axis {axis}...")
+        report["perAxis"][axis] = core.compute(
+            volume,
+            coronal_axis_index=axis,
+            regions=regions,
+            nb_thread=nb_thread,
+            engine=engine,
+            backend=backend,
+            max_memory=max_memory,
+            label_index=label_index,
+            timings=axis_timings,
+        )
+
+    return report
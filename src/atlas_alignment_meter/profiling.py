@@ -0,0 +1,127 @@
+import contextlib
+import cProfile
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+def peakRss(who="self"):
+    """
+    Gets the peak resident set size (physical memory) of the process so far.
+
+      Parameters:
+        who (string): "self" for the process itself, "children" for its terminated child processes, such as the
+          worker processes of the process backend (the largest of them) (default: "self")
+
+      Returns:
+        nb_bytes (int). The peak resident set size, or None if it cannot be measured on this platform
+    """
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(
+        resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN
+    )
+
+    # in kilobytes on Linux, in bytes on macOS
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def currentRss():
+    """
+    Gets the current resident set size (physical memory) of the process, which unlike peakRss() goes down when memory
+    is released.
+
+      Returns:
+        nb_bytes (int). The current resident set size, or None if it cannot be measured on this platform (only on Linux)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            nb_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return nb_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+@contextlib.contextmanager
+def timePhase(timings, name):
+    """
+    Measures the wall time of a phase of a run, such as the loading of the volume or the computation of the metrics,
+    and adds it to the "phases" of the timings (the times of a phase that is run several times are summed).
+    The memory of the phase is added to the "memory" of the timings: the change of the resident set size of the process
+    over the phase ("rssDelta", negative if the phase released memory), and, if tracemalloc is tracing, the peak of the
+    memory allocated during the phase ("peakAllocated", in addition to the memory allocated before the phase).
+    The peak resident set size is that of the whole process so far rather than of a phase, and is given once in the
+    timings ("peakRss", and "peakRssChildren" for its largest terminated child process, such as a worker process of
+    the process backend).
+
+      Parameters:
+        timings (dict): OUTPUT. The "timings" section of a report, to which the time of the phase is added. If None, nothing is measured
+        name (string): name of the phase
+    """
+    if timings is None:
+        yield
+        return
+
+    # tracemalloc.reset_peak() is only available from Python 3.9
+    is_tracing = tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak")
+    if is_tracing:
+        allocated_before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    rss_before = currentRss()
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        phases = timings.setdefault("phases", {})
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+        memory = timings.setdefault("memory", {}).setdefault(name, {})
+
+        rss_after = currentRss()
+        if rss_before is not None and rss_after is not None:
+            memory["rssDelta"] = memory.get("rssDelta", 0) + rss_after - rss_before
+
+        timings["peakRss"] = peakRss()
+
+        if peakRss("children"):
+            timings["peakRssChildren"] = peakRss("children")
+
+        if is_tracing:
+            memory["peakAllocated"] = max(
+                memory.get("peakAllocated", 0),
+                tracemalloc.get_traced_memory()[1] - allocated_before,
+            )
+
+
+@contextlib.contextmanager
+def profileToFile(filepath):
+    """
+    Runs cProfile on a block of code and dumps the statistics into a file, which can be read with the pstats
+    module or tools such as snakeviz.
+
+      Parameters:
+        filepath (string): path to the cProfile statistics file (output). If None, nothing is profiled
+    """
+    if filepath is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filepath)
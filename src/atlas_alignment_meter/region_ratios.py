@@ -0,0 +1,171 @@
+from collections import namedtuple
+import json
+import numpy as np
+
+# number of decimals of the ratios written in a JSON report, about the precision of a float32
+_JSON_DECIMALS = 7
+
+# the ratios of each region over its own slice span (from its first to its last non-zero ratio), all the spans
+# being concatenated in values: the ratios of the i-th region are values[offsets[i]:offsets[i + 1]], and the first of
+# them is the ratio of the slice starts[i]. The ratios outside of the span of a region are all 0.
+RegionRatios = namedtuple(
+    "RegionRatios", ["nb_slices", "region_ids", "starts", "offsets", "values"]
+)
+
+
+def fromDense(ratios_per_region, region_ids=None):
+    """
+    Keeps the ratios of each region only over its own slice span, as float32, so that their size scales with the
+    slices the regions are on rather than with the number of regions times the number of slices.
+
+      Parameters:
+        ratios_per_region (dict): the ratios for each slice of each region (key: region id), such as filled by
+          core.compute()
+        region_ids (list): the regions to keep, that are in ratios_per_region (default: None, all of them)
+
+      Returns:
+        region_ratios (RegionRatios). The ratios of each region over its span, the regions being sorted by id
+    """
+    if region_ids is None:
+        region_ids = list(ratios_per_region)
+
+    region_ids = np.array(sorted(int(id) for id in region_ids), dtype=np.int64)
+    nb_slices = len(next(iter(ratios_per_region.values()))) if ratios_per_region else 0
+    ratios = np.zeros((len(region_ids), nb_slices), dtype=np.float32)
+
+    for row, id in enumerate(region_ids.tolist()):
+        ratios[row] = ratios_per_region[id]
+
+    # the span of a region goes from its first to its last non-zero ratio, and is empty if it has none
+    is_non_zero = ratios != 0
+    has_ratios = is_non_zero.any(axis=1)
+    starts = np.where(has_ratios, np.argmax(is_non_zero, axis=1), 0)
+    stops = np.where(has_ratios, nb_slices - np.argmax(is_non_zero[:, ::-1], axis=1), 0)
+    lengths = stops - starts
+
+    offsets = np.zeros(len(region_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # the (row, slice) of each value kept, region after region
+    rows = np.repeat(np.arange(len(region_ids)), lengths)
+    slices = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - starts, lengths)
+
+    return RegionRatios(
+        nb_slices, region_ids, starts.astype(np.int64), offsets, ratios[rows, slices]
+    )
+
+
+def toDense(region_ratios):
+    """
+    Expands the ratios of each region over its span back to one ratio per slice.
+
+      Parameters:
+        region_ratios (RegionRatios): the ratios, as given by fromDense(), fromJson() or loadRegionRatios()
+
+      Returns:
+        ratios_per_region (dict). The ratios for each slice of each region (key: region id), as in core.compute()
+    """
+    ratios = np.zeros(
+        (len(region_ratios.region_ids), region_ratios.nb_slices), dtype=float
+    )
+    lengths = np.diff(region_ratios.offsets)
+
+    rows = np.repeat(np.arange(len(region_ratios.region_ids)), lengths)
+    slices = np.arange(region_ratios.offsets[-1]) - np.repeat(
+        region_ratios.offsets[:-1] - region_ratios.starts, lengths
+    )
+    ratios[rows, slices] = region_ratios.values
+
+    return dict(zip(np.asarray(region_ratios.region_ids).tolist(), ratios))
+
+
+def toJson(region_ratios):
+    """
+    Converts the ratios of each region over its span to the "regionRatios" section of a JSON report.
+
+      Parameters:
+        region_ratios (RegionRatios): the ratios, as given by fromDense()
+
+      Returns:
+        section (dict). {"nbSlices": nb_slices, "perRegion": {id: {"start": start, "ratios": [...]}}}
+    """
+    # the float32 ratios are rounded, not to be written with the digits of their conversion to float64
+    values = np.round(
+        np.asarray(region_ratios.values, dtype=float), _JSON_DECIMALS
+    ).tolist()
+    offsets = np.asarray(region_ratios.offsets).tolist()
+
+    return {
+        "nbSlices": int(region_ratios.nb_slices),
+        "perRegion": {
+            id: {"start": start, "ratios": values[offsets[row] : offsets[row + 1]]}
+            for row, (id, start) in enumerate(
+                zip(
+                    np.asarray(region_ratios.region_ids).tolist(),
+                    np.asarray(region_ratios.starts).tolist(),
+                )
+            )
+        },
+    }
+
+
+def fromJson(section):
+    """
+    Reads the "regionRatios" section of a JSON report, written by toJson().
+
+      Parameters:
+        section (dict): the "regionRatios" section of the report
+
+      Returns:
+        region_ratios (RegionRatios). The ratios of each region over its span, the regions being sorted by id
+    """
+    per_region = sorted(
+        (int(id), span["start"], span["ratios"])
+        for id, span in section["perRegion"].items()
+    )
+    lengths = [len(ratios) for id, start, ratios in per_region]
+
+    offsets = np.zeros(len(per_region) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return RegionRatios(
+        int(section["nbSlices"]),
+        np.array([id for id, start, ratios in per_region], dtype=np.int64),
+        np.array([start for id, start, ratios in per_region], dtype=np.int64),
+        offsets,
+        np.array(
+            [value for id, start, ratios in per_region for value in ratios],
+            dtype=np.float32,
+        ),
+    )
+
+
+def loadRegionRatios(report_filepath, dense=False):
+    """
+    Loads the ratios of each region over its span from a JSON or binary report written with them (see --report-ratio-spans).
+
+      Parameters:
+        report_filepath (string): path to the report file
+        dense (bool): whether to expand them to one ratio per slice, see toDense() (default: False)
+
+      Returns:
+        region_ratios (RegionRatios or dict). The ratios of each region over its span, or for each slice of each
+          region (key: region id) if dense is True. None if they are not in the report
+    """
+    # imported here, as report_file imports this module
+    from atlas_alignment_meter import report_file
+
+    if report_file.isBinaryReport(report_filepath):
+        region_ratios = report_file.openRegionRatios(report_filepath)
+    else:
+        with open(report_filepath) as f:
+            report = json.load(f)
+
+        region_ratios = (
+            fromJson(report["regionRatios"]) if "regionRatios" in report else None
+        )
+
+    if region_ratios is None or not dense:
+        return region_ratios
+
+    return toDense(region_ratios)
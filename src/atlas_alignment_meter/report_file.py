@@ -0,0 +1,325 @@
+import json
+import os
+import struct
+import zipfile
+import numpy as np
+from atlas_alignment_meter import region_ratios as ratio_spans
+
+# version of the content of the binary report files, to change when it changes
+_FORMAT_VERSION = 1
+
+# extension of the binary report files, the other reports being written as JSON
+EXTENSION = ".npz"
+
+# the metrics of the report, in the order they are given by core.compute()
+_REGION_STATS = ["mean", "std", "median"]
+_SLICE_STATS = ["mean", "median", "std", "min", "max"]
+
+# the sections of the report that are stored as JSON, as they are not columns
+_JSON_SECTIONS = ["timings", "approximate"]
+
+# the arrays of the ratios of each region over its span (see region_ratios.RegionRatios), in the order of its fields
+_REGION_RATIOS_ARRAYS = [
+    f"regionRatios.{name}"
+    for name in ["nbSlices", "regionIds", "starts", "offsets", "values"]
+]
+
+# size of the fixed part of the local header of a zip member, before its name and extra field
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def isBinaryReport(filepath):
+    """
+    Whether a report file is (or is to be) written in the binary format, from its extension.
+
+      Parameters:
+        filepath (string): path to the report file
+
+      Returns:
+        bool. True for a .npz file
+    """
+    return filepath.lower().endswith(EXTENSION)
+
+
+def _addReportArrays(arrays, report, prefix, ratios_per_region=None):
+    """
+    Adds to arrays the columns of a report (as given by core.compute()), with names starting with prefix.
+    The metrics that are None are stored as NaN.
+    """
+    ids = sorted(int(id) for id in report["perRegion"])
+    per_region = {int(id): stats for id, stats in report["perRegion"].items()}
+    arrays[f"{prefix}regionIds"] = np.array(ids, dtype=np.int64)
+
+    for name in _REGION_STATS:
+        arrays[f"{prefix}perRegion.{name}"] = np.array(
+            [per_region[id][name] for id in ids], dtype=np.float64
+        )
+
+    for name in _SLICE_STATS:
+        arrays[f"{prefix}perSlice.{name}"] = np.array(
+            report["perSlice"][name], dtype=np.float64
+        )
+        arrays[f"{prefix}global.{name}"] = np.array(
+            report["global"][name], dtype=np.float64
+        )
+
+    # one row per region, in the order of the region ids
+    if ratios_per_region is not None and all(id in ratios_per_region for id in ids):
+        arrays[f"{prefix}ratios"] = np.stack([ratios_per_region[id] for id in ids])
+
+    for section in _JSON_SECTIONS:
+        if section in report:
+            arrays[f"{prefix}{section}"] = np.array(json.dumps(report[section]))
+
+
+def saveReport(report, filepath, ratios_per_region=None, region_ratios=None):
+    """
+    Writes a report in a binary format: an uncompressed .npz file with one array per column of the report (region
+    ids, per-region metrics, per-slice metrics...), so that it can be read without parsing and its arrays can be
+    memory-mapped (see openReport()). The metrics that are None in the report are stored as NaN.
+
+      Parameters:
+        report (dict): the metrics, as given by core.compute() or multi_axis.computeAllAxes()
+        filepath (string): path to the report file
+        ratios_per_region (dict): the ratios for each slice of each region (key: region id), such as filled by
+          core.compute(). If provided, the (nb_regions, nb_slices) matrix of the ratios is added to the report, in the
+          "ratios" array (not with a report per axis) (default: None)
+        region_ratios (region_ratios.RegionRatios): if provided, the ratios of each region over its own slice span are
+          added to the report, in the "regionRatios.*" arrays (see openRegionRatios()) (default: None)
+    """
+    arrays = {"version": np.array(_FORMAT_VERSION)}
+
+    if report is not None and "perAxis" in report:
+        arrays["axes"] = np.array(sorted(report["perAxis"]), dtype=np.int64)
+
+        for axis, axis_report in report["perAxis"].items():
+            if axis_report is not None:
+                _addReportArrays(arrays, axis_report, f"perAxis.{axis}.")
+
+        if "timings" in report:
+            arrays["timings"] = np.array(json.dumps(report["timings"]))
+
+    elif report is not None:
+        _addReportArrays(arrays, report, "", ratios_per_region)
+
+    if region_ratios is not None:
+        for name, values in zip(_REGION_RATIOS_ARRAYS, region_ratios):
+            arrays[name] = np.asarray(values)
+
+    with open(filepath, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _memoryMapMember(f, filepath, info):
+    """
+    Memory-maps the array stored in a member of an uncompressed .npz file, or reads it if it can not be
+    memory-mapped (empty or 0-d array, or compressed member).
+    """
+    f.seek(info.header_offset)
+    local_header = f.read(_ZIP_LOCAL_HEADER_SIZE)
+    name_length, extra_length = struct.unpack("<2H", local_header[26:30])
+    data_offset = (
+        info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_length + extra_length
+    )
+
+    f.seek(data_offset)
+    version = np.lib.format.read_magic(f)
+
+    if info.compress_type != zipfile.ZIP_STORED or version not in [(1, 0), (2, 0)]:
+        return None
+
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+    if len(shape) == 0 or np.prod(shape) == 0 or dtype.hasobject:
+        f.seek(data_offset)
+        return np.lib.format.read_array(f)
+
+    return np.memmap(
+        filepath,
+        dtype=dtype,
+        mode="r",
+        offset=f.tell(),
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+def openReport(filepath):
+    """
+    Opens a binary report written by saveReport(), memory-mapping its arrays so that only the parts that are used
+    are read from the disk.
+
+      Parameters:
+        filepath (string): path to the report file
+
+      Returns:
+        arrays (dict). The arrays of the report (key: name of the array, ex. "regionIds", "perRegion.median",
+          "perSlice.mean" or "ratios", prefixed with "perAxis.<axis>." for a report per axis)
+    """
+    arrays = {}
+
+    with zipfile.ZipFile(filepath) as archive, open(filepath, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[: -len(".npy")]
+            array = _memoryMapMember(f, filepath, info)
+
+            if array is None:
+                with archive.open(info) as member:
+                    array = np.lib.format.read_array(member)
+
+            arrays[name] = array
+
+    if int(arrays["version"]) != _FORMAT_VERSION:
+        raise Exception(
+            f"The report {filepath} is of the version {int(arrays['version'])} of the format, not {_FORMAT_VERSION}"
+        )
+
+    return arrays
+
+
+def openRegionRatios(filepath):
+    """
+    Opens the ratios of each region over its span from a binary report written with them by saveReport(), their
+    arrays being memory-mapped.
+
+      Parameters:
+        filepath (string): path to the report file
+
+      Returns:
+        region_ratios (region_ratios.RegionRatios). The ratios of each region over its span, or None if they are not
+          in the report
+    """
+    arrays = openReport(filepath)
+
+    if _REGION_RATIOS_ARRAYS[0] not in arrays:
+        return None
+
+    return ratio_spans.RegionRatios(
+        int(arrays[_REGION_RATIOS_ARRAYS[0]]),
+        *[arrays[name] for name in _REGION_RATIOS_ARRAYS[1:]],
+    )
+
+
+def _toList(values):
+    """
+    Converts an array of metrics to a list, the NaN being converted back to None.
+    """
+    return [None if value != value else value for value in np.asarray(values).tolist()]
+
+
+def _reportFromArrays(arrays, prefix):
+    """
+    Rebuilds a report (as given by core.compute()) from the arrays whose names start with prefix, or None if there is
+    no report.
+    """
+    if f"{prefix}regionIds" not in arrays:
+        return None
+
+    ids = arrays[f"{prefix}regionIds"].tolist()
+    region_stats = [
+        _toList(arrays[f"{prefix}perRegion.{name}"]) for name in _REGION_STATS
+    ]
+
+    report = {
+        "perRegion": {
+            id: dict(zip(_REGION_STATS, stats))
+            for id, stats in zip(ids, zip(*region_stats))
+        },
+        "perSlice": {
+            name: _toList(arrays[f"{prefix}perSlice.{name}"]) for name in _SLICE_STATS
+        },
+        "global": {
+            name: _toList([arrays[f"{prefix}global.{name}"]])[0]
+            for name in _SLICE_STATS
+        },
+    }
+
+    for section in _JSON_SECTIONS:
+        if f"{prefix}{section}" in arrays:
+            report[section] = json.loads(str(arrays[f"{prefix}{section}"]))
+
+    return report
+
+
+def loadReport(filepath, ratios_per_region=None):
+    """
+    Loads a binary report written by saveReport(), as the dictionary given by core.compute() (or by
+    multi_axis.computeAllAxes()). The "timings", "approximate" and "regionRatios" sections, if any, are given as in the
+    JSON report (with string keys).
+
+      Parameters:
+        filepath (string): path to the report file
+        ratios_per_region (dict): OUTPUT. if provided and if the ratios are in the report, the ratios for each slice of
+          each region are added to it (key: region id) (default: None)
+
+      Returns:
+        report (dict). Metrics per slice, per region and global, or None if nothing was computed
+    """
+    arrays = openReport(filepath)
+
+    if "axes" in arrays:
+        report = {
+            "perAxis": {
+                axis: _reportFromArrays(arrays, f"perAxis.{axis}.")
+                for axis in arrays["axes"].tolist()
+            }
+        }
+
+        if "timings" in arrays:
+            report["timings"] = json.loads(str(arrays["timings"]))
+
+        return report
+
+    if ratios_per_region is not None and "ratios" in arrays:
+        ratios_per_region.update(zip(arrays["regionIds"].tolist(), arrays["ratios"]))
+
+    report = _reportFromArrays(arrays, "")
+
+    if report is not None and _REGION_RATIOS_ARRAYS[0] in arrays:
+        report["regionRatios"] = json.loads(
+            json.dumps(ratio_spans.toJson(openRegionRatios(filepath)))
+        )
+
+    return report
+
+
+def reportFilepath(report_dir, volume_filepath, extension=".json"):
+    """
+    Gets the path of the report of a volume of the batch command, named after the volume (ex. variant_12.json for
+    warped/variant_12.nrrd).
+
+      Parameters:
+        report_dir (string): path to the folder of the reports
+        volume_filepath (string): path to the NRRD file of the volume
+        extension (string): ".json" or ".npz", see writeReport() (default: ".json")
+
+      Returns:
+        filepath (string). The path to the report file
+    """
+    name = os.path.splitext(os.path.basename(volume_filepath))[0]
+    return os.path.join(report_dir, f"{name}{extension}")
+
+
+def writeReport(report, filepath, ratios_per_region=None, region_ratios=None):
+    """
+    Writes a report as a JSON file, or in the binary format of saveReport() for a .npz file.
+
+      Parameters:
+        report (dict): the metrics, as given by core.compute()
+        filepath (string): path to the report file
+        ratios_per_region (dict): the ratios for each slice of each region, added to a binary report (default: None)
+        region_ratios (region_ratios.RegionRatios): the ratios of each region over its span, added to the report in
+          the "regionRatios" section (default: None)
+    """
+    if isBinaryReport(filepath):
+        saveReport(report, filepath, ratios_per_region, region_ratios)
+        return
+
+    if region_ratios is not None:
+        report = {**report, "regionRatios": ratio_spans.toJson(region_ratios)}
+
+    with open(filepath, "w") as f:
+        f.write(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import numpy as np
+from atlas_alignment_meter import core
+
+# version of the content of the cache files, to change when it changes
+_FORMAT_VERSION = 1
+
+# extension of the cache entries, so that no other file of the cache folder is ever evicted
+_ENTRY_EXTENSION = ".ratios.npz"
+
+# default maximum size of the cache folder, in bytes
+DEFAULT_MAX_SIZE = 2**30
+
+
+def cacheKey(content_hash, coronal_axis_index):
+    """
+    Gets the key of the cache entry of the ratios of a volume. The ratios of a region only depend on the content of
+    the volume, on the axis along which they are computed and on the version of their computation, so the ratios
+    cached for a volume serve any subset of its regions, with any engine.
+
+      Parameters:
+        content_hash (string): the hash of the content of the volume files (see label_index.contentHash())
+        coronal_axis_index (int): index of the axis orthogonal to the slices
+
+      Returns:
+        key (string). The key of the cache entry
+    """
+    return hashlib.sha256(
+        f"{content_hash}:{coronal_axis_index}:{core.RATIOS_VERSION}:{_FORMAT_VERSION}".encode()
+    ).hexdigest()
+
+
+def _entryFilepath(cache_dir, key):
+    """
+    The path to the file of a cache entry
+    """
+    return os.path.join(cache_dir, f"{key}{_ENTRY_EXTENSION}")
+
+
+def loadRatios(cache_dir, key):
+    """
+    Loads the ratios cached for a key, and marks the entry as recently used.
+
+      Parameters:
+        cache_dir (string): path to the cache folder
+        key (string): the key of the cache entry, as given by cacheKey()
+
+      Returns:
+        ratios_per_region (dict). The ratios for each slice of each cached region (key: region id), empty if nothing is cached
+    """
+    filepath = _entryFilepath(cache_dir, key)
+
+    if not os.path.exists(filepath):
+        return {}
+
+    try:
+        with np.load(filepath) as data:
+            if int(data["version"]) != _FORMAT_VERSION:
+                return {}
+
+            ids = data["ids"]
+            ratios = data["ratios"]
+    except (OSError, ValueError, KeyError):
+        # an unreadable entry is just a cache miss
+        return {}
+
+    # the eviction is based on the modification time, which is updated on each use
+    try:
+        os.utime(filepath)
+    except OSError:
+        pass
+
+    return dict(zip(ids.tolist(), ratios))
+
+
+def saveRatios(cache_dir, key, ratios_per_region, max_size=DEFAULT_MAX_SIZE):
+    """
+    Adds ratios to the cache entry of a key, then evicts the least recently used entries if the cache is over its
+    maximum size.
+
+      Parameters:
+        cache_dir (string): path to the cache folder, created if needed
+        key (string): the key of the cache entry, as given by cacheKey()
+        ratios_per_region (dict): the ratios for each slice of each region (key: region id), such as filled by core.compute()
+        max_size (int): maximum size of the cache folder, in bytes (default: DEFAULT_MAX_SIZE, 1GB)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    filepath = _entryFilepath(cache_dir, key)
+
+    # the regions cached by a previous run are kept
+    ratios_per_region = {**loadRatios(cache_dir, key), **ratios_per_region}
+    ids = np.array(sorted(ratios_per_region), dtype=np.int64)
+
+    # written in a temporary file first, so that a concurrent run never reads a partial file
+    temporary_filepath = f"{filepath}.{os.getpid()}.tmp"
+
+    with open(temporary_filepath, "wb") as f:
+        np.savez(
+            f,
+            version=_FORMAT_VERSION,
+            ids=ids,
+            ratios=np.stack([ratios_per_region[id] for id in ids.tolist()]),
+        )
+
+    os.replace(temporary_filepath, filepath)
+    evictEntries(cache_dir, max_size)
+
+
+def evictEntries(cache_dir, max_size):
+    """
+    Deletes the least recently used entries of the cache until its size is under the maximum size.
+
+      Parameters:
+        cache_dir (string): path to the cache folder
+        max_size (int): maximum size of the cache folder, in bytes
+
+      Returns:
+        evicted (list). The paths to the deleted entries
+    """
+    entries = []
+
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith(_ENTRY_EXTENSION):
+            continue
+
+        filepath = os.path.join(cache_dir, filename)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            # deleted by a concurrent run
+            continue
+
+        entries.append((stat.st_mtime_ns, stat.st_size, filepath))
+
+    total_size = sum(size for _, size, _ in entries)
+    evicted = []
+
+    # the oldest first
+    for _, size, filepath in sorted(entries):
+        if total_size <= max_size:
+            break
+
+        try:
+            os.remove(filepath)
+        except OSError:
+            continue
+
+        total_size -= size
+        evicted.append(filepath)
+
+    return evicted
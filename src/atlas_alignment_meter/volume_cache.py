@@ -0,0 +1,261 @@
+import json
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import nrrd
+import numpy as np
+from atlas_alignment_meter import label_index
+from atlas_alignment_meter import load_volume
+
+# version of the content of the cache files, to change when it changes
+_FORMAT_VERSION = 1
+
+# first bytes of a cache file, followed by the length of its JSON header (uint64, little-endian)
+_MAGIC = b"AAMCACHE"
+
+# the data start at a multiple of this, so that the memory-mapped volume is aligned
+_ALIGNMENT = 64
+
+# default number of voxels in each independently compressed slab
+_SLAB_NB_VOXELS = 2**22
+
+# the ways the volume can be stored in the cache: "raw" is read by memory-mapping it, "zlib" is made of
+# independently compressed slabs, that are decompressed in parallel
+COMPRESSIONS = ("raw", "zlib")
+
+
+def cacheFilepath(volume_filepath):
+    """
+    Gets the path of the cache copy of a volume, stored next to it (ex. annotation.nrrd.cache)
+
+      Parameters:
+        volume_filepath (string): path to the NRRD file of the volume
+
+      Returns:
+        filepath (string). The path to the cache file
+    """
+    return f"{volume_filepath}.cache"
+
+
+def _slabRanges(shape, slab_axis, slab_size):
+    """
+    The (start, stop) slices of each slab along slab_axis
+    """
+    return [
+        (start, min(start + slab_size, shape[slab_axis]))
+        for start in range(0, shape[slab_axis], slab_size)
+    ]
+
+
+def saveVolumeCache(
+    volume,
+    volume_filepath,
+    compression="zlib",
+    nb_thread=os.cpu_count(),
+    cache_filepath=None,
+    level=1,
+):
+    """
+    Writes a copy of a volume that is much faster to load than a compressed NRRD file: either raw (see
+    loadVolumeCache(), the volume is then memory-mapped) or as slabs of consecutive slices along the slowest-varying
+    axis, compressed independently so that they are compressed and decompressed in parallel. The copy is keyed by the
+    size and modification time of the volume files, and is no longer used once they change.
+
+      Parameters:
+        volume (np.ndarray): the volume, as read from the NRRD file
+        volume_filepath (string): path to the NRRD file of the volume
+        compression (string): "raw" or "zlib" (default: "zlib")
+        nb_thread (int): number of threads to compress the slabs on (default: number of threads available)
+        cache_filepath (string): path to the cache file (default: None, next to the volume, see cacheFilepath())
+        level (int): the zlib compression level, the lowest being the fastest to write (default: 1)
+    """
+    if compression not in COMPRESSIONS:
+        raise Exception(f"Unknown compression '{compression}', one of {COMPRESSIONS}")
+
+    if cache_filepath is None:
+        cache_filepath = cacheFilepath(volume_filepath)
+
+    # the slabs are contiguous blocks of the volume in its memory order
+    order = "F" if volume.flags.f_contiguous and not volume.flags.c_contiguous else "C"
+    volume = np.asarray(volume, order=order)
+    slab_axis = volume.ndim - 1 if order == "F" else 0
+
+    slice_size = max(1, volume.size // max(1, volume.shape[slab_axis]))
+    slab_size = max(1, _SLAB_NB_VOXELS // slice_size)
+    slab_ranges = _slabRanges(volume.shape, slab_axis, slab_size)
+
+    def slabData(slab_range):
+        crop = [slice(None)] * volume.ndim
+        crop[slab_axis] = slice(*slab_range)
+        data = volume[tuple(crop)].tobytes(order=order)
+        return data if compression == "raw" else zlib.compress(data, level)
+
+    if compression == "raw":
+        # the raw slabs are written one by one, and follow each other like in the volume
+        slabs = map(slabData, slab_ranges)
+        slab_nbytes = [
+            (stop - start) * slice_size * volume.dtype.itemsize
+            for start, stop in slab_ranges
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, nb_thread)) as executor:
+            slabs = list(executor.map(slabData, slab_ranges))
+        slab_nbytes = [len(slab) for slab in slabs]
+
+    offsets = np.concatenate([[0], np.cumsum(slab_nbytes, dtype=np.int64)])
+    header = json.dumps(
+        {
+            "version": _FORMAT_VERSION,
+            "fileStamps": label_index.fileStamps(
+                label_index.volumeFilepaths(volume_filepath)
+            ).tolist(),
+            "shape": list(volume.shape),
+            "dtype": volume.dtype.str,
+            "order": order,
+            "compression": compression,
+            "slabAxis": slab_axis,
+            "slabSize": slab_size,
+            "offsets": offsets.tolist(),
+        }
+    ).encode()
+
+    # the header is padded so that the data are aligned
+    data_offset = len(_MAGIC) + 8 + len(header)
+    header += b" " * (-data_offset % _ALIGNMENT)
+
+    # written in a temporary file first, so that a concurrent run never reads a partial file
+    temporary_filepath = f"{cache_filepath}.{os.getpid()}.tmp"
+
+    with open(temporary_filepath, "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+
+        for slab in slabs:
+            f.write(slab)
+
+    os.replace(temporary_filepath, cache_filepath)
+
+
+def _readCacheHeader(cache_filepath):
+    """
+    Reads the JSON header of a cache file, and the position of its data. Returns None if it is not a cache file.
+    """
+    with open(cache_filepath, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            return None
+
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length))
+
+    return header, len(_MAGIC) + 8 + header_length
+
+
+def loadVolumeCache(volume_filepath, nb_thread=os.cpu_count(), cache_filepath=None):
+    """
+    Loads the cache copy of a volume written by saveVolumeCache(), if it exists and the volume files did not change
+    since it was written. A raw copy is memory-mapped, the slabs of a compressed copy are decompressed in parallel.
+
+      Parameters:
+        volume_filepath (string): path to the NRRD file of the volume
+        nb_thread (int): number of threads to decompress the slabs on (default: number of threads available)
+        cache_filepath (string): path to the cache file (default: None, next to the volume, see cacheFilepath())
+
+      Returns:
+        volume (np.ndarray). The volume, as given by nrrd.read(), or None if there is no valid cache copy
+        header (dict). The NRRD header of the volume file (None if there is no valid cache copy)
+    """
+    if cache_filepath is None:
+        cache_filepath = cacheFilepath(volume_filepath)
+
+    if not os.path.exists(cache_filepath):
+        return None, None
+
+    try:
+        header, data_offset = _readCacheHeader(cache_filepath)
+    except (OSError, ValueError, TypeError):
+        # an unreadable copy is just a cache miss
+        return None, None
+
+    stamps = label_index.fileStamps(label_index.volumeFilepaths(volume_filepath))
+    if header["version"] != _FORMAT_VERSION or header["fileStamps"] != stamps.tolist():
+        return None, None
+
+    shape = tuple(header["shape"])
+    dtype = np.dtype(header["dtype"])
+    order = header["order"]
+    volume_header = nrrd.read_header(volume_filepath)
+
+    if header["compression"] == "raw":
+        volume = np.memmap(
+            cache_filepath,
+            dtype=dtype,
+            mode="r",
+            offset=data_offset,
+            shape=shape,
+            order=order,
+        )
+        return volume, volume_header
+
+    volume = np.empty(shape, dtype=dtype, order=order)
+    offsets = header["offsets"]
+    slab_axis = header["slabAxis"]
+
+    def readSlab(position, slab_range):
+        with open(cache_filepath, "rb") as f:
+            f.seek(data_offset + offsets[position])
+            data = zlib.decompress(f.read(offsets[position + 1] - offsets[position]))
+
+        crop = [slice(None)] * len(shape)
+        crop[slab_axis] = slice(*slab_range)
+        slab_shape = list(shape)
+        slab_shape[slab_axis] = slab_range[1] - slab_range[0]
+        volume[tuple(crop)] = np.frombuffer(data, dtype=dtype).reshape(
+            slab_shape, order=order
+        )
+
+    slab_ranges = _slabRanges(shape, slab_axis, header["slabSize"])
+    with ThreadPoolExecutor(max_workers=max(1, nb_thread)) as executor:
+        list(executor.map(readSlab, range(len(slab_ranges)), slab_ranges))
+
+    return volume, volume_header
+
+
+def loadVolume(
+    volume_filepath, compression="zlib", mmap="auto", nb_thread=os.cpu_count()
+):
+    """
+    Loads the volume and the header of a NRRD file from its cache copy, or from the NRRD file (see
+    load_volume.loadVolume()) and then writes its cache copy, so that the next runs load it much faster.
+    A raw NRRD file, which is memory-mapped, has no cache copy.
+
+      Parameters:
+        volume_filepath (string): path to the NRRD file of the volume
+        compression (string): "raw" or "zlib", the compression of the cache copy, see saveVolumeCache() (default: "zlib")
+        mmap (string or bool): whether to memory-map the NRRD file, see load_volume.loadVolume() (default: "auto")
+        nb_thread (int): number of threads to compress or decompress the slabs on (default: number of threads available)
+
+      Returns:
+        volume (np.ndarray). The volume, as given by nrrd.read()
+        header (dict). The NRRD header
+    """
+    if mmap is not False and load_volume.canMemoryMap(
+        nrrd.read_header(volume_filepath)
+    ):
+        return load_volume.loadVolume(volume_filepath, mmap)
+
+    volume, header = loadVolumeCache(volume_filepath, nb_thread)
+
+    if volume is not None:
+        print("the volume is read from its cache copy")
+        return volume, header
+
+    volume, header = load_volume.loadVolume(volume_filepath, mmap)
+
+    try:
+        saveVolumeCache(volume, volume_filepath, compression, nb_thread)
+    except OSError as e:
+        print(f"Warning: the cache copy of the volume could not be written ({e})")
+
+    return volume, header
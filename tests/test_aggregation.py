@@ -0,0 +1,40 @@
+from atlas_alignment_meter import core
+import numpy as np
+
+def test_aggregate_report():
+  rng = np.random.default_rng(0)
+  ratios = rng.random((20, 30))
+  ratios[rng.random((20, 30)) < 0.6] = 0
+  ratios[3] = 0
+  ratios[-1, 0] = 0.5
+
+  report = {"perSlice": {}, "global": {}}
+  core.aggregateReport(report, ratios)
+
+  # the same metrics as the reductions on the non-zero ratios of each slice
+  for slice_index, slice_ratios in enumerate(ratios):
+    non_zero_only = slice_ratios[slice_ratios > 0]
+
+    if len(non_zero_only) == 0:
+      assert slice_index == 3
+      assert all(report["perSlice"][name][slice_index] is None for name in report["perSlice"])
+      continue
+
+    assert np.isclose(report["perSlice"]["mean"][slice_index], np.mean(non_zero_only))
+    assert np.isclose(report["perSlice"]["std"][slice_index], np.std(non_zero_only))
+    assert report["perSlice"]["median"][slice_index] == np.median(non_zero_only)
+    assert report["perSlice"]["min"][slice_index] == np.min(non_zero_only)
+    assert report["perSlice"]["max"][slice_index] == np.max(non_zero_only)
+
+  assert report["global"]["median"] == np.median(ratios[ratios > 0])
+
+  # no regions at all
+  report = {"perSlice": {}, "global": {}}
+  core.aggregateReport(report, np.zeros((5, 0)))
+  assert report["perSlice"]["median"] == [None] * 5
+  assert report["global"]["mean"] is None
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_aggregate_report()
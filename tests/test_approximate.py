@@ -0,0 +1,75 @@
+from atlas_alignment_meter import approximate
+from atlas_alignment_meter import core
+from atlas_alignment_meter import labels
+from atlas_alignment_meter import main
+import json
+import nrrd
+import numpy as np
+import sys
+
+def test_sampling():
+  rng = np.random.default_rng(0)
+  slices = approximate.sampleSlices(100, 0.1, rng)
+  assert len(slices) == 10
+  assert slices.min() >= 1 and slices.max() <= 98
+  assert np.all(np.diff(slices) > 0)
+
+  # a region of each size range is sampled
+  region_ids = np.arange(1, 101)
+  sampled = approximate.sampleRegions(region_ids, region_ids * 10, 0.1, rng)
+  assert len(sampled) == 8
+  for stratum in np.array_split(region_ids, approximate.NB_STRATA):
+    assert np.isin(stratum, sampled).any()
+
+
+def test_compute_approximate():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics = core.compute(volume_data, regions = regions, engine = "singlepass")
+
+  # on all the slices, the metrics are exact
+  for volume in [volume_data, labels.compactLabels(volume_data)]:
+    metrics_sampled = approximate.computeApproximate(volume, regions = regions, slice_fraction = 1, nb_bootstrap = 10, seed = 0)
+    assert metrics_sampled["perRegion"] == metrics["perRegion"]
+    assert metrics_sampled["perSlice"] == metrics["perSlice"]
+
+  ratios_per_region = {}
+  core.compute(volume_data, regions = regions, engine = "singlepass", ratios_per_region = ratios_per_region)
+  ratios = np.stack(list(ratios_per_region.values()))
+  exact_mean = np.mean(ratios[ratios > 0])
+
+  metrics_sampled = approximate.computeApproximate(volume_data, regions = regions, slice_fraction = 0.2, seed = 0)
+  estimate = metrics_sampled["approximate"]
+  assert estimate["nbSampledSlices"] == 105
+  low, high = estimate["global"]["meanInterval"]
+  assert low <= estimate["global"]["mean"] <= high
+  assert low <= exact_mean <= high
+  assert sorted(estimate["perRegion"]) == sorted(regions)
+
+  # the unsampled slices have no metrics
+  assert sum(value is not None for value in metrics_sampled["perSlice"]["mean"]) <= 105
+
+  # the same seed gives the same estimate
+  assert approximate.computeApproximate(volume_data, regions = regions, slice_fraction = 0.2, seed = 0)["approximate"] == estimate
+
+
+def test_cli_approximate(tmp_path):
+  report_filepath = str(tmp_path / "report.json")
+  sys.argv = ["atlas-alignment-meter", "-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", report_filepath, "--label-index", "OFF", "--sample-slices", "0.1", "--sample-regions", "0.2", "--bootstrap", "100", "--seed", "1"]
+  main.main()
+
+  report = json.load(open(report_filepath))
+  assert report["approximate"]["nbSampledSlices"] == 53
+  assert len(report["perRegion"]) == report["approximate"]["nbSampledRegions"]
+  assert report["approximate"]["global"]["medianInterval"] is not None
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_sampling()
+  test_compute_approximate()
+  import pathlib
+  import tempfile
+  test_cli_approximate(pathlib.Path(tempfile.mkdtemp()))
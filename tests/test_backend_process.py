@@ -0,0 +1,36 @@
+from atlas_alignment_meter import core
+import nrrd
+import numpy as np
+
+def test_backend_process():
+  # load your volume and all:
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics_thread = core.compute(volume_data, regions = regions, nb_thread = 2, backend = "thread")
+  metrics_process = core.compute(volume_data, regions = regions, nb_thread = 2, backend = "process")
+
+  # Both backends must give the very same per-region metrics
+  assert len(metrics_process["perRegion"]) == len(regions)
+  for region in regions:
+    assert metrics_process["perRegion"][region] == metrics_thread["perRegion"][region]
+
+  for metric in ["mean", "median", "std", "min", "max"]:
+    a = np.array(metrics_thread["perSlice"][metric], dtype = float)
+    b = np.array(metrics_process["perSlice"][metric], dtype = float)
+    assert np.allclose(a, b, equal_nan = True)
+
+
+def test_backend_process_zero():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # the no_data part is not a region
+  metrics = core.compute(volume_data, regions = [0], nb_thread = 2, backend = "process")
+  assert metrics == None
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_backend_process()
+  test_backend_process_zero()
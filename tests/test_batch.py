@@ -0,0 +1,95 @@
+from atlas_alignment_meter import batch
+from atlas_alignment_meter import core
+from atlas_alignment_meter import main
+from atlas_alignment_meter import report_file
+import csv
+import json
+import nrrd
+import os
+import pytest
+import sys
+
+def createVolumes(tmp_path):
+  # two variants of the same volume, and a file that is not a volume
+  volume_dir = tmp_path / "volumes"
+  volume_dir.mkdir()
+
+  for name in ["variant_1.nrrd", "variant_2.nrrd"]:
+    os.symlink(os.path.abspath("./test_data/annotation_25_ccfv3.nrrd"), volume_dir / name)
+
+  (volume_dir / "variant_3.nrrd").write_text("not a volume")
+  return volume_dir
+
+
+def test_expand_volume_filepaths(tmp_path):
+  volume_dir = createVolumes(tmp_path)
+  first = str(volume_dir / "variant_2.nrrd")
+
+  # the patterns are expanded in order, each file being kept once
+  volume_filepaths = main.expandVolumeFilepaths([first, str(volume_dir / "*.nrrd")])
+  assert [os.path.basename(filepath) for filepath in volume_filepaths] == ["variant_2.nrrd", "variant_1.nrrd", "variant_3.nrrd"]
+  assert report_file.reportFilepath("reports", first, ".npz") == os.path.join("reports", "variant_2.npz")
+
+
+def test_iterate_volumes(tmp_path):
+  volume_dir = createVolumes(tmp_path)
+  volume_filepaths = main.expandVolumeFilepaths([str(volume_dir / "*.nrrd")])
+
+  loaded = list(batch.iterateVolumes(volume_filepaths, prefetch = 1))
+  assert [filepath for filepath, compacted_labels, load_time, error in loaded] == volume_filepaths
+  assert loaded[0][1].indices.shape == (528, 320, 456)
+  assert loaded[2][1] is None and loaded[2][3] is not None
+
+  # the loading stops when the volumes are no longer used
+  for volume_filepath, compacted_labels, load_time, error in batch.iterateVolumes(volume_filepaths, prefetch = 1):
+    break
+
+
+def test_cli_batch(tmp_path):
+  volume_dir = createVolumes(tmp_path)
+  report_dir = tmp_path / "reports"
+
+  sys.argv = ["atlas-alignment-meter", "batch", str(volume_dir / "*.nrrd"), "-o", str(report_dir), "-r", "68,656,320", "-t", "2"]
+  main.main()
+
+  # the same report as a run on a single volume
+  single_filepath = str(tmp_path / "single.json")
+  sys.argv = ["atlas-alignment-meter", "-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", single_filepath, "-r", "68,656,320", "-e", "SINGLEPASS", "--label-index", "OFF"]
+  main.main()
+  single_report = json.load(open(single_filepath))
+
+  for name in ["variant_1", "variant_2"]:
+    assert json.load(open(report_dir / f"{name}.json")) == single_report
+
+  # one row per volume, the volume that could not be loaded having an error instead of scores
+  summary = list(csv.DictReader(open(report_dir / "summary.csv")))
+  assert [row["volume"] for row in summary] == [str(volume_dir / f"variant_{i}.nrrd") for i in [1, 2, 3]]
+  assert summary[0]["nbRegions"] == "3" and summary[0]["error"] == ""
+  assert 0 < float(summary[0]["pooledMin"]) <= float(summary[0]["pooledMedian"]) <= float(summary[0]["pooledMax"])
+  assert summary[0]["pooledMedian"] == summary[1]["pooledMedian"]
+  assert summary[2]["error"] != "" and summary[2]["pooledMedian"] == ""
+
+  # the pooled scores are not the global section of the report, which is only given when the last slice has ratios
+  assert single_report["global"]["median"] is None
+  ratios_per_region = {}
+  core.compute(nrrd.read("./test_data/annotation_25_ccfv3.nrrd")[0], regions = [68, 656, 320], engine = "singlepass", ratios_per_region = ratios_per_region)
+  assert float(summary[0]["pooledMedian"]) == pytest.approx(batch.pooledScores(ratios_per_region)["pooledMedian"])
+
+  # the reports of two volumes of the same name would overwrite each other
+  other_dir = tmp_path / "other"
+  other_dir.mkdir()
+  os.symlink(os.path.abspath("./test_data/annotation_25_ccfv3.nrrd"), other_dir / "variant_1.nrrd")
+  assert len(main.parse_batch_args([str(volume_dir / "variant_1.nrrd"), "-o", str(report_dir)]).volume_filepaths) == 1
+
+  for invalid_args in [[str(other_dir / "variant_1.nrrd")], [str(volume_dir / "*.txt")], ["-r", "LARGEST,0"], ["--prefetch", "0"]]:
+    with pytest.raises(SystemExit):
+      main.parse_batch_args([str(volume_dir / "variant_1.nrrd"), "-o", str(report_dir)] + invalid_args)
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_expand_volume_filepaths(pathlib.Path(tempfile.mkdtemp()))
+  test_iterate_volumes(pathlib.Path(tempfile.mkdtemp()))
+  test_cli_batch(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,71 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import export_volume
+from atlas_alignment_meter import labels
+import nrrd
+import numpy as np
+
+def test_compacted_labels():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  compacted_labels = labels.compactLabels(volume_data)
+
+  ids, counts = np.unique(volume_data, return_counts = True)
+  assert np.array_equal(compacted_labels.ids, ids)
+  assert np.array_equal(compacted_labels.counts, counts)
+  assert compacted_labels.indices.dtype == np.uint16
+  assert np.array_equal(compacted_labels.ids[compacted_labels.indices], volume_data)
+
+
+def test_compute_compacted_labels():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  compacted_labels = labels.compactLabels(volume_data)
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics = core.compute(volume_data, regions = regions)
+
+  # The metrics are the same when computed on the compacted labels, with both engines
+  for engine in core.ENGINES:
+    metrics_compacted = core.compute(compacted_labels, regions = regions, engine = engine)
+    assert metrics_compacted["perRegion"] == metrics["perRegion"]
+    assert metrics_compacted["global"] == metrics["global"]
+
+
+def test_export_compacted_labels(tmp_path):
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  compacted_labels = labels.compactLabels(volume_data)
+
+  regions = [68, 656, 320]
+  metrics = core.compute(compacted_labels, regions = regions, engine = "singlepass")
+
+  # the exported volume is the same from the volume and from its compacted labels
+  for reference_volume_data, name in [(volume_data, "volume"), (compacted_labels, "compacted")]:
+    export_volume.createVolumeMetricsPerRegion(metrics["perRegion"], reference_volume_data, volume_header, str(tmp_path / f"region_{name}.nrrd"))
+    export_volume.createVolumeMetricsPerSlice(metrics["perSlice"], reference_volume_data, volume_header, str(tmp_path / f"slice_{name}.nrrd"))
+
+  for export in ["region", "slice"]:
+    from_volume, _ = nrrd.read(str(tmp_path / f"{export}_volume.nrrd"))
+    from_compacted, _ = nrrd.read(str(tmp_path / f"{export}_compacted.nrrd"))
+    assert np.array_equal(from_volume, from_compacted)
+
+
+def test_select_regions():
+  # regions 2, 5 and 7 have the same size, as well as regions 3 and 9
+  ids = np.array([0, 2, 3, 5, 7, 9])
+  counts = np.array([100, 40, 10, 40, 40, 10])
+  compacted_labels = labels.CompactedLabels(None, ids, counts)
+
+  assert labels.selectRegions("12,7", compacted_labels) == [12, 7]
+  assert labels.selectRegions("LARGEST,2", compacted_labels) == [2, 5]
+  assert labels.selectRegions("LARGEST,4", compacted_labels) == [2, 5, 7, 3]
+  assert labels.selectRegions("SMALLEST,3", compacted_labels) == [3, 9, 2]
+  assert labels.selectRegions("largest,10", compacted_labels) == [2, 5, 7, 3, 9]
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_compacted_labels()
+  test_compute_compacted_labels()
+  test_export_compacted_labels(pathlib.Path(tempfile.mkdtemp()))
+  test_select_regions()
@@ -0,0 +1,62 @@
+from atlas_alignment_meter import core
+import nrrd
+import numpy as np
+
+def test_engine_singlepass():
+  # load your volume and all:
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics_region = core.compute(volume_data, regions = regions, engine = "region")
+  metrics_single_pass = core.compute(volume_data, regions = regions, engine = "singlepass")
+
+  # Both engines must give the very same per-region metrics
+  assert len(metrics_single_pass["perRegion"]) == len(regions)
+  for region in regions:
+    assert metrics_single_pass["perRegion"][region] == metrics_region["perRegion"][region]
+
+  # The per-slice metrics are the same, only the order of the regions (hence of the sums) may differ
+  for metric in ["mean", "median", "std", "min", "max"]:
+    assert len(metrics_single_pass["perSlice"][metric]) == volume_data.shape[0]
+    a = np.array(metrics_region["perSlice"][metric], dtype = float)
+    b = np.array(metrics_single_pass["perSlice"][metric], dtype = float)
+    assert np.allclose(a, b, equal_nan = True)
+
+  assert metrics_single_pass["global"] == metrics_region["global"]
+
+
+def test_engine_singlepass_zero():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # the no_data part is not a region
+  metrics = core.compute(volume_data, regions = [0], engine = "singlepass")
+  assert metrics == None
+
+
+def test_engine_singlepass_slabs():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # each slab ends with the first slice of the next one
+  assert core.overlappingSlabRanges(10, 3) == [(0, 4), (3, 7), (6, 10)]
+  assert core.overlappingSlabRanges(2, 4) == [(0, 2)]
+
+  # the counts of the slabs add up to those of the whole volume, for a single region as for several
+  for regions in [[997], [68, 656, 320]]:
+    for coronal_axis_index in [0, 2]:
+      metrics = core.compute(volume_data, coronal_axis_index, regions = regions, nb_thread = 1, engine = "singlepass")
+
+      for backend in core.BACKENDS:
+        timings = {}
+        metrics_slabs = core.compute(volume_data, coronal_axis_index, regions = regions, nb_thread = 4, engine = "singlepass", backend = backend, timings = timings)
+        assert timings["nbWorkers"] == 4
+        assert metrics_slabs["perRegion"] == metrics["perRegion"]
+        assert metrics_slabs["perSlice"] == metrics["perSlice"]
+        assert metrics_slabs["global"] == metrics["global"]
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_engine_singlepass()
+  test_engine_singlepass_zero()
+  test_engine_singlepass_slabs()
@@ -1,7 +1,10 @@
 from atlas_alignment_meter import core
 from atlas_alignment_meter import export_volume
+from atlas_alignment_meter import labels
 import nrrd
+import numpy as np
 import os
+import pytest
 
 def test_exporter():
   # load your volume and all:
@@ -51,6 +54,60 @@ def test_exporter():
 
   assert valid_slice_file
 
+
+def test_exporter_several_metrics():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  regions = [68, 656, 320]
+  metrics = core.compute(volume_data, regions = regions, engine = "singlepass")
+
+  # a region without metric, as when it is on a single slice
+  metrics["perRegion"][656]["median"] = None
+
+  metric_names = ["mean", "median"]
+  filepaths = ["/tmp/region_volume_mean.nrrd", "/tmp/region_volume_median.nrrd"]
+
+  for reference_volume_data in [volume_data, labels.compactLabels(volume_data)]:
+    export_volume.createVolumeMetricsPerRegion(metrics_per_region = metrics["perRegion"], reference_volume_data = reference_volume_data, reference_volume_meta = volume_header, output_filepath = filepaths, metric_name = metric_names, fill_value = -1)
+
+    for metric_name, filepath in zip(metric_names, filepaths):
+      data_region, header_region = nrrd.read(filepath)
+
+      expected = np.zeros_like(volume_data, dtype = np.float32)
+      for region in regions:
+        value = metrics["perRegion"][region][metric_name]
+        expected[volume_data == region] = -1 if value is None else value
+
+      assert np.array_equal(data_region, expected)
+
+  # the regions have no min nor max
+  with pytest.raises(Exception, match = "metric per region"):
+    export_volume.createVolumeMetricsPerRegion(metrics_per_region = metrics["perRegion"], reference_volume_data = volume_data, reference_volume_meta = volume_header, output_filepath = "/tmp/region_volume_max.nrrd", metric_name = "max")
+
+
+def test_exporter_per_slice_axis():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  regions = [68, 656, 320]
+
+  for axis in [0, 1, 2]:
+    metrics = core.compute(volume_data, coronal_axis_index = axis, regions = regions, engine = "singlepass")
+
+    # the metrics volume is written in a memory-mapped array
+    out = np.lib.format.open_memmap("/tmp/slice_volume.npy", mode = "w+", dtype = np.float32, shape = volume_data.shape)
+    metric_volume = export_volume.createVolumeMetricsPerSlice(metrics_per_slice = metrics["perSlice"], reference_volume_data = volume_data, reference_volume_meta = volume_header, output_filepath = None, per_slice_axis = axis, metric_name = "median", out = out)
+    assert metric_volume is out
+
+    expected = np.zeros_like(volume_data, dtype = np.float32)
+    for slice_index, value in enumerate(metrics["perSlice"]["median"]):
+      index = [slice(None)] * 3
+      index[axis] = slice_index
+      expected[tuple(index)][volume_data[tuple(index)] != 0] = value or 0
+
+    assert np.array_equal(out, expected)
+
+
 # to reun the test manually
 if __name__ == "__main__":
-  test_exporter()
\ No newline at end of file
+  test_exporter()
+  test_exporter_several_metrics()
+  test_exporter_per_slice_axis()
\ No newline at end of file
@@ -0,0 +1,61 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import incremental
+import nrrd
+import numpy as np
+
+def realign(volume_data):
+  # a few slices of the volume change, as in an iteration of a realignment
+  new_volume_data = volume_data.copy()
+  new_volume_data[200] = np.roll(new_volume_data[200], 3, axis = 0)
+  new_volume_data[201] = np.roll(new_volume_data[201], -2, axis = 1)
+  new_volume_data[350] = np.roll(new_volume_data[350], 1, axis = 1)
+  # with a region that was not in the volume
+  new_volume_data[250, 100:110, 100:110] = 999999
+  return new_volume_data
+
+
+def test_slice_checksums():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  new_volume_data = realign(volume_data)
+
+  checksums = incremental.sliceChecksums(volume_data)
+  new_checksums = incremental.sliceChecksums(new_volume_data)
+  assert len(checksums) == volume_data.shape[0]
+  assert incremental.changedSlices(checksums, new_checksums).tolist() == [200, 201, 250, 350]
+
+  # along another axis
+  checksums = incremental.sliceChecksums(volume_data, coronal_axis_index = 2)
+  assert len(checksums) == volume_data.shape[2]
+
+  assert incremental.affectedPairs([0, 200, 201, 527], 528).tolist() == [199, 200, 201, 526]
+
+
+def test_compute_incremental():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  new_volume_data = realign(volume_data)
+  metrics = core.compute(new_volume_data, engine = "singlepass")
+
+  for use_checksums in [True, False]:
+    ratios_per_region = {}
+    core.compute(volume_data, engine = "singlepass", ratios_per_region = ratios_per_region)
+
+    timings = {}
+    if use_checksums:
+      checksums = incremental.sliceChecksums(volume_data)
+      metrics_incremental = incremental.computeIncremental(new_volume_data, ratios_per_region, checksums = checksums, engine = "singlepass", timings = timings)
+      assert np.array_equal(checksums, incremental.sliceChecksums(new_volume_data))
+    else:
+      metrics_incremental = incremental.computeIncremental(new_volume_data, ratios_per_region, changed_slices = [200, 201, 250, 350], engine = "singlepass", timings = timings)
+
+    assert timings["nbChangedSlices"] == 4
+    # only the new region is computed entirely
+    assert len(metrics_incremental["perRegion"]) == timings["nbCachedRegions"] + 1
+    assert metrics_incremental["perRegion"] == metrics["perRegion"]
+    assert metrics_incremental["perSlice"] == metrics["perSlice"]
+    assert metrics_incremental["global"] == metrics["global"]
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_slice_checksums()
+  test_compute_incremental()
@@ -0,0 +1,152 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import label_index
+from atlas_alignment_meter import main
+import json
+import nrrd
+import numpy as np
+import os
+import shutil
+import sys
+
+def test_label_index():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  index = label_index.buildLabelIndex(volume_data)
+
+  ids, counts = np.unique(volume_data, return_counts = True)
+  assert np.array_equal(index.ids, ids)
+  assert np.array_equal(index.counts, counts)
+  assert index.shape == volume_data.shape
+
+  # the bounding boxes are the ranges of slices of each label along each axis
+  for position in [0, 100, len(ids) - 1]:
+    coordinates = np.nonzero(volume_data == ids[position])
+    for axis in range(3):
+      assert index.bounding_boxes[position, axis].tolist() == [coordinates[axis].min(), coordinates[axis].max() + 1]
+
+
+def test_label_index_file(tmp_path):
+  volume_filepath = str(tmp_path / "annotation.nrrd")
+  shutil.copyfile("./test_data/annotation_25_ccfv3.nrrd", volume_filepath)
+  volume_data, volume_header = nrrd.read(volume_filepath)
+
+  assert label_index.loadLabelIndex(volume_filepath) is None
+
+  index = label_index.buildLabelIndex(volume_data)
+  label_index.saveLabelIndex(index, volume_filepath)
+  assert os.path.exists(label_index.labelIndexFilepath(volume_filepath))
+
+  loaded_index = label_index.loadLabelIndex(volume_filepath)
+  for field in ["ids", "counts", "bounding_boxes"]:
+    assert np.array_equal(getattr(loaded_index, field), getattr(index, field))
+  assert loaded_index.shape == index.shape
+
+  # touched but not changed: still valid
+  os.utime(volume_filepath, ns = (0, 0))
+  assert label_index.loadLabelIndex(volume_filepath) is not None
+
+  # changed: not valid anymore
+  volume_data[0, 0, 0] = 1
+  nrrd.write(volume_filepath, volume_data, volume_header)
+  assert label_index.loadLabelIndex(volume_filepath) is None
+
+
+def test_compute_label_index():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  index = label_index.buildLabelIndex(volume_data)
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics = core.compute(volume_data, regions = regions)
+  timings = {}
+  metrics_index = core.compute(volume_data, regions = regions, label_index = index, timings = timings)
+
+  # the volume is not scanned again
+  assert "regionList" not in timings["phases"]
+  assert "census" not in timings["phases"]
+  assert metrics_index["perRegion"] == metrics["perRegion"]
+  assert metrics_index["global"] == metrics["global"]
+
+
+def test_cli_label_index(tmp_path):
+  volume_filepath = str(tmp_path / "annotation.nrrd")
+  shutil.copyfile("./test_data/annotation_25_ccfv3.nrrd", volume_filepath)
+  report_filepath = str(tmp_path / "report.json")
+
+  # without a cache folder, nothing is written next to the volume unless asked to
+  argv = ["atlas-alignment-meter", "-i", volume_filepath, "-o", report_filepath, "-r", "LARGEST,3", "--profile"]
+  sys.argv = argv
+  main.main()
+  assert not os.path.exists(label_index.labelIndexFilepath(volume_filepath))
+
+  for label_index_args, index_filepath in [
+    (["--label-index", "SIDECAR"], label_index.labelIndexFilepath(volume_filepath)),
+    (["--cache-dir", str(tmp_path / "cache")], label_index.labelIndexFilepath(volume_filepath, str(tmp_path / "cache"))),
+  ]:
+    # the label index is built on the first run and used by the next ones
+    sys.argv = argv + label_index_args
+    main.main()
+    first_report = json.load(open(report_filepath))
+    assert "compaction" in first_report["timings"]["phases"]
+    assert os.path.exists(index_filepath)
+
+    main.main()
+    second_report = json.load(open(report_filepath))
+    assert "compaction" not in second_report["timings"]["phases"]
+    assert second_report["perRegion"] == first_report["perRegion"]
+
+
+def test_label_index_filepath(tmp_path):
+  # the volumes of the same name in different folders have their own label index in the cache folder
+  cache_dir = str(tmp_path / "cache")
+  index_filepath = label_index.labelIndexFilepath("a/annotation.nrrd", cache_dir)
+  assert os.path.dirname(index_filepath) == cache_dir
+  assert os.path.basename(index_filepath).startswith("annotation.nrrd.")
+  assert index_filepath != label_index.labelIndexFilepath("b/annotation.nrrd", cache_dir)
+  assert label_index.labelIndexFilepath("a/annotation.nrrd") == "a/annotation.nrrd.labels.npz"
+
+
+def test_volume_content_hash(tmp_path):
+  volume_filepath = str(tmp_path / "annotation.nrrd")
+  shutil.copyfile("./test_data/annotation_25_ccfv3.nrrd", volume_filepath)
+  content_hash = label_index.contentHash([volume_filepath])
+
+  # without a label index, the files are hashed
+  assert label_index.volumeContentHash(volume_filepath) == content_hash
+
+  # the hash stored in the label index is used as long as the files keep their size and modification time
+  index = label_index.LabelIndex(np.array([0]), np.array([1]), np.zeros((1, 3, 2), dtype = np.int64), (1, 1, 1))
+  label_index.saveLabelIndex(index, volume_filepath, content_hash = "stored")
+  assert label_index.volumeContentHash(volume_filepath) == "stored"
+
+  os.utime(volume_filepath, ns = (0, 0))
+  assert label_index.volumeContentHash(volume_filepath) == content_hash
+
+
+def test_damaged_label_index(tmp_path):
+  volume_filepath = str(tmp_path / "annotation.nrrd")
+  shutil.copyfile("./test_data/annotation_25_ccfv3.nrrd", volume_filepath)
+  volume_data, volume_header = nrrd.read(volume_filepath)
+  index_filepath = label_index.labelIndexFilepath(volume_filepath)
+
+  label_index.saveLabelIndex(label_index.buildLabelIndex(volume_data), volume_filepath)
+  index_content = open(index_filepath, "rb").read()
+
+  # a garbage or truncated index file is not valid, and is built again
+  for damaged_content in [b"not a label index", index_content[:len(index_content) // 2]]:
+    with open(index_filepath, "wb") as f:
+      f.write(damaged_content)
+    assert label_index.loadLabelIndex(volume_filepath) is None
+    assert label_index.volumeContentHash(volume_filepath) == label_index.contentHash([volume_filepath])
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_label_index()
+  test_label_index_file(pathlib.Path(tempfile.mkdtemp()))
+  test_compute_label_index()
+  test_cli_label_index(pathlib.Path(tempfile.mkdtemp()))
+  test_label_index_filepath(pathlib.Path(tempfile.mkdtemp()))
+  test_volume_content_hash(pathlib.Path(tempfile.mkdtemp()))
+  test_damaged_label_index(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,75 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import main
+from atlas_alignment_meter import profiling
+import nrrd
+import numpy as np
+import tracemalloc
+
+def test_memory_budget():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  timings = {}
+  metrics = core.compute(volume_data, regions = regions, nb_thread = 4, timings = timings)
+  assert timings["nbWorkers"] == 4
+
+  # a budget for only two of the largest regions at once
+  worker_memory = timings["estimatedWorkerMemory"]
+  timings = {}
+  metrics_budget = core.compute(volume_data, regions = regions, nb_thread = 4, max_memory = 2 * worker_memory + 1, timings = timings)
+  assert timings["nbWorkers"] == 2
+  assert metrics_budget["perRegion"] == metrics["perRegion"]
+
+  # a budget under the need of a single region still runs, on a single thread
+  timings = {}
+  metrics_budget = core.compute(volume_data, regions = regions, nb_thread = 4, max_memory = 1, timings = timings)
+  assert timings["nbWorkers"] == 1
+  assert metrics_budget["perRegion"] == metrics["perRegion"]
+
+
+def test_memory_estimate():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  region_ids = np.array([68, 315, 320], dtype = volume_data.dtype)
+  voxel_counts, bounding_boxes = core.computeRegionCensus(volume_data, region_ids)
+
+  # the memory allocated for a region is within its estimate
+  for id, bounding_box in zip(region_ids, bounding_boxes):
+    tracemalloc.start()
+    core.threadedProcess(volume_data, id, [], {"perRegion": {}}, 0, (1, 2), bounding_box)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak <= core.estimateRegionMemory(bounding_box, 0, volume_data.shape[0])
+
+
+def test_memory_per_phase():
+  timings = {}
+
+  tracemalloc.start()
+  # over the largest threshold from which malloc maps new memory, so that it is not already resident
+  with profiling.timePhase(timings, "allocation"):
+    data = np.ones(2**23)
+  tracemalloc.stop()
+
+  assert timings["memory"]["allocation"]["peakAllocated"] >= data.nbytes
+
+  # the peak resident set size is the one of the process, not of the phase
+  assert timings["peakRss"] > 0
+  assert "peakRss" not in timings["memory"]["allocation"]
+
+  if profiling.currentRss() is not None:
+    assert timings["memory"]["allocation"]["rssDelta"] >= data.nbytes // 2
+
+
+def test_parse_memory_size():
+  assert main.parseMemorySize("1024") == 1024
+  assert main.parseMemorySize("512M") == 512 * 2**20
+  assert main.parseMemorySize("1.5gb") == int(1.5 * 2**30)
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_memory_budget()
+  test_memory_estimate()
+  test_memory_per_phase()
+  test_parse_memory_size()
@@ -0,0 +1,37 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import load_volume
+import nrrd
+import numpy as np
+
+def test_memory_map():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # gzip-encoded files can't be memory-mapped, they are read as usual
+  assert not load_volume.canMemoryMap(volume_header)
+  data, header = load_volume.loadVolume("./test_data/annotation_25_ccfv3.nrrd")
+  assert not isinstance(data, np.memmap)
+
+  # with the data attached or detached
+  nrrd.write("/tmp/annotation_attached.nrrd", volume_data, {"encoding": "raw"})
+  nrrd.write("/tmp/annotation_detached.nhdr", volume_data, {"encoding": "raw"}, detached_header = True)
+
+  for filepath in ["/tmp/annotation_attached.nrrd", "/tmp/annotation_detached.nhdr"]:
+    data, header = load_volume.loadVolume(filepath)
+
+    assert isinstance(data, np.memmap)
+    assert data.shape == volume_data.shape
+    assert np.array_equal(data, volume_data)
+
+    # the volume is read-only
+    assert not data.flags.writeable
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics = core.compute(volume_data, regions = regions)
+  metrics_mmap = core.compute(data, regions = regions)
+  assert metrics_mmap["perRegion"] == metrics["perRegion"]
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_memory_map()
@@ -0,0 +1,50 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import main
+from atlas_alignment_meter import multi_axis
+import json
+import nrrd
+import os
+import sys
+
+def test_compute_all_axes():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  timings = {}
+  metrics = multi_axis.computeAllAxes(volume_data, regions = regions, engine = "singlepass", timings = timings)
+
+  # the labels are compacted and counted once for the three axes
+  assert list(timings["phases"]) == ["compaction", "census"]
+  assert sorted(metrics["perAxis"]) == [0, 1, 2]
+  assert "timings" not in metrics
+
+  for axis in multi_axis.AXES:
+    metrics_axis = core.compute(volume_data, coronal_axis_index = axis, regions = regions, engine = "singlepass")
+    assert "regionList" not in timings["perAxis"][axis]["phases"]
+    assert metrics["perAxis"][axis]["perRegion"] == metrics_axis["perRegion"]
+    assert metrics["perAxis"][axis]["perSlice"] == metrics_axis["perSlice"]
+    assert len(metrics["perAxis"][axis]["perSlice"]["mean"]) == volume_data.shape[axis]
+
+
+def test_cli_all_axes(tmp_path):
+  report_filepath = str(tmp_path / "report.json")
+  slice_volume_filepath = str(tmp_path / "per_slice.nrrd")
+  sys.argv = ["atlas-alignment-meter", "-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", report_filepath, "-r", "68,656", "-e", "SINGLEPASS", "--label-index", "OFF", "-a", "ALL", "-vs", slice_volume_filepath]
+  main.main()
+
+  report = json.load(open(report_filepath))
+  assert sorted(report["perAxis"]) == ["0", "1", "2"]
+  assert "timings" not in report
+  assert "timings" not in report["perAxis"]["0"]
+
+  for axis in multi_axis.AXES:
+    assert os.path.exists(str(tmp_path / f"per_slice_axis{axis}.nrrd"))
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_compute_all_axes()
+  test_cli_all_axes(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,134 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import load_volume
+import nrrd
+import numpy as np
+import pytest
+
+class ChunkedArray:
+  # an array-like that only gives access to slabs, like an HDF5 dataset or a zarr array
+  def __init__(self, array, chunks):
+    self.array = array
+    self.shape = array.shape
+    self.dtype = array.dtype
+    self.chunks = chunks
+
+  def __getitem__(self, key):
+    return self.array[key].copy()
+
+
+def test_slab_size():
+  volume = ChunkedArray(np.zeros((100, 200, 300), dtype = np.uint32), (8, 200, 300))
+  slice_nbytes = 200 * 300 * (4 + core._SINGLE_PASS_BYTES_PER_VOXEL)
+
+  # whole chunks when the budget allows it
+  assert core.estimateSlabSize(volume, 0, 20 * slice_nbytes) == 16
+  assert core.estimateSlabSize(volume, 0, 5 * slice_nbytes) == 5
+  assert core.estimateSlabSize(volume, 0, 1) == 1
+  assert core.estimateSlabSize(volume, 0, 1000 * slice_nbytes) == 100
+
+
+def test_compute_out_of_core(tmp_path):
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics = core.compute(volume_data, regions = regions)
+
+  npy_filepath = str(tmp_path / "annotation.npy")
+  np.save(npy_filepath, volume_data)
+  memory_mapped_volume = load_volume.openArray(npy_filepath)
+  chunked_volume = ChunkedArray(volume_data, (64, 64, 64))
+
+  for volume in [memory_mapped_volume, chunked_volume]:
+    assert core.isOutOfCore(volume, max_memory = 100 * 2**20)
+    ratios_per_region = {}
+    timings = {}
+    metrics_out_of_core = core.compute(volume, regions = regions, max_memory = 100 * 2**20, ratios_per_region = ratios_per_region, timings = timings)
+
+    assert timings["slabSize"] < volume_data.shape[0]
+    assert sorted(ratios_per_region) == sorted(regions)
+    assert metrics_out_of_core["perRegion"] == metrics["perRegion"]
+    assert metrics_out_of_core["perSlice"] == metrics["perSlice"]
+    assert metrics_out_of_core["global"] == metrics["global"]
+
+    # the regions already computed are not counted again
+    cached_ratios = {id: ratios_per_region[id] for id in regions[:4]}
+    timings = {}
+    metrics_cached = core.compute(volume, regions = regions, max_memory = 100 * 2**20, ratios_per_region = cached_ratios, timings = timings)
+    assert timings["nbCachedRegions"] == 4
+    assert sorted(cached_ratios) == sorted(regions)
+    assert metrics_cached["perRegion"] == metrics["perRegion"]
+    assert metrics_cached["perSlice"] == metrics["perSlice"]
+
+    # nothing is read when all the regions were already computed
+    timings = {}
+    metrics_cached = core.compute(volume, regions = regions, max_memory = 100 * 2**20, ratios_per_region = cached_ratios, timings = timings)
+    assert "slabSize" not in timings
+    assert metrics_cached["perRegion"] == metrics["perRegion"]
+
+
+def test_compute_memory_mapped(tmp_path):
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  regions = [68, 656, 320]
+  metrics = core.compute(volume_data, regions = regions, nb_thread = 1, engine = "singlepass")
+
+  npy_filepath = str(tmp_path / "annotation.npy")
+  np.save(npy_filepath, volume_data)
+  memory_mapped_volume = load_volume.openArray(npy_filepath)
+
+  # within the memory budget, a memory-mapped volume is computed by the engine, on all the threads
+  assert not core.isOutOfCore(memory_mapped_volume)
+  assert not core.isOutOfCore(memory_mapped_volume, max_memory = volume_data.nbytes)
+  assert core.isOutOfCore(memory_mapped_volume, max_memory = volume_data.nbytes - 1)
+
+  timings = {}
+  metrics_mmap = core.compute(memory_mapped_volume, regions = regions, nb_thread = 3, engine = "singlepass", timings = timings)
+  assert timings["nbWorkers"] == 3
+  assert "slabSize" not in timings
+  assert metrics_mmap == metrics
+
+  # unless it is asked to be computed slab by slab
+  timings = {}
+  metrics_mmap = core.compute(memory_mapped_volume, regions = regions, engine = "singlepass", timings = timings, out_of_core = True)
+  assert "slabSize" in timings
+  assert metrics_mmap["perRegion"] == metrics["perRegion"]
+
+
+def test_compute_hdf5(tmp_path):
+  h5py = pytest.importorskip("h5py")
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  regions = [68, 656, 320]
+  metrics = core.compute(volume_data, regions = regions)
+
+  h5_filepath = str(tmp_path / "annotation.h5")
+  with h5py.File(h5_filepath, "w") as h5_file:
+    h5_file.create_dataset("annotation", data = volume_data, chunks = (32, 32, 32))
+
+  metrics_hdf5 = core.compute(load_volume.openArray(h5_filepath), regions = regions, max_memory = 100 * 2**20)
+  assert metrics_hdf5["perRegion"] == metrics["perRegion"]
+  assert metrics_hdf5["perSlice"] == metrics["perSlice"]
+
+
+def test_compute_zarr(tmp_path):
+  zarr = pytest.importorskip("zarr")
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  regions = [68, 656, 320]
+  metrics = core.compute(volume_data, regions = regions)
+
+  zarr_filepath = str(tmp_path / "annotation.zarr")
+  zarr.save_array(zarr_filepath, volume_data, chunks = (32, 32, 32))
+
+  metrics_zarr = core.compute(load_volume.openArray(zarr_filepath), regions = regions, max_memory = 100 * 2**20)
+  assert metrics_zarr["perRegion"] == metrics["perRegion"]
+  assert metrics_zarr["perSlice"] == metrics["perSlice"]
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_slab_size()
+  test_compute_out_of_core(pathlib.Path(tempfile.mkdtemp()))
+  test_compute_memory_mapped(pathlib.Path(tempfile.mkdtemp()))
+  test_compute_hdf5(pathlib.Path(tempfile.mkdtemp()))
+  test_compute_zarr(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,77 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import main
+from atlas_alignment_meter import profiling
+import json
+import nrrd
+import os
+import pstats
+import sys
+import time
+
+def test_time_phase():
+  timings = {}
+
+  # the times of a phase run several times are summed
+  for _ in range(2):
+    with profiling.timePhase(timings, "sleep"):
+      time.sleep(0.01)
+
+  assert list(timings["phases"]) == ["sleep"]
+  assert timings["phases"]["sleep"] >= 0.02
+
+  # nothing is measured without timings
+  with profiling.timePhase(None, "sleep"):
+    pass
+
+
+def test_compute_timings():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  regions = [68, 656, 320]
+
+  # the report has no timings unless they are requested
+  metrics = core.compute(volume_data, regions = regions, nb_thread = 2)
+  assert "timings" not in metrics
+
+  timings = {}
+  metrics_timed = core.compute(volume_data, regions = regions, nb_thread = 2, timings = timings)
+  assert metrics_timed == metrics
+  assert list(timings["phases"]) == ["regionList", "census", "regions", "aggregation"]
+  assert timings["nbWorkers"] == 2
+  assert sorted(timings["perRegion"]) == sorted(regions)
+
+  timings = {}
+  core.compute(volume_data, regions = regions, nb_thread = 1, engine = "singlepass", timings = timings)
+  assert list(timings["phases"]) == ["regionList", "singlePass", "aggregation"]
+  assert timings["nbWorkers"] == 1
+
+  # one worker per slab
+  timings = {}
+  core.compute(volume_data, regions = regions, nb_thread = 3, engine = "singlepass", timings = timings)
+  assert timings["nbWorkers"] == 3
+
+
+def test_cli_profile():
+  report_filepath = "/tmp/profile_report.json"
+  cprofile_filepath = "/tmp/profile.prof"
+
+  # without --profile, the report has no timings
+  sys.argv = ["atlas-alignment-meter", "-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", report_filepath, "-r", "68,656", "-e", "SINGLEPASS", "--label-index", "OFF"]
+  main.main()
+  assert "timings" not in json.load(open(report_filepath))
+
+  sys.argv += ["-vs", "/tmp/profile_slice_volume.nrrd", "--profile", cprofile_filepath]
+  main.main()
+  timings = json.load(open(report_filepath))["timings"]
+  assert list(timings["phases"]) == ["load", "compaction", "singlePass", "aggregation", "serialization", "exportPerSlice"]
+  assert all(wall_time >= 0 for wall_time in timings["phases"].values())
+
+  # the cProfile file is readable
+  assert os.path.exists(cprofile_filepath)
+  pstats.Stats(cprofile_filepath)
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_time_phase()
+  test_compute_timings()
+  test_cli_profile()
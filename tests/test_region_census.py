@@ -0,0 +1,47 @@
+from atlas_alignment_meter import core
+import nrrd
+import numpy as np
+
+def test_region_census():
+  # load your volume and all:
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = np.array(sorted([68, 656, 320, 1030, 670, 113, 943, 962, 667]), dtype = volume_data.dtype)
+  voxel_counts, bounding_boxes = core.computeRegionCensus(volume_data, regions)
+
+  assert voxel_counts.shape == (len(regions),)
+  assert bounding_boxes.shape == (len(regions), 3, 2)
+
+  for i, region in enumerate(regions):
+    positions = np.nonzero(volume_data == region)
+    assert voxel_counts[i] == len(positions[0])
+
+    # start is inclusive, stop is exclusive
+    for axis in range(3):
+      assert bounding_boxes[i][axis][0] == positions[axis].min()
+      assert bounding_boxes[i][axis][1] == positions[axis].max() + 1
+
+
+def test_cropped_region_ratios():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  regions = np.array([68, 943], dtype = volume_data.dtype)
+  voxel_counts, bounding_boxes = core.computeRegionCensus(volume_data, regions)
+
+  # computing on the sub-volume of a region must give the same ratios as on the whole volume
+  for region, bounding_box in zip(regions, bounding_boxes):
+    ratios_whole = []
+    ratios_cropped = []
+    report = {"perRegion": {}}
+    core.threadedProcess(volume_data, region, ratios_whole, report, 0, (1, 2))
+    core.threadedProcess(volume_data, region, ratios_cropped, report, 0, (1, 2), bounding_box)
+
+    assert len(ratios_cropped[0]) == volume_data.shape[0]
+    assert np.array_equal(ratios_whole[0], ratios_cropped[0])
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_region_census()
+  test_cropped_region_ratios()
@@ -0,0 +1,74 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import main
+from atlas_alignment_meter import region_ratios
+from atlas_alignment_meter import report_file
+import json
+import nrrd
+import numpy as np
+import sys
+
+def test_region_ratios():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  ratios_per_region = {}
+  core.compute(volume_data, regions = regions, engine = "singlepass", ratios_per_region = ratios_per_region)
+  spans = region_ratios.fromDense(ratios_per_region)
+
+  # only the span of each region is kept, and nothing non-zero is lost
+  assert spans.region_ids.tolist() == sorted(regions)
+  assert spans.values.dtype == np.float32
+  assert len(spans.values) < len(regions) * volume_data.shape[0]
+  dense = region_ratios.toDense(spans)
+
+  for row, id in enumerate(spans.region_ids.tolist()):
+    span = spans.values[spans.offsets[row] : spans.offsets[row + 1]]
+    assert span[0] != 0 and span[-1] != 0
+    assert np.allclose(dense[id], ratios_per_region[id], atol = 1e-6)
+    assert np.count_nonzero(dense[id]) == np.count_nonzero(ratios_per_region[id])
+
+  # the same ratios once written as JSON
+  from_json = region_ratios.fromJson(json.loads(json.dumps(region_ratios.toJson(spans))))
+  assert np.array_equal(from_json.starts, spans.starts)
+  assert np.array_equal(from_json.offsets, spans.offsets)
+  assert np.allclose(from_json.values, spans.values, atol = 1e-6)
+
+  # a region without any ratio has an empty span
+  empty = region_ratios.fromDense({1: np.zeros(5), 2: np.array([0, 0.5, 0, 0.2, 0])})
+  assert empty.starts.tolist() == [0, 1] and empty.offsets.tolist() == [0, 0, 3]
+  assert np.array_equal(region_ratios.toDense(empty)[2], [0, 0.5, 0, np.float32(0.2), 0])
+
+
+def test_cli_region_ratios(tmp_path):
+  json_filepath = str(tmp_path / "report.json")
+  npz_filepath = str(tmp_path / "report.npz")
+  argv = ["atlas-alignment-meter", "-i", "./test_data/annotation_25_ccfv3.nrrd", "-r", "68,656,320", "-e", "SINGLEPASS", "--label-index", "OFF", "--report-ratio-spans"]
+
+  sys.argv = argv + ["-o", json_filepath]
+  main.main()
+  sys.argv = argv + ["-o", npz_filepath]
+  main.main()
+
+  # the same ratios in both reports
+  report = json.load(open(json_filepath))
+  assert sorted(report["regionRatios"]["perRegion"]) == ["320", "656", "68"]
+  assert json.loads(json.dumps(report_file.loadReport(npz_filepath))) == report
+
+  from_json = region_ratios.loadRegionRatios(json_filepath, dense = True)
+  from_npz = region_ratios.loadRegionRatios(npz_filepath, dense = True)
+  assert sorted(from_npz) == [68, 320, 656]
+
+  for id in from_npz:
+    assert np.allclose(from_json[id], from_npz[id], atol = 1e-6)
+
+  # the arrays of the binary report are memory-mapped
+  assert isinstance(region_ratios.loadRegionRatios(npz_filepath).values, np.memmap)
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_region_ratios()
+  test_cli_region_ratios(pathlib.Path(tempfile.mkdtemp()))
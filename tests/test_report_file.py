@@ -0,0 +1,74 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import main
+from atlas_alignment_meter import multi_axis
+from atlas_alignment_meter import report_file
+import json
+import nrrd
+import numpy as np
+import sys
+
+def test_report_file(tmp_path):
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  report_filepath = str(tmp_path / "report.npz")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  ratios_per_region = {}
+  timings = {}
+  metrics = core.compute(volume_data, regions = regions, engine = "singlepass", ratios_per_region = ratios_per_region, timings = timings)
+  metrics["timings"] = timings
+  report_file.saveReport(metrics, report_filepath, ratios_per_region)
+
+  # the columns are memory-mapped
+  arrays = report_file.openReport(report_filepath)
+  assert arrays["regionIds"].tolist() == sorted(regions)
+  assert isinstance(arrays["perRegion.median"], np.memmap)
+  assert arrays["ratios"].shape == (len(regions), volume_data.shape[0])
+
+  loaded_ratios = {}
+  loaded_metrics = report_file.loadReport(report_filepath, loaded_ratios)
+  assert loaded_metrics["perRegion"] == metrics["perRegion"]
+  assert loaded_metrics["perSlice"] == metrics["perSlice"]
+  assert loaded_metrics["global"] == metrics["global"]
+  assert sorted(loaded_metrics["timings"]["phases"]) == sorted(metrics["timings"]["phases"])
+
+  for id in regions:
+    assert np.array_equal(loaded_ratios[id], ratios_per_region[id])
+
+
+def test_report_file_all_axes(tmp_path):
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  report_filepath = str(tmp_path / "report.npz")
+
+  metrics = multi_axis.computeAllAxes(volume_data, regions = [68, 656], engine = "singlepass")
+  report_file.saveReport(metrics, report_filepath)
+  loaded_metrics = report_file.loadReport(report_filepath)
+
+  for axis in multi_axis.AXES:
+    assert loaded_metrics["perAxis"][axis]["perRegion"] == metrics["perAxis"][axis]["perRegion"]
+    assert loaded_metrics["perAxis"][axis]["perSlice"] == metrics["perAxis"][axis]["perSlice"]
+
+
+def test_cli_report_file(tmp_path):
+  json_filepath = str(tmp_path / "report.json")
+  npz_filepath = str(tmp_path / "report.npz")
+  argv = ["atlas-alignment-meter", "-i", "./test_data/annotation_25_ccfv3.nrrd", "-r", "68,656,320", "-e", "SINGLEPASS", "--label-index", "OFF"]
+
+  sys.argv = argv + ["-o", json_filepath]
+  main.main()
+  sys.argv = argv + ["-o", npz_filepath, "--report-ratios"]
+  main.main()
+
+  # the same report as the JSON one, once serialized
+  report = json.load(open(json_filepath))
+  assert json.loads(json.dumps(report_file.loadReport(npz_filepath))) == report
+  assert report_file.openReport(npz_filepath)["ratios"].shape[0] == 3
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_report_file(pathlib.Path(tempfile.mkdtemp()))
+  test_report_file_all_axes(pathlib.Path(tempfile.mkdtemp()))
+  test_cli_report_file(pathlib.Path(tempfile.mkdtemp()))
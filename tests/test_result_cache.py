@@ -0,0 +1,94 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import main
+from atlas_alignment_meter import result_cache
+import json
+import nrrd
+import numpy as np
+import os
+import sys
+
+def test_result_cache(tmp_path):
+  cache_dir = str(tmp_path / "cache")
+  key = result_cache.cacheKey("some_hash", 0)
+  assert key != result_cache.cacheKey("some_hash", 1)
+  assert result_cache.loadRatios(cache_dir, key) == {}
+
+  result_cache.saveRatios(cache_dir, key, {1: np.arange(5.0), 2: np.ones(5)})
+  result_cache.saveRatios(cache_dir, key, {3: np.zeros(5)})
+
+  # the regions of both runs are cached
+  ratios_per_region = result_cache.loadRatios(cache_dir, key)
+  assert sorted(ratios_per_region) == [1, 2, 3]
+  assert np.array_equal(ratios_per_region[1], np.arange(5.0))
+
+
+def test_result_cache_eviction(tmp_path):
+  cache_dir = str(tmp_path / "cache")
+  keys = [result_cache.cacheKey(f"hash_{i}", 0) for i in range(3)]
+  filepaths = [os.path.join(cache_dir, f"{key}.ratios.npz") for key in keys]
+
+  # entries used one after the other
+  for i, key in enumerate(keys):
+    result_cache.saveRatios(cache_dir, key, {1: np.ones(1000)})
+    os.utime(filepaths[i], ns = (i, i))
+
+  # the first entry is used again, so the second one is now the least recently used
+  assert len(result_cache.loadRatios(cache_dir, keys[0])) == 1
+
+  entry_size = os.path.getsize(filepaths[0])
+  assert result_cache.evictEntries(cache_dir, 2 * entry_size) == [filepaths[1]]
+  assert result_cache.loadRatios(cache_dir, keys[1]) == {}
+  assert len(result_cache.loadRatios(cache_dir, keys[0])) == 1
+
+
+def test_compute_cached_ratios():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics = core.compute(volume_data, regions = regions)
+
+  # some of the regions are computed first, the others are then computed with them
+  ratios_per_region = {}
+  core.compute(volume_data, regions = regions[:4], ratios_per_region = ratios_per_region)
+  assert sorted(ratios_per_region) == sorted(regions[:4])
+
+  for engine in core.ENGINES:
+    cached_ratios = dict(ratios_per_region)
+    timings = {}
+    metrics_cached = core.compute(volume_data, regions = regions, engine = engine, ratios_per_region = cached_ratios, timings = timings)
+    assert timings["nbCachedRegions"] == 4
+    assert sorted(cached_ratios) == sorted(regions)
+    assert metrics_cached["perRegion"] == metrics["perRegion"]
+    assert metrics_cached["perSlice"] == metrics["perSlice"]
+
+
+def test_cli_result_cache(tmp_path):
+  cache_dir = str(tmp_path / "cache")
+  report_filepath = str(tmp_path / "report.json")
+  argv = ["atlas-alignment-meter", "-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", report_filepath, "--label-index", "OFF", "--cache-dir", cache_dir, "--profile"]
+
+  sys.argv = argv + ["-r", "68,656"]
+  main.main()
+  assert json.load(open(report_filepath))["timings"]["nbCachedRegions"] == 0
+
+  # only the new region is computed
+  sys.argv = argv + ["-r", "68,656,320"]
+  main.main()
+  report = json.load(open(report_filepath))
+  assert report["timings"]["nbCachedRegions"] == 2
+  assert sorted(report["timings"]["perRegion"]) == ["320"]
+
+  sys.argv = argv + ["-r", "68,320"]
+  main.main()
+  assert json.load(open(report_filepath))["timings"]["nbCachedRegions"] == 2
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_result_cache(pathlib.Path(tempfile.mkdtemp()))
+  test_result_cache_eviction(pathlib.Path(tempfile.mkdtemp()))
+  test_compute_cached_ratios()
+  test_cli_result_cache(pathlib.Path(tempfile.mkdtemp()))
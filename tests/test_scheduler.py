@@ -0,0 +1,36 @@
+from atlas_alignment_meter import core
+import nrrd
+
+def test_scheduler_timings():
+  # load your volume and all:
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+
+  for backend in ["thread", "process"]:
+    timings = {}
+    core.compute(volume_data, regions = regions, nb_thread = 2, backend = backend, timings = timings)
+
+    # the wall time of each region is recorded
+    assert sorted(timings["perRegion"]) == sorted(regions)
+
+    for region in regions:
+      assert timings["perRegion"][region] >= 0
+
+
+def test_scheduler_more_threads_than_regions():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  timings = {}
+  metrics = core.compute(volume_data, regions = [68, 0], nb_thread = 8, timings = timings)
+
+  # the no_data part is neither computed nor timed
+  assert list(metrics["perRegion"]) == [68]
+  assert list(timings["perRegion"]) == [68]
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_scheduler_timings()
+  test_scheduler_more_threads_than_regions()
@@ -0,0 +1,69 @@
+from atlas_alignment_meter import main
+import contextlib
+import io
+import json
+import pytest
+import subprocess
+import sys
+
+# runs the CLI with the given arguments, then prints the modules that were imported
+SCRIPT = """
+import json
+import sys
+sys.argv = ["atlas-alignment-meter"] + json.loads(sys.argv[1])
+try:
+    from atlas_alignment_meter import main
+    main.main()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted(sys.modules)))
+"""
+
+def importedModules(cli_args):
+  process = subprocess.run([sys.executable, "-c", SCRIPT, json.dumps(cli_args)], capture_output = True, text = True)
+  return process.stdout, json.loads(process.stderr.strip().splitlines()[-1])
+
+
+def test_startup_imports():
+  # nothing heavy is imported to print the help or to reject the arguments
+  for cli_args in [["--help"], ["-i", "missing_volume.nrrd", "-o", "report.json"], ["-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", "report.json", "-r", "LARGEST"], ["batch", "--help"], ["batch", "missing_volume.nrrd", "-o", "reports"]]:
+    output, modules = importedModules(cli_args)
+    for module in ["numpy", "nrrd", "pkg_resources", "atlas_alignment_meter.core", "atlas_alignment_meter.export_volume"]:
+      assert module not in modules
+
+  # the batch command is listed in the help
+  output, modules = importedModules(["--help"])
+  assert "batch" in output
+
+  output, modules = importedModules(["--version"])
+  assert output.startswith("atlas-alignment-meter ")
+  assert "numpy" not in modules
+
+
+def test_check_args(tmp_path):
+  argv = ["-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", str(tmp_path / "report.json")]
+  assert main.parse_args(argv + ["-r", "SMALLEST,3", "--max-memory", "16G"]).regions == "SMALLEST,3"
+
+  # MIN and MAX are per-slice metrics only
+  assert main.parse_args(argv + ["-vs", str(tmp_path / "slice.nrrd"), "-vm", "MIN", "MAX"]).out_metric == ["MIN", "MAX"]
+
+  for invalid_args in [["-r", "1,two"], ["-r", "LARGEST,0"], ["--max-memory", "lots"], ["--sample-slices", "2"]]:
+    with pytest.raises(SystemExit):
+      main.parse_args(argv + invalid_args)
+
+  # the error names the option to change
+  error = io.StringIO()
+  with pytest.raises(SystemExit), contextlib.redirect_stderr(error):
+    main.parse_args(argv + ["-vr", str(tmp_path / "region.nrrd"), "-vm", "MEDIAN", "MAX"])
+  assert "--volume-metric MAX is only available with --output-per-slice-volume" in error.getvalue()
+
+  with pytest.raises(SystemExit):
+    main.parse_args(["-i", "./test_data/annotation_25_ccfv3.nrrd", "-o", str(tmp_path / "missing" / "report.json")])
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_startup_imports()
+  test_check_args(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,49 @@
+from atlas_alignment_meter import core
+from atlas_alignment_meter import load_volume
+import nrrd
+import numpy as np
+
+def test_iterate_slabs():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # The slabs must give back the whole volume, along its slowest-varying axis
+  slabs = list(load_volume.iterateSlabs("./test_data/annotation_25_ccfv3.nrrd", slab_size = 100))
+  assert [start for start, slab in slabs] == list(range(0, volume_data.shape[2], 100))
+  assert np.array_equal(np.concatenate([slab for start, slab in slabs], axis = 2), volume_data)
+
+
+def test_streaming():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+  shape = volume_data.shape
+
+  # a subset of regions located in the cortical plate
+  regions = [68, 656, 320, 1030, 670, 113, 943, 962, 667]
+  metrics = core.compute(volume_data, regions = regions, engine = "singlepass")
+
+  slabs = load_volume.iterateSlabs("./test_data/annotation_25_ccfv3.nrrd", slab_size = 50)
+  metrics_streaming = core.computeFromSlabs(slabs, shape, 2, regions = regions)
+
+  assert metrics_streaming == metrics
+
+
+def test_streaming_along_coronal_axis():
+  volume_data, volume_header = nrrd.read("./test_data/annotation_25_ccfv3.nrrd")
+
+  # a raw copy of a part of the volume, sliced along the slowest-varying axis
+  sub_volume = volume_data[200:300]
+  raw_filepath = "/tmp/annotation_raw.nrrd"
+  nrrd.write(raw_filepath, sub_volume, {"encoding": "raw"})
+  metrics = core.compute(sub_volume, coronal_axis_index = 2, engine = "singlepass")
+
+  # when cut along the coronal axis, the slabs are stitched using the last slice of the previous one
+  slabs = load_volume.iterateSlabs(raw_filepath, slab_size = 7)
+  metrics_streaming = core.computeFromSlabs(slabs, sub_volume.shape, 2, coronal_axis_index = 2)
+
+  assert metrics_streaming == metrics
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  test_iterate_slabs()
+  test_streaming()
+  test_streaming_along_coronal_axis()
@@ -0,0 +1,51 @@
+from atlas_alignment_meter import main
+from atlas_alignment_meter import volume_cache
+import json
+import nrrd
+import numpy as np
+import os
+import shutil
+import sys
+
+def test_volume_cache(tmp_path):
+  volume_filepath = str(tmp_path / "annotation.nrrd")
+  shutil.copyfile("./test_data/annotation_25_ccfv3.nrrd", volume_filepath)
+  volume_data, volume_header = nrrd.read(volume_filepath)
+
+  assert volume_cache.loadVolumeCache(volume_filepath) == (None, None)
+
+  for compression in volume_cache.COMPRESSIONS:
+    volume_cache.saveVolumeCache(volume_data, volume_filepath, compression, nb_thread = 4)
+    data, header = volume_cache.loadVolumeCache(volume_filepath, nb_thread = 4)
+
+    assert isinstance(data, np.memmap) == (compression == "raw")
+    assert data.dtype == volume_data.dtype
+    assert np.array_equal(data, volume_data)
+    assert header["sizes"].tolist() == volume_header["sizes"].tolist()
+    del data
+
+  # the copy is no longer used once the volume changed
+  os.utime(volume_filepath, ns = (0, 0))
+  assert volume_cache.loadVolumeCache(volume_filepath) == (None, None)
+
+
+def test_cli_volume_cache(tmp_path):
+  volume_filepath = str(tmp_path / "annotation.nrrd")
+  shutil.copyfile("./test_data/annotation_25_ccfv3.nrrd", volume_filepath)
+  report_filepaths = [str(tmp_path / "report_0.json"), str(tmp_path / "report_1.json")]
+
+  # the copy is written by the first run and read by the second one
+  for report_filepath in report_filepaths:
+    sys.argv = ["atlas-alignment-meter", "-i", volume_filepath, "-o", report_filepath, "-r", "68,656,320", "-e", "SINGLEPASS", "--label-index", "OFF", "--input-cache", "ZLIB"]
+    main.main()
+    assert os.path.exists(volume_cache.cacheFilepath(volume_filepath))
+
+  assert json.load(open(report_filepaths[0])) == json.load(open(report_filepaths[1]))
+
+
+# to reun the test manually
+if __name__ == "__main__":
+  import pathlib
+  import tempfile
+  test_volume_cache(pathlib.Path(tempfile.mkdtemp()))
+  test_cli_volume_cache(pathlib.Path(tempfile.mkdtemp()))